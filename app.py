@@ -9,7 +9,14 @@ from pathlib import Path
 import base64
 from cryptography.fernet import Fernet
 
+from modules.app_logging import LEVELS, get_logger, ring_buffer, setup_logging
+from modules.app_paths import APP_DIR
 from modules.email_gmail import GmailClient
+from modules.attachment_store import AttachmentStore
+from modules.cancel_token import CancelToken
+from modules.mail_archive import MailArchive
+from modules.mail_cache import MailCache
+from modules.search_query import parse_day
 from modules.llm_status import get_monitor as get_llm_monitor
 from modules.llm_analyzer import LLMAnalyzer
 from modules.html_exporter import HTMLExporter
@@ -19,8 +26,10 @@ from modules.plugin_manager import PluginManager
 # Configurações salvas em memória (priorizadas)
 _CONFIG_CACHE = None
 
+log = get_logger('APP')
+
 # Apenas se usuário quiser persistir, salva em pasta do sistema
-CONFIG_DIR = os.path.join(os.environ.get('PROGRAMDATA', 'C:\\ProgramData'), 'SimpleNFE')
+CONFIG_DIR = APP_DIR
 CONFIG_PATH = os.path.join(CONFIG_DIR, '.config')
 
 
@@ -85,7 +94,11 @@ def load_config():
             "server": "imap.gmail.com",
             "port": 993,
             "address": "",
-            "app_password": ""
+            "app_password": "",
+            "pool_size": 4,
+            "engine": "imaplib",
+            "liveness_window": 60,
+            "timeout": 30
         },
         "lmstudio": {
             "url": "http://127.0.0.1:1234",
@@ -93,7 +106,17 @@ def load_config():
         },
         "search": {
             "include_keywords": ["nfe", "nf-e", "nota", "xml", "danfe", "fiscal", "fatura", "invoice", "eletronica", "nfce", "cupom"],
-            "exclude_keywords": ["promo", "oferta", "newsletter"]
+            "exclude_keywords": ["promo", "oferta", "newsletter"],
+            "server_filter": True,
+            "mark_processed": False,
+            "prioritize_senders": True,
+            "skip_negative_senders": False,
+            "cache": True,
+            "attachment_store": True
+        },
+        "log": {
+            "level": "INFO",
+            "buffer": 2000
         }
     }
     
@@ -170,8 +193,15 @@ class SimpleNFEApp:
         self.root.minsize(900, 600)
 
         self.cfg = load_config()
+        # Logs no console + buffer em memória exibido em Configurações > Ver logs
+        setup_logging(self.cfg.get('log', {}).get('level', 'INFO'), self.cfg.get('log', {}).get('buffer', 2000))
         self.gmail: GmailClient | None = None
+        self.mail_cache: MailCache | None = None
+        self.attachment_store: AttachmentStore | None = None
+        # Arquivo offline (.mbox/Maildir/.eml) aberto: substitui o Gmail em listagem, busca e download
+        self.mail_archive: MailArchive | None = None
         self._item_uid: dict[str, str] = {}
+        self._listed_qty = 0  # quantidade da última listagem da aba Conexão
         self.search_results = []  # resultados de notas encontradas
         self.extracted_items = []  # itens extraídos
         
@@ -184,6 +214,9 @@ class SimpleNFEApp:
         self._cancel_search = False
         self._cancel_extraction = False
         self._cancel_local_analysis = False
+        # Tokens das operações de email: o cancelamento também interrompe o comando IMAP em andamento
+        self._search_token = CancelToken()
+        self._extract_token = CancelToken()
         
         # Arquivos locais selecionados
         self.local_files = []
@@ -285,12 +318,42 @@ class SimpleNFEApp:
         self.search_qty_var = tk.IntVar(value=50)
         ttk.Entry(controls, textvariable=self.search_qty_var, width=6).pack(side=tk.LEFT, padx=6)
 
+        # Pré-filtro das palavras-chave via IMAP SEARCH (o filtro local continua valendo)
+        self.server_filter_var = tk.BooleanVar(value=self.cfg.get('search', {}).get('server_filter', True))
+        ttk.Checkbutton(controls, text="Filtrar no servidor", variable=self.server_filter_var).pack(side=tk.LEFT, padx=6)
+        # Marca no servidor os emails já extraídos e os deixa de fora das próximas buscas
+        self.mark_processed_var = tk.BooleanVar(value=self.cfg.get('search', {}).get('mark_processed', False))
+        ttk.Checkbutton(controls, text="Pular já processados", variable=self.mark_processed_var).pack(side=tk.LEFT, padx=6)
+
         self.btn_search = ttk.Button(controls, text="Buscar", command=self.on_search_notes)
         self.btn_search.pack(side=tk.LEFT, padx=8)
         
         self.btn_cancel_search = ttk.Button(controls, text="Cancelar", command=self._cancel_search_operation, state=tk.DISABLED)
         self.btn_cancel_search.pack(side=tk.LEFT, padx=8)
 
+        # Condições de parada: quantidade de anexos aceitos e período (data de recebimento)
+        limits = ttk.Frame(self.tab_search)
+        limits.pack(fill=tk.X, padx=16, pady=(0, 8))
+        ttk.Label(limits, text="Parar após (anexos, 0 = sem limite):").pack(side=tk.LEFT)
+        self.max_results_var = tk.IntVar(value=0)
+        ttk.Entry(limits, textvariable=self.max_results_var, width=6).pack(side=tk.LEFT, padx=6)
+        ttk.Label(limits, text="Desde (dd/mm/aaaa):").pack(side=tk.LEFT, padx=(16, 0))
+        self.since_var = tk.StringVar(value="")
+        ttk.Entry(limits, textvariable=self.since_var, width=12).pack(side=tk.LEFT, padx=6)
+        ttk.Label(limits, text="Antes de:").pack(side=tk.LEFT, padx=(8, 0))
+        self.before_var = tk.StringVar(value="")
+        ttk.Entry(limits, textvariable=self.before_var, width=12).pack(side=tk.LEFT, padx=6)
+
+        # Fonte dos emails: Gmail ou arquivo offline (Google Takeout .mbox, Maildir, .eml)
+        source = ttk.Frame(self.tab_search)
+        source.pack(fill=tk.X, padx=16, pady=(0, 8))
+        ttk.Label(source, text="Fonte:").pack(side=tk.LEFT)
+        self.source_var = tk.StringVar(value="Gmail")
+        ttk.Label(source, textvariable=self.source_var).pack(side=tk.LEFT, padx=6)
+        ttk.Button(source, text="Abrir .mbox/.eml", command=self._open_archive_file).pack(side=tk.LEFT, padx=(16, 0))
+        ttk.Button(source, text="Abrir pasta (Maildir)", command=self._open_archive_folder).pack(side=tk.LEFT, padx=8)
+        ttk.Button(source, text="Usar Gmail", command=self._close_archive).pack(side=tk.LEFT)
+
         # Progress
         prog_frame = ttk.Frame(self.tab_search)
         prog_frame.pack(fill=tk.X, padx=16)
@@ -348,6 +411,13 @@ class SimpleNFEApp:
         self.btn_toggle_pwd = ttk.Button(pwd_frame, text="👁️ Mostrar", width=10, command=self._toggle_password_visibility)
         self.btn_toggle_pwd.pack(side=tk.LEFT, padx=6)
 
+        # Conexões IMAP simultâneas usadas em buscas e downloads
+        pool_frame = ttk.Frame(form)
+        pool_frame.grid(row=2, column=3, sticky=tk.W)
+        ttk.Label(pool_frame, text="Conexões:").pack(side=tk.LEFT)
+        self.cfg_pool_size = tk.IntVar(value=self.cfg['email'].get('pool_size', 4))
+        ttk.Spinbox(pool_frame, from_=1, to=10, textvariable=self.cfg_pool_size, width=4).pack(side=tk.LEFT, padx=4)
+
         # Keywords
         ttk.Label(form, text="Palavras-chave (incluir):").grid(row=3, column=0, sticky=tk.W, pady=8)
         self.cfg_include = tk.StringVar(value=", ".join(self.cfg['search']['include_keywords']))
@@ -376,6 +446,14 @@ class SimpleNFEApp:
         ).grid(row=7, column=0, columnspan=4, sticky=tk.W, pady=8)
         ttk.Label(form, text="(Desmarcado = apenas na memória RAM, perde ao fechar)", font=('Segoe UI', 8)).grid(row=8, column=0, columnspan=4, sticky=tk.W)
 
+        # Logs
+        log_frame = ttk.Frame(form)
+        log_frame.grid(row=9, column=1, columnspan=3, sticky=tk.W, pady=(16, 0))
+        ttk.Label(log_frame, text="Nível de log:").pack(side=tk.LEFT)
+        self.cfg_log_level = tk.StringVar(value=self.cfg.get('log', {}).get('level', 'INFO'))
+        ttk.Combobox(log_frame, textvariable=self.cfg_log_level, values=LEVELS, state='readonly', width=10).pack(side=tk.LEFT, padx=4)
+        ttk.Button(log_frame, text="Ver logs", command=self._show_log_window).pack(side=tk.LEFT, padx=6)
+
         # Save button
         ttk.Button(form, text="Salvar Configurações", command=self.on_save_config).grid(row=9, column=0, pady=(16, 0))
 
@@ -400,15 +478,90 @@ class SimpleNFEApp:
             self.show_password_var.set(True)
     
     def _get_client(self) -> GmailClient:
+        if self.mail_archive is not None:
+            return self.mail_archive
+        if self.gmail is None and self.cfg['email'].get('engine') == 'asyncio':
+            # Motor asyncio: poucos sockets com comandos em pipeline, mesma API síncrona
+            from modules.email_async import AsyncBackedGmailClient
+            self.gmail = AsyncBackedGmailClient(
+                self.cfg['email']['server'],
+                int(self.cfg['email']['port']),
+                self.cfg['email']['address'],
+                self.cfg['email']['app_password'],
+                connections=max(1, int(self.cfg['email'].get('pool_size', 4)) // 2),
+                timeout=float(self.cfg['email'].get('timeout', 30)) or None,
+                store=self._get_attachment_store(),
+            )
         if self.gmail is None:
             self.gmail = GmailClient(
                 self.cfg['email']['server'],
                 int(self.cfg['email']['port']),
                 self.cfg['email']['address'],
                 self.cfg['email']['app_password'],
+                pool_size=int(self.cfg['email'].get('pool_size', 4)),
+                liveness_window=float(self.cfg['email'].get('liveness_window', 60)),
+                timeout=float(self.cfg['email'].get('timeout', 30)) or None,
+                cache=self._get_mail_cache(),
+                store=self._get_attachment_store(),
             )
         return self.gmail
 
+    def _open_archive_file(self):
+        path = filedialog.askopenfilename(
+            title="Abrir arquivo de emails",
+            filetypes=[("Arquivos de email", "*.mbox *.mbx *.eml"), ("Todos os arquivos", "*.*")]
+        )
+        if path:
+            self._open_archive(path)
+
+    def _open_archive_folder(self):
+        path = filedialog.askdirectory(title="Abrir pasta Maildir (ou com arquivos .mbox/.eml)")
+        if path:
+            self._open_archive(path)
+
+    def _open_archive(self, path: str):
+        if self._email_operation_running:
+            messagebox.showinfo("Aguarde", "Há uma operação de email em andamento.")
+            return
+        try:
+            archive = MailArchive(path, store=self._get_attachment_store())
+        except (OSError, ValueError) as e:
+            messagebox.showerror("Erro", f"Não foi possível abrir {path}:\n{e}")
+            return
+        self._close_archive()
+        self.mail_archive = archive
+        total = archive.count_inbox()
+        self.source_var.set(f"{os.path.basename(path) or path} ({total} emails)")
+        self.total_label_var.set(f"Total no arquivo: {total}")
+        self.status_var.set(f"Arquivo aberto: {path} ({total} emails)")
+
+    def _close_archive(self):
+        """Volta a usar o Gmail como fonte dos emails."""
+        if self._email_operation_running:
+            return
+        if self.mail_archive is not None:
+            self.mail_archive.close()
+            self.mail_archive = None
+        self.source_var.set("Gmail")
+
+    def _get_mail_cache(self) -> MailCache | None:
+        """Cache local de cabeçalhos/anexos já examinados (search.cache)."""
+        if self.mail_cache is None and self.cfg.get('search', {}).get('cache', True):
+            try:
+                self.mail_cache = MailCache()
+            except Exception as e:
+                log.warning("Cache local indisponível: %s", e)
+        return self.mail_cache
+
+    def _get_attachment_store(self) -> AttachmentStore | None:
+        """Repositório de anexos por SHA-256 (search.attachment_store), compartilhado com a CLI."""
+        if self.attachment_store is None and self.cfg.get('search', {}).get('attachment_store', True):
+            try:
+                self.attachment_store = AttachmentStore()
+            except Exception as e:
+                log.warning("Repositório de anexos indisponível: %s", e)
+        return self.attachment_store
+
     def on_connect_and_list(self):
         # Verifica se já há operação de email em andamento
         if self._email_operation_running:
@@ -417,7 +570,8 @@ class SimpleNFEApp:
             
         qty = max(1, int(self.conn_qty_var.get() or 10))
         self.status_var.set("Conectando e listando...")
-        self.conn_tree.delete(*self.conn_tree.get_children())
+        # estado da lista lido aqui: widgets do Tkinter só podem ser usados na thread principal
+        already_listed = self._listed_qty == qty and bool(self.conn_tree.get_children())
 
         def on_item_loaded(item: dict):
             """Callback progressivo: adiciona item à UI conforme é processado"""
@@ -431,10 +585,17 @@ class SimpleNFEApp:
             self._email_operation_running = True
             try:
                 client = self._get_client()
-                total = client.count_inbox()
+                # Um STATUS diz se algo mudou desde a última listagem
+                sync = client.sync_mailbox()
+                total = sync['messages']
                 self.root.after(0, lambda: self.total_label_var.set(f"Total na INBOX: {total}"))
+                if not sync['changed'] and already_listed:
+                    self.root.after(0, lambda: self.status_var.set(f"Nenhuma alteração na INBOX ({total} emails)"))
+                    return
+                self.root.after(0, lambda: self.conn_tree.delete(*self.conn_tree.get_children()))
                 # Carregamento progressivo com callback
                 recent = client.list_recent(qty, result_callback=on_item_loaded)
+                self._listed_qty = qty
                 self.root.after(0, lambda: self.status_var.set(f"Listados {len(recent)} emails (de {total})"))
             except Exception as e:
                 error_msg = str(e)
@@ -468,12 +629,24 @@ class SimpleNFEApp:
         # Usar keywords das configurações
         include = self.cfg.get('search', {}).get('include_keywords', [])
         exclude = self.cfg.get('search', {}).get('exclude_keywords', [])
+        server_filter = bool(self.server_filter_var.get())
+        self.cfg.setdefault('search', {})['server_filter'] = server_filter
+        skip_processed = bool(self.mark_processed_var.get())
+        self.cfg['search']['mark_processed'] = skip_processed
+        try:
+            max_results = max(0, int(self.max_results_var.get() or 0))
+            since = parse_day(self.since_var.get())
+            before = parse_day(self.before_var.get())
+        except (ValueError, tk.TclError) as e:
+            messagebox.showwarning("Busca", str(e))
+            return
 
         self.results_tree.delete(*self.results_tree.get_children())
         self.progress['value'] = 0
         self.status_var.set("Buscando notas...")
         self.search_status_var.set("Iniciando busca...")
         self._cancel_search = False
+        self._search_token = CancelToken()
         try:
             self.btn_search.configure(state=tk.DISABLED)
             self.btn_cancel_search.configure(state=tk.NORMAL)
@@ -500,18 +673,21 @@ class SimpleNFEApp:
             self._email_operation_running = True
             try:
                 client = self._get_client()
-                # Debug: mostra o que está buscando
-                print(f"\n[BUSCA] Tipos: {note_types}")
-                print(f"[BUSCA] Quantidade: {qty}")
-                print(f"[BUSCA] Incluir keywords: {include}")
-                print(f"[BUSCA] Excluir keywords: {exclude}")
+                log.debug("Busca: tipos=%s quantidade=%s incluir=%s excluir=%s", note_types, qty, include, exclude)
                 # Carregamento progressivo com callback
-                # Passa lambda para verificar cancelamento
+                # Passa o token de cancelamento (consultado e capaz de interromper o IMAP)
                 results = client.search_notes(
                     note_types, qty, include, exclude, 
                     progress_cb, 
                     result_callback=on_result_found,
-                    cancel_check=lambda: self._cancel_search
+                    cancel_check=self._search_token,
+                    server_filter=server_filter,
+                    skip_processed=skip_processed,
+                    prioritize_senders=self.cfg['search'].get('prioritize_senders', True),
+                    skip_negative_senders=self.cfg['search'].get('skip_negative_senders', False),
+                    max_results=max_results,
+                    since=since,
+                    before=before
                 )
                 
                 if self._cancel_search:
@@ -559,6 +735,7 @@ class SimpleNFEApp:
     def _cancel_search_operation(self):
         """Cancela a operação de busca em andamento"""
         self._cancel_search = True
+        self._search_token.cancel()
         self.search_status_var.set("Cancelando busca...")
         self.status_var.set("Busca cancelada pelo usuário")
 
@@ -651,6 +828,7 @@ class SimpleNFEApp:
         self._set_extract_progress(0)
         self._set_extract_status("Preparando extração...")
         self._cancel_extraction = False
+        self._extract_token = CancelToken()
         try:
             self.extract_progress.configure(mode='determinate', maximum=100)
         except Exception:
@@ -695,11 +873,22 @@ class SimpleNFEApp:
                     self._set_extract_status(f"Baixando anexos... {d}/{t}")
                     self._set_extract_progress(pct)
                 self._set_extract_status("Baixando anexos...")
-                downloaded = client.download_attachments(selections, temp_dir, progress_cb=dl_cb)
+                downloaded = client.download_attachments(selections, temp_dir, progress_cb=dl_cb,
+                                                     cancel_check=self._extract_token)
 
                 all_items = []
                 seen = set()
+                seen_blobs = set()  # conteúdo (sha256) já processado nesta extração
+                store = self._get_attachment_store()
+                model = self.cfg.get('lmstudio', {}).get('model', 'openai/gpt-oss-20b')
                 total_att = len(downloaded)
+                # emails com todos os anexos selecionados baixados e extraídos sem erro podem ser
+                # marcados como processados; anexo que não baixou mantém o contador acima de zero
+                pending_by_uid = {}
+                for sel in selections:
+                    pending_by_uid[str(sel.get('uid'))] = pending_by_uid.get(str(sel.get('uid')), 0) + 1
+                failed_uids = set()
+                failed_blobs = set()  # conteúdos cuja extração falhou nesta execução
                 for idx, att in enumerate(downloaded, start=1):
                     # Verifica cancelamento
                     if self._cancel_extraction:
@@ -709,10 +898,31 @@ class SimpleNFEApp:
                     
                     path = att['path']
                     fname = os.path.basename(path)
+                    att_uid = str(att.get('uid'))
                     try:
-                        if att.get('type') == 'XML' or path.lower().endswith('.xml'):
+                        is_xml = att.get('type') == 'XML' or path.lower().endswith('.xml')
+                        # mesmo conteúdo já extraído (aqui ou em execuções anteriores) não é reprocessado
+                        digest = att.get('sha256')
+                        kind = 'xml' if is_xml else f"pdf:{model}"
+                        cached = store.get_extraction(digest, kind) if store else None
+                        cacheable = cached is None
+                        failed = False
+                        if digest and digest in seen_blobs:
+                            log.info("%s: conteúdo idêntico a um anexo já processado; ignorado", fname)
+                            items = []
+                            cacheable = False
+                            failed = digest in failed_blobs
+                        elif cached is not None:
+                            self._set_extract_status(f"Extração reaproveitada: {fname}")
+                            items = cached
+                        elif is_xml:
                             self._set_extract_status(f"Extraindo XML: {fname}")
                             items = extract_items_from_xml(path)
+                            if items is None:
+                                self._set_extract_status(f"XML inválido: {fname}")
+                                items = []
+                                cacheable = False
+                                failed = True
                         else:
                             self._set_extract_status(f"Extraindo PDF via LM: {fname} (aguarde)")
                             # modo indeterminado enquanto aguarda LM
@@ -721,36 +931,48 @@ class SimpleNFEApp:
                             except Exception:
                                 pass
                             text = extract_text_from_pdf(path)
-                            print(f"\n[APP] Texto extraído do PDF {fname}: {len(text) if text else 0} caracteres")
-                            print(f"[APP] Primeiros 500 chars: {text[:500] if text else 'VAZIO'}")
+                            log.debug("Texto extraído do PDF %s: %d caracteres", fname, len(text or ''))
+                            log.debug("Primeiros 500 chars: %.500s", text or 'VAZIO')
                             
                             if not text or len(text.strip()) < 50:
                                 self._set_extract_status(f"PDF vazio ou com pouco texto: {fname}")
-                                print(f"[APP] PDF {fname} rejeitado: texto insuficiente")
+                                log.info("PDF %s rejeitado: texto insuficiente", fname)
                                 items = []
+                                # falha não vai para o cache: senão a próxima execução a trataria como sucesso
+                                cacheable = False
+                                failed = True
                             else:
-                                print(f"[APP] Enviando para LM Studio...")
-                                print(f"[APP] URL: {self.cfg.get('lmstudio', {}).get('url', 'http://127.0.0.1:1234')}")
-                                print(f"[APP] Modelo: {self.cfg.get('lmstudio', {}).get('model', 'openai/gpt-oss-20b')}")
+                                log.debug("Enviando %s para LM Studio (%s, modelo %s)", fname,
+                                          self.cfg.get('lmstudio', {}).get('url', 'http://127.0.0.1:1234'), model)
                                 try:
                                     items = extract_items_from_pdf_via_llm(
                                         text,
                                         self.cfg.get('lmstudio', {}).get('url', 'http://127.0.0.1:1234'),
                                         self.cfg.get('lmstudio', {}).get('model', 'openai/gpt-oss-20b')
                                     )
-                                    print(f"[APP] LM Studio retornou {len(items)} itens")
+                                    log.info("LM Studio retornou %d itens para %s", len(items), fname)
                                 except Exception as e:
                                     error_msg = f"Erro ao extrair PDF {fname}: {str(e)}"
-                                    print(f"[APP] {error_msg}")
+                                    log.error(error_msg)
                                     self._set_extract_status(error_msg)
                                     items = []
+                                    cacheable = False
+                                    failed = True
                             # volta ao modo determinate e avança proporção
                             try:
                                 self.root.after(0, lambda: (self.extract_progress.stop(), self.extract_progress.configure(mode='determinate')))
                             except Exception:
                                 pass
                         
-                        print(f"[APP] Total de itens antes da dedup: {len(items)}")
+                        if failed:
+                            failed_uids.add(att_uid)
+                        if digest:
+                            seen_blobs.add(digest)
+                            if failed:
+                                failed_blobs.add(digest)
+                            if store and cacheable:
+                                store.put_extraction(digest, kind, items)
+                        log.debug("Total de itens antes da dedup: %d", len(items))
                         for it in items:
                             it['documento'] = fname
                             # evita itens duplicados idênticos
@@ -765,13 +987,23 @@ class SimpleNFEApp:
                                 continue
                             seen.add(key)
                             all_items.append(it)
+                        pending_by_uid[att_uid] -= 1
                     except Exception as e:
                         self._set_extract_status(f"Erro ao processar {fname}: {str(e)}")
+                        failed_uids.add(att_uid)
                     
                     # avança progresso geral por anexo
                     pct = int((idx / max(1, total_att)) * 100)
                     self._set_extract_progress(pct)
 
+                if self.mark_processed_var.get():
+                    done_uids = [u for u, n in pending_by_uid.items() if n <= 0 and u not in failed_uids]
+                    if done_uids:
+                        self._set_extract_status("Marcando emails processados no servidor...")
+                        try:
+                            client.mark_processed(done_uids)
+                        except Exception as e:
+                            log.warning("Falha ao marcar emails processados: %s", e)
                 self.extracted_items = all_items
                 self._refresh_items_tab()
                 self._set_extract_progress(100)
@@ -801,6 +1033,7 @@ class SimpleNFEApp:
     def _cancel_extraction_operation(self):
         """Cancela a operação de extração em andamento"""
         self._cancel_extraction = True
+        self._extract_token.cancel()
         self._set_extract_status("Cancelando extração...")
         self.status_var.set("Extração cancelada pelo usuário")
 
@@ -983,38 +1216,38 @@ class SimpleNFEApp:
 
                     try:
                         if fpath.lower().endswith('.xml'):
-                            items = extract_items_from_xml(fpath)
+                            items = extract_items_from_xml(fpath) or []
                         else:  # PDF
                             self.root.after(0, lambda: self.local_progress.configure(mode='indeterminate'))
                             self.root.after(0, lambda: self.local_progress.start(10))
                             
                             text = extract_text_from_pdf(fpath)
-                            print(f"\n[LOCAL] Texto extraído de {fname}: {len(text) if text else 0} caracteres")
+                            log.debug("Texto extraído de %s: %d caracteres", fname, len(text or ''))
                             
                             if not text or len(text.strip()) < 50:
-                                print(f"[LOCAL] PDF {fname} rejeitado: texto insuficiente (provavelmente imagem escaneada)")
+                                log.info("PDF %s rejeitado: texto insuficiente (provavelmente imagem escaneada)", fname)
                                 skipped_pdfs.append(fname)
                                 self.root.after(0, lambda f=fname: self.local_status_var.set(f"⚠️ PDF escaneado (sem texto): {f}"))
                                 items = []
                             else:
-                                print(f"[LOCAL] Enviando para LM Studio...")
+                                log.debug("Enviando %s para LM Studio...", fname)
                                 try:
                                     items = extract_items_from_pdf_via_llm(
                                         text,
                                         self.cfg.get('lmstudio', {}).get('url', 'http://127.0.0.1:1234'),
                                         self.cfg.get('lmstudio', {}).get('model', 'openai/gpt-oss-20b')
                                     )
-                                    print(f"[LOCAL] LM Studio retornou {len(items)} itens")
+                                    log.info("LM Studio retornou %d itens para %s", len(items), fname)
                                 except Exception as e:
                                     error_msg = f"Erro ao extrair PDF {fname}: {str(e)}"
-                                    print(f"[LOCAL] {error_msg}")
+                                    log.error(error_msg)
                                     self.root.after(0, lambda msg=error_msg: self.local_status_var.set(msg))
                                     items = []
                             
                             self.root.after(0, lambda: self.local_progress.stop())
                             self.root.after(0, lambda: self.local_progress.configure(mode='determinate'))
 
-                        print(f"[LOCAL] Total de itens extraídos: {len(items)}")
+                        log.debug("Total de itens extraídos: %d", len(items))
                         for it in items:
                             it['documento'] = fname
                             # deduplicação
@@ -1031,7 +1264,7 @@ class SimpleNFEApp:
                             all_items.append(it)
                     except Exception as e:
                         error_msg = f"Erro ao processar {fname}: {str(e)}"
-                        print(f"[LOCAL] {error_msg}")
+                        log.error(error_msg)
                         self.root.after(0, lambda msg=error_msg: self.local_status_var.set(msg))
 
                     # Atualiza progresso
@@ -1272,6 +1505,42 @@ class SimpleNFEApp:
                 error_msg = f"Erro ao abrir visualizador:\n{str(e)}\n{str(e2)}"
                 messagebox.showerror("Erro", error_msg)
 
+    def _show_log_window(self):
+        """Mostra as últimas linhas de log guardadas em memória."""
+        win = tk.Toplevel(self.root)
+        win.title("Logs")
+        win.geometry("900x500")
+
+        body_frame = ttk.Frame(win)
+        body_frame.pack(fill=tk.BOTH, expand=True, padx=12, pady=8)
+        txt = tk.Text(body_frame, wrap='none', font=('Consolas', 9))
+        scroll = ttk.Scrollbar(body_frame, orient=tk.VERTICAL, command=txt.yview)
+        txt.configure(yscrollcommand=scroll.set)
+        scroll.pack(side=tk.RIGHT, fill=tk.Y)
+        txt.pack(fill=tk.BOTH, expand=True)
+
+        def refresh():
+            ring = ring_buffer()
+            lines = ring.lines() if ring else ["(buffer de logs desativado)"]
+            txt.configure(state='normal')
+            txt.delete('1.0', tk.END)
+            txt.insert('1.0', "\n".join(lines))
+            txt.configure(state='disabled')
+            txt.see(tk.END)
+
+        def clear():
+            ring = ring_buffer()
+            if ring:
+                ring.clear()
+            refresh()
+
+        btns = ttk.Frame(win)
+        btns.pack(fill=tk.X, padx=12, pady=(0, 8))
+        ttk.Button(btns, text="Atualizar", command=refresh).pack(side=tk.LEFT)
+        ttk.Button(btns, text="Limpar", command=clear).pack(side=tk.LEFT, padx=6)
+        ttk.Button(btns, text="Fechar", command=win.destroy).pack(side=tk.RIGHT)
+        refresh()
+
     def _show_email_window_fallback(self, data: dict):
         win = tk.Toplevel(self.root)
         win.title("Email")
@@ -1368,6 +1637,10 @@ class SimpleNFEApp:
     def on_save_config(self):
         self.cfg['email']['server'] = self.cfg_server.get().strip() or 'imap.gmail.com'
         self.cfg['email']['port'] = int(self.cfg_port.get() or 993)
+        try:
+            self.cfg['email']['pool_size'] = max(1, min(10, int(self.cfg_pool_size.get())))
+        except (tk.TclError, ValueError):
+            self.cfg['email']['pool_size'] = 4
         self.cfg['email']['address'] = self.cfg_address.get().strip()
         
         # Remove espaços da senha (erro comum)
@@ -1391,6 +1664,11 @@ class SimpleNFEApp:
         self.cfg['lmstudio']['url'] = self.cfg_lm_url.get().strip() or 'http://127.0.0.1:1234'
         self.cfg['lmstudio']['model'] = self.cfg_lm_model.get().strip() or 'openai/gpt-oss-20b'
 
+        # Logs: o novo nível vale imediatamente
+        self.cfg.setdefault('log', {})
+        self.cfg['log']['level'] = self.cfg_log_level.get() or 'INFO'
+        setup_logging(self.cfg['log']['level'], self.cfg['log'].get('buffer', 2000))
+
         persist = self.persist_config_var.get()
         if save_config(self.cfg, persist=persist):
             if persist:
@@ -1398,6 +1676,8 @@ class SimpleNFEApp:
             else:
                 messagebox.showinfo("Configurações", "Configurações salvas apenas na memória (serão perdidas ao fechar)!")
             # reset client
+            if self.gmail is not None:
+                self.gmail.close()
             self.gmail = None
     
     def _init_monitors(self):
@@ -1457,7 +1737,13 @@ class SimpleNFEApp:
                 return
             
             # Inicializa monitor de emails
-            self.email_monitor = EmailMonitor(email, password, check_interval=300)
+            # IDLE na INBOX: o servidor avisa na hora; NOOP a cada 300 s só se não houver IDLE
+            self.email_monitor = EmailMonitor(
+                email, password, check_interval=300,
+                server=self.cfg['email'].get('server', 'imap.gmail.com'),
+                port=int(self.cfg['email'].get('port', 993)),
+                timeout=float(self.cfg['email'].get('timeout', 30)) or None,
+            )
             
             # Callback para quando novos emails chegarem
             def on_new_emails():
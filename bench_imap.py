@@ -0,0 +1,133 @@
+"""
+Benchmark da camada de email sem conta Gmail real.
+
+Sobe o servidor IMAP local de modules/fake_imap.py com uma caixa sintética
+(quantidade de emails, proporção de NF-e, tamanhos dos anexos e latência por
+comando configuráveis) e mede list_recent, search_notes, download_attachments
+e fetch_email: tempo, mensagens/s, bytes trafegados e round trips.
+
+Exemplo:
+    python bench_imap.py --messages 2000 --latency 0.02 --connections 4
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Tuple
+
+from modules.fake_imap import FakeIMAPServer, generate_mailbox
+
+
+def _measure(srv: FakeIMAPServer, name: str, messages: int, fn: Callable[[], object]) -> Tuple[Dict, object]:
+    srv.stats.reset()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    stats = srv.stats.snapshot()
+    row = {
+        'case': name,
+        'seconds': round(elapsed, 3),
+        'messages': messages,
+        'messages_per_s': round(messages / elapsed, 1) if elapsed > 0 else 0.0,
+        'bytes_in': stats['bytes_in'],
+        'bytes_out': stats['bytes_out'],
+        'round_trips': stats['round_trips'],
+        'connections': stats['connections'],
+        'commands': stats['commands'],
+        'result_count': len(result) if hasattr(result, '__len__') else 0,
+    }
+    return row, result
+
+
+def _make_client(args, port: int):
+    if args.engine == 'asyncio':
+        from modules.email_async import AsyncBackedGmailClient
+        return AsyncBackedGmailClient('127.0.0.1', port, 'bench', 'bench',
+                                      connections=max(1, args.connections // 2), use_ssl=False)
+    from modules.email_gmail import GmailClient
+    return GmailClient('127.0.0.1', port, 'bench', 'bench', pool_size=args.connections, use_ssl=False)
+
+
+def run(args) -> List[Dict]:
+    mailbox = generate_mailbox(args.messages, nfe_ratio=args.nfe_ratio, xml_size=args.xml_size,
+                               pdf_size=args.pdf_size, image_size=args.image_size, seed=args.seed)
+    types = [t.strip().upper() for t in args.types.split(',') if t.strip()]
+    include = [s.strip() for s in args.include.split(',') if s.strip()]
+    exclude = [s.strip() for s in args.exclude.split(',') if s.strip()]
+    limit = args.limit or args.messages
+    rows: List[Dict] = []
+    with FakeIMAPServer(mailbox, latency=args.latency, gmail_ext=args.gmail_ext) as srv:
+        for rnd in range(1, args.repeat + 1):
+            # cliente novo a cada rodada: sem conexões aquecidas nem memo de buscas
+            client = _make_client(args, srv.port)
+            out_dir = tempfile.mkdtemp(prefix='simplenfe_bench_')
+            try:
+                row, _ = _measure(srv, 'list_recent', min(args.recent, args.messages),
+                                  lambda: client.list_recent(args.recent))
+                rows.append(row)
+                row, results = _measure(srv, 'search_notes', min(limit, args.messages),
+                                        lambda: client.search_notes(types, limit, include, exclude))
+                rows.append(row)
+                selections = [{'uid': r['uid'], 'filename': r['filename'], 'type': r['type']} for r in results]
+                uids = sorted({s['uid'] for s in selections}, key=int)
+                row, _ = _measure(srv, 'download_attachments', len(uids),
+                                  lambda: client.download_attachments(selections, out_dir))
+                rows.append(row)
+                sample = uids[-args.fetch:] if args.fetch else []
+                row, _ = _measure(srv, 'fetch_email', len(sample),
+                                  lambda: [client.fetch_email(uid) for uid in sample])
+                rows.append(row)
+            finally:
+                client.close()
+                shutil.rmtree(out_dir, ignore_errors=True)
+            for row in rows[-4:]:
+                row['round'] = rnd
+    return rows
+
+
+def _print_table(rows: List[Dict]):
+    print(f"{'rodada':>6}  {'caso':<22}{'tempo (s)':>10}{'msgs':>8}{'msgs/s':>10}"
+          f"{'recebido':>12}{'enviado':>10}{'round trips':>13}")
+    for r in rows:
+        print(f"{r['round']:>6}  {r['case']:<22}{r['seconds']:>10.3f}{r['messages']:>8}{r['messages_per_s']:>10.1f}"
+              f"{r['bytes_out']:>12}{r['bytes_in']:>10}{r['round_trips']:>13}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SimpleNFE - benchmark IMAP contra servidor local sintético')
+    parser.add_argument('--messages', type=int, default=1000, help='Emails na caixa sintética (padrão: 1000)')
+    parser.add_argument('--nfe-ratio', type=float, default=0.3, help='Proporção de emails com NF-e (XML+PDF)')
+    parser.add_argument('--xml-size', type=int, default=8 * 1024, help='Tamanho aproximado de cada XML em bytes')
+    parser.add_argument('--pdf-size', type=int, default=64 * 1024, help='Tamanho aproximado de cada PDF em bytes')
+    parser.add_argument('--image-size', type=int, default=128 * 1024, help='Tamanho das imagens de newsletters em bytes')
+    parser.add_argument('--latency', type=float, default=0.0, help='Atraso por comando IMAP em segundos (simula rede)')
+    parser.add_argument('--seed', type=int, default=42, help='Semente da caixa sintética')
+    parser.add_argument('--gmail-ext', action='store_true', help='Anuncia X-GM-EXT-1 (habilita X-GM-RAW)')
+    parser.add_argument('--engine', choices=['imaplib', 'asyncio'], default='imaplib', help='Motor IMAP medido')
+    parser.add_argument('--connections', type=int, default=4, help='Conexões IMAP simultâneas')
+    parser.add_argument('--types', type=str, default='pdf,xml', help='Tipos de nota buscados')
+    parser.add_argument('--include', type=str, default='nfe,nota', help='Palavras-chave a incluir')
+    parser.add_argument('--exclude', type=str, default='promo', help='Palavras-chave a excluir')
+    parser.add_argument('--limit', type=int, default=0, help='Quantidade de emails na busca (padrão: a caixa toda)')
+    parser.add_argument('--recent', type=int, default=50, help='Emails listados em list_recent')
+    parser.add_argument('--fetch', type=int, default=20, help='Emails abertos com fetch_email')
+    parser.add_argument('--repeat', type=int, default=1, help='Rodadas (cada uma com cliente novo)')
+    parser.add_argument('--json', type=str, default='', help='Salva os resultados em JSON neste arquivo')
+    args = parser.parse_args()
+
+    print(f"Caixa sintética: {args.messages} emails, latência {args.latency * 1000:.0f} ms, "
+          f"motor {args.engine}, {args.connections} conexões")
+    rows = run(args)
+    _print_table(rows)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'params': vars(args), 'results': rows}, f, ensure_ascii=False, indent=2)
+        print(f"Resultados salvos em: {os.path.abspath(args.json)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -13,9 +13,10 @@ OUT_PATH = os.path.join(TEMP_DIR, 'out_items.json')
 
 def load_config() -> Dict:
     default = {
-        "email": {"server": "imap.gmail.com", "port": 993, "address": "", "app_password": ""},
+        "email": {"server": "imap.gmail.com", "port": 993, "address": "", "app_password": "", "pool_size": 4, "engine": "imaplib", "liveness_window": 60, "timeout": 30},
         "lmstudio": {"url": "http://127.0.0.1:1234", "model": "openai/gpt-oss-20b"},
-        "search": {"include_keywords": ["nfe", "nf-e", "nota", "xml", "danfe"], "exclude_keywords": ["promo", "oferta", "newsletter"]},
+        "search": {"include_keywords": ["nfe", "nf-e", "nota", "xml", "danfe"], "exclude_keywords": ["promo", "oferta", "newsletter"], "server_filter": True, "mark_processed": False, "prioritize_senders": True, "skip_negative_senders": False, "cache": True, "attachment_store": True},
+        "log": {"level": "WARNING"},
     }
     try:
         if os.path.exists(CONFIG_PATH):
@@ -33,16 +34,48 @@ def load_config() -> Dict:
     return default
 
 
+def _finish_recording(client, transport, args):
+    """Com --record, encerra as conexões (LOGOUT gravado) e fecha o arquivo da gravação."""
+    if args.record and transport is not None:
+        client.close()
+        transport.close()
+        print(f'Tráfego IMAP gravado em: {args.record}')
+
+
 def main():
     parser = argparse.ArgumentParser(description='SimpleNFE CLI - Busca e extração de notas (sem UI)')
-    parser.add_argument('--limit', type=int, default=20, help='Quantidade de emails para buscar (padrão: 20)')
+    parser.add_argument('--limit', type=int, default=20, help='Quantidade de emails para buscar (padrão: 20; 0 = arquivo inteiro com --archive)')
     parser.add_argument('--types', type=str, default='pdf,xml', help='Tipos de nota: pdf,xml (padrão: ambos)')
     parser.add_argument('--include', type=str, default='', help='Palavras-chave a incluir, separadas por vírgula (sobrescreve config)')
     parser.add_argument('--exclude', type=str, default='', help='Palavras-chave a excluir, separadas por vírgula (sobrescreve config)')
+    parser.add_argument('--max-results', type=int, default=0, help='Para a busca ao encontrar N anexos (padrão: 0 = sem limite)')
+    parser.add_argument('--since', type=str, default='', help='Só emails recebidos a partir desta data (AAAA-MM-DD ou DD/MM/AAAA)')
+    parser.add_argument('--before', type=str, default='', help='Só emails recebidos antes desta data (exclusiva), ex.: fechamento do mês')
+    parser.add_argument('--no-server-filter', action='store_true', help='Não pré-filtra no servidor (palavras de exclusão no IMAP SEARCH, anexos no X-GM-RAW do Gmail)')
+    parser.add_argument('--connections', type=int, default=0, help='Conexões IMAP simultâneas (padrão: email.pool_size da config)')
+    parser.add_argument('--engine', choices=['imaplib', 'asyncio'], default=None, help='Motor IMAP (padrão: email.engine da config)')
+    parser.add_argument('--mark-processed', action='store_true', help='Marca no servidor os emails extraídos ($SimpleNFEDone ou rótulo no Gmail) e os pula nas próximas buscas')
+    parser.add_argument('--no-sender-priority', action='store_true', help='Não examina primeiro os remetentes que já trouxeram notas (histórico do cache local)')
+    parser.add_argument('--skip-negative-senders', action='store_true', help='Pula remetentes que, pelo histórico, nunca trouxeram notas (ex.: newsletters)')
+    parser.add_argument('--no-cache', action='store_true', help='Ignora o cache local de emails já examinados')
+    parser.add_argument('--no-store', action='store_true', help='Não usa o repositório local de anexos (baixa e extrai tudo de novo)')
+    parser.add_argument('--archive', type=str, default='', help='Lê de um arquivo .mbox (Google Takeout), pasta Maildir ou .eml em vez do Gmail')
     parser.add_argument('--output', type=str, default=OUT_PATH, help='Arquivo JSON de saída com os itens extraídos')
+    parser.add_argument('--record', type=str, default='', help='Grava o tráfego IMAP da sessão neste arquivo (.jsonl ou .jsonl.gz), sem credenciais')
+    parser.add_argument('--replay', type=str, default='', help='Reproduz uma gravação feita com --record em vez de conectar ao servidor')
+    parser.add_argument('--replay-timing', type=float, default=0.0, help='Com --replay: 0 = sem espera (padrão), 1 = tempo original do servidor')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default=None, help='Nível dos logs internos (padrão: log.level da config)')
     args = parser.parse_args()
 
+    from modules.search_query import parse_day
+    try:
+        since, before = parse_day(args.since), parse_day(args.before)
+    except ValueError as e:
+        parser.error(str(e))
+
     cfg = load_config()
+    from modules.app_logging import setup_logging
+    setup_logging(args.log_level or cfg.get('log', {}).get('level', 'WARNING'), ring_capacity=0)
     types = [t.strip().upper() for t in args.types.split(',') if t.strip()]
     if not types:
         types = ['PDF', 'XML']
@@ -54,8 +87,40 @@ def main():
 
     os.makedirs(TEMP_DIR, exist_ok=True)
 
-    print('Conectando ao Gmail...')
-    client = GmailClient(cfg['email']['server'], int(cfg['email']['port']), cfg['email']['address'], cfg['email']['app_password'])
+    # gravação/reprodução precisam dos mesmos comandos: sem cache nem repositório de anexos
+    tracing = bool(args.record or args.replay)
+    store = None
+    if not args.no_store and not tracing and cfg['search'].get('attachment_store', True):
+        from modules.attachment_store import AttachmentStore
+        store = AttachmentStore()
+
+    pool_size = args.connections or int(cfg['email'].get('pool_size', 4))
+    transport = None
+    if args.archive:
+        from modules.mail_archive import MailArchive
+        print(f'Abrindo arquivo {args.archive}...')
+        client = MailArchive(args.archive, store=store)
+        if args.limit <= 0:
+            args.limit = client.count_inbox()
+    elif not tracing and (args.engine or cfg['email'].get('engine', 'imaplib')) == 'asyncio':
+        from modules.email_async import AsyncBackedGmailClient
+        print('Conectando ao Gmail...')
+        client = AsyncBackedGmailClient(cfg['email']['server'], int(cfg['email']['port']), cfg['email']['address'], cfg['email']['app_password'], connections=max(1, pool_size // 2), store=store, timeout=float(cfg['email'].get('timeout', 30)) or None)
+    else:
+        if args.replay:
+            from modules.imap_trace import TraceReplay
+            print(f'Reproduzindo gravação {args.replay}...')
+            transport = TraceReplay(args.replay, time_scale=args.replay_timing)
+        else:
+            print('Conectando ao Gmail...')
+            if args.record:
+                from modules.imap_trace import TraceRecorder
+                transport = TraceRecorder(args.record)
+        cache = None
+        if not args.no_cache and not tracing and cfg['search'].get('cache', True):
+            from modules.mail_cache import MailCache
+            cache = MailCache()
+        client = GmailClient(cfg['email']['server'], int(cfg['email']['port']), cfg['email']['address'], cfg['email']['app_password'], pool_size=pool_size, cache=cache, store=store, liveness_window=float(cfg['email'].get('liveness_window', 60)), timeout=float(cfg['email'].get('timeout', 30)) or None, transport=transport)
 
     done = 0
     def prog(d, t):
@@ -64,12 +129,19 @@ def main():
         print(f'Buscando... {d}/{t}', end='\r', flush=True)
 
     print(f'Buscando anexos (tipos: {types}, limite: {args.limit})...')
-    results = client.search_notes(types, int(args.limit), include, exclude, progress_cb=prog)
+    server_filter = not args.no_server_filter and cfg['search'].get('server_filter', True)
+    mark_processed = args.mark_processed or cfg['search'].get('mark_processed', False)
+    results = client.search_notes(types, int(args.limit), include, exclude, progress_cb=prog,
+                                  server_filter=server_filter, skip_processed=mark_processed,
+                                  prioritize_senders=not args.no_sender_priority and cfg['search'].get('prioritize_senders', True),
+                                  skip_negative_senders=args.skip_negative_senders or cfg['search'].get('skip_negative_senders', False),
+                                  max_results=max(0, args.max_results), since=since, before=before)
     print()  # nova linha após progresso
     print(f'Encontrados {len(results)} anexos candidatos.')
 
     if not results:
         print('Nada encontrado com os filtros. Saindo.')
+        _finish_recording(client, transport, args)
         return 0
 
     print('Baixando anexos...')
@@ -85,19 +157,62 @@ def main():
     print(f'Baixados {len(downloaded)} anexos.')
 
     all_items: List[Dict] = []
+    seen_blobs = set()
+    failed_blobs = set()
+    # anexos selecionados ainda não extraídos, por email; anexo que não baixou deixa o email pendente
+    pending_by_uid: Dict[str, int] = {}
+    for sel in selections:
+        pending_by_uid[str(sel['uid'])] = pending_by_uid.get(str(sel['uid']), 0) + 1
+    failed_uids = set()
+    model = cfg.get('lmstudio', {}).get('model', 'openai/gpt-oss-20b')
     for idx, att in enumerate(downloaded, start=1):
         path = att['path']
         name = os.path.basename(path)
-        if att.get('type') == 'XML' or path.lower().endswith('.xml'):
+        att_uid = str(att.get('uid'))
+        is_xml = att.get('type') == 'XML' or path.lower().endswith('.xml')
+        # conteúdo idêntico (sha256) é extraído uma vez só; resultados ficam no repositório
+        digest = att.get('sha256')
+        kind = 'xml' if is_xml else f'pdf:{model}'
+        if digest and digest in seen_blobs:
+            print(f'[{idx}/{len(downloaded)}] Ignorado (conteúdo repetido): {name}')
+            if digest in failed_blobs:
+                failed_uids.add(att_uid)
+            pending_by_uid[att_uid] -= 1
+            continue
+        items = store.get_extraction(digest, kind) if store else None
+        cacheable = items is None
+        if items is not None:
+            print(f'[{idx}/{len(downloaded)}] Extração reaproveitada: {name}')
+        elif is_xml:
             print(f'[{idx}/{len(downloaded)}] Extraindo XML: {name}')
             items = extract_items_from_xml(path)
         else:
             print(f'[{idx}/{len(downloaded)}] Extraindo PDF via LM: {name} (aguarde)')
             text = extract_text_from_pdf(path)
-            items = extract_items_from_pdf_via_llm(text, cfg.get('lmstudio', {}).get('url', 'http://127.0.0.1:1234'), cfg.get('lmstudio', {}).get('model', 'openai/gpt-oss-20b'))
+            items = extract_items_from_pdf_via_llm(text, cfg.get('lmstudio', {}).get('url', 'http://127.0.0.1:1234'), model)
+        if items is None:
+            # falha não vai para o cache nem deixa o email ser marcado como processado
+            print(f'[{idx}/{len(downloaded)}] Falha ao ler: {name}')
+            items = []
+            cacheable = False
+            failed_uids.add(att_uid)
+            if digest:
+                failed_blobs.add(digest)
+        if digest:
+            seen_blobs.add(digest)
+            if store and cacheable:
+                store.put_extraction(digest, kind, items)
         for it in items:
             it['documento'] = name
         all_items.extend(items)
+        pending_by_uid[att_uid] -= 1
+
+    if mark_processed:
+        # só emails com todos os anexos selecionados baixados e extraídos sem erro
+        done_uids = [u for u, n in pending_by_uid.items() if n <= 0 and u not in failed_uids]
+        marked = client.mark_processed(done_uids) if done_uids else 0
+        print(f'{marked} emails marcados como processados no servidor.')
+    _finish_recording(client, transport, args)
 
     with open(args.output, 'w', encoding='utf-8') as f:
         json.dump({'items': all_items}, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,83 @@
+"""Logging do SimpleNFE: um logger por módulo, nível configurável e um buffer
+circular em memória que a interface pode exibir.
+
+Os módulos usam `log = get_logger('GMAIL')` e passam os valores como
+argumentos (log.debug('UID %s: %d anexo(s)', uid, n)); abaixo do nível
+configurado a mensagem nem chega a ser formatada. No console o formato
+continua sendo '[GMAIL] mensagem'.
+"""
+import logging
+import sys
+from collections import deque
+from typing import List, Optional
+
+ROOT_LOGGER = 'simplenfe'
+LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR')
+
+_ring: Optional['RingBufferHandler'] = None
+_console: Optional[logging.Handler] = None
+
+
+class _TagFormatter(logging.Formatter):
+    """'[GMAIL] mensagem' a partir do logger 'simplenfe.GMAIL'."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.tag = record.name.rsplit('.', 1)[-1]
+        return super().format(record)
+
+
+class RingBufferHandler(logging.Handler):
+    """Guarda as últimas `capacity` linhas formatadas para o visualizador da interface."""
+
+    def __init__(self, capacity: int = 2000):
+        super().__init__()
+        self.buffer: deque = deque(maxlen=max(1, int(capacity)))
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            self.buffer.append(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+    def lines(self) -> List[str]:
+        with self.lock:
+            return list(self.buffer)
+
+    def clear(self):
+        with self.lock:
+            self.buffer.clear()
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger do módulo (ex.: 'GMAIL', 'APP', 'PDF')."""
+    return logging.getLogger(f'{ROOT_LOGGER}.{name}')
+
+
+def setup_logging(level: str = 'INFO', ring_capacity: int = 2000, console: bool = True) -> Optional[RingBufferHandler]:
+    """Configura nível e destinos dos logs. Pode ser chamada de novo (ex.: ao
+    salvar as configurações) sem duplicar handlers. ring_capacity=0 desliga o buffer."""
+    global _ring, _console
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(getattr(logging, str(level).upper(), logging.INFO))
+    root.propagate = False
+    formatter = _TagFormatter('%(asctime)s %(levelname)-7s [%(tag)s] %(message)s', '%H:%M:%S')
+    if _console is not None:
+        root.removeHandler(_console)
+        _console = None
+    if console:
+        _console = logging.StreamHandler(sys.stdout)
+        _console.setFormatter(_TagFormatter('[%(tag)s] %(message)s'))
+        root.addHandler(_console)
+    if _ring is not None and (not ring_capacity or _ring.buffer.maxlen != int(ring_capacity)):
+        root.removeHandler(_ring)
+        _ring = None
+    if ring_capacity and _ring is None:
+        _ring = RingBufferHandler(ring_capacity)
+        _ring.setFormatter(formatter)
+        root.addHandler(_ring)
+    return _ring
+
+
+def ring_buffer() -> Optional[RingBufferHandler]:
+    """Buffer em memória configurado por setup_logging, se houver."""
+    return _ring
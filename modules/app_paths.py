@@ -0,0 +1,10 @@
+"""Diretórios de dados do aplicativo, compartilhados pela interface e pela CLI."""
+import os
+
+APP_DIR = os.path.join(os.environ.get('PROGRAMDATA', 'C:\\ProgramData'), 'SimpleNFE')
+
+
+def app_path(*parts: str) -> str:
+    """Caminho dentro do diretório de dados, criando o diretório se necessário."""
+    os.makedirs(APP_DIR, exist_ok=True)
+    return os.path.join(APP_DIR, *parts)
@@ -0,0 +1,144 @@
+"""Repositório local de anexos endereçado por conteúdo (SHA-256).
+
+Cada arquivo baixado é guardado uma única vez em blobs/<2 primeiros>/<hash><ext>,
+e um índice SQLite liga (conta, UIDVALIDITY, UID, nome do anexo) ao hash. Assim
+um anexo já baixado não volta a ser buscado no servidor, anexos iguais
+recebidos em emails diferentes ocupam um só arquivo, e o resultado da extração
+de itens fica guardado por hash, compartilhado entre a interface e a CLI.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+from modules.app_paths import app_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    hash TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS attachments (
+    account TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    uid INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (account, uidvalidity, uid, filename)
+);
+CREATE TABLE IF NOT EXISTS extractions (
+    hash TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (hash, kind)
+);
+"""
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def unique_names(pairs: List[tuple]) -> Dict[tuple, str]:
+    """Nome local para cada (uid, filename) sem colisões: o primeiro fica com o
+    nome original, os seguintes ganham o UID no nome (nota_4512.xml)."""
+    used = set()
+    out: Dict[tuple, str] = {}
+    for uid, fname in pairs:
+        if (uid, fname) in out:
+            continue
+        name = fname
+        if name.lower() in used:
+            stem, ext = os.path.splitext(fname)
+            name = f"{stem}_{uid}{ext}"
+        used.add(name.lower())
+        out[(uid, fname)] = name
+    return out
+
+
+class AttachmentStore:
+    """Blobs por SHA-256 + índice (UID, nome) -> hash + extrações por hash. Thread-safe."""
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or app_path('attachments')
+        os.makedirs(os.path.join(self.root, 'blobs'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def _blob_path(self, digest: str) -> Optional[str]:
+        row = self._db.execute('SELECT path FROM blobs WHERE hash=?', (digest,)).fetchone()
+        if row and os.path.exists(row[0]):
+            return row[0]
+        return None
+
+    def add(self, path: str) -> str:
+        """Guarda uma cópia do arquivo (se o conteúdo ainda não existir) e retorna o hash."""
+        digest = file_sha256(path)
+        with self._lock:
+            if self._blob_path(digest) is None:
+                ext = os.path.splitext(path)[1].lower()
+                blob = os.path.join(self.root, 'blobs', digest[:2], digest + ext)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                shutil.copyfile(path, blob + '.tmp')
+                os.replace(blob + '.tmp', blob)
+                self._db.execute('INSERT OR REPLACE INTO blobs (hash, path, size) VALUES (?, ?, ?)',
+                                 (digest, blob, os.path.getsize(blob)))
+                self._db.commit()
+        return digest
+
+    def link(self, account: str, uidvalidity: int, uid: str, filename: str, digest: str):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO attachments (account, uidvalidity, uid, filename, hash) '
+                             'VALUES (?, ?, ?, ?, ?)', (account, int(uidvalidity), int(uid), filename, digest))
+            self._db.commit()
+
+    def lookup(self, account: str, uidvalidity: int, uid: str, filename: str) -> Optional[str]:
+        """Hash do anexo (uid, filename) se o blob ainda estiver no disco."""
+        with self._lock:
+            row = self._db.execute('SELECT hash FROM attachments WHERE account=? AND uidvalidity=? AND uid=? '
+                                   'AND filename=?', (account, int(uidvalidity), int(uid), filename)).fetchone()
+            if row and self._blob_path(row[0]):
+                return row[0]
+        return None
+
+    def materialize(self, digest: str, dest: str) -> str:
+        """Copia o conteúdo do blob para `dest`. Cópia e não hard link: quem grava
+        depois em `dest` (open(..., 'wb')) alteraria o próprio blob."""
+        with self._lock:
+            blob = self._blob_path(digest)
+        if blob is None:
+            raise FileNotFoundError(digest)
+        shutil.copyfile(blob, dest + '.tmp')
+        os.replace(dest + '.tmp', dest)
+        return dest
+
+    def get_extraction(self, digest: Optional[str], kind: str) -> Optional[List[Dict]]:
+        """Itens já extraídos deste conteúdo com o extrator `kind` (ex.: 'xml', 'pdf:<modelo>')."""
+        if not digest:
+            return None
+        with self._lock:
+            row = self._db.execute('SELECT result FROM extractions WHERE hash=? AND kind=?',
+                                   (digest, kind)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_extraction(self, digest: Optional[str], kind: str, items: List[Dict]):
+        if not digest:
+            return
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO extractions (hash, kind, result) VALUES (?, ?, ?)',
+                             (digest, kind, json.dumps(items, ensure_ascii=False)))
+            self._db.commit()
@@ -0,0 +1,93 @@
+"""Cancelamento de operações IMAP que também interrompe leituras em andamento.
+
+Uma flag consultada entre um email e outro não basta: um FETCH de 20 MB ou um
+servidor que parou de responder prende a thread dentro de recv(). CancelToken
+guarda as conexões em uso (watch) e, no cancel(), fecha os sockets delas: a
+leitura bloqueada termina na hora com erro, o cliente descarta a conexão e
+devolve o que já tinha sido concluído.
+
+O token é chamável (token() == token.cancelled), então serve também como
+cancel_check para quem só sabe consultar uma função.
+"""
+import socket
+import threading
+from contextlib import contextmanager
+from typing import Set
+
+
+class OperationCancelled(Exception):
+    """A operação foi cancelada (comando não enviado ou interrompido)."""
+
+
+class CancelToken:
+    """Sinal de cancelamento compartilhado entre a interface e as threads de IMAP."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._conns: Set[object] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def __call__(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """Marca o token e fecha os sockets das conexões em uso."""
+        self._event.set()
+        with self._lock:
+            conns = list(self._conns)
+        for conn in conns:
+            abort_socket(conn)
+
+    def check(self):
+        """Levanta OperationCancelled se o token já foi cancelado."""
+        if self._event.is_set():
+            raise OperationCancelled()
+
+    @contextmanager
+    def watch(self, conn):
+        """Registra a conexão durante o bloco: um cancel() nesse meio tempo fecha o socket."""
+        self.check()
+        with self._lock:
+            self._conns.add(conn)
+        try:
+            yield conn
+        except Exception as e:
+            # erro de socket provocado pelo próprio cancel()
+            if self._event.is_set() and not isinstance(e, OperationCancelled):
+                raise OperationCancelled() from e
+            raise
+        finally:
+            with self._lock:
+                self._conns.discard(conn)
+
+
+def abort_socket(conn):
+    """Derruba o socket de uma conexão imaplib a partir de outra thread.
+    socket.shutdown na classe base (e não em SSLSocket) acorda o recv() bloqueado
+    sem mexer no estado TLS que a outra thread está usando.
+    Clientes asyncio expõem abort_threadsafe(), que agenda o fechamento no event loop."""
+    abort = getattr(conn, 'abort_threadsafe', None)
+    if abort is not None:
+        abort()
+        return
+    sock = getattr(conn, 'sock', None)
+    if sock is None:
+        return
+    try:
+        socket.socket.shutdown(sock, socket.SHUT_RDWR)
+    except (OSError, TypeError):
+        pass
+
+
+@contextmanager
+def watching(token, conn):
+    """token.watch(conn) quando há token; senão, não faz nada."""
+    if token is None:
+        yield conn
+        return
+    with token.watch(conn):
+        yield conn
@@ -0,0 +1,919 @@
+"""Motor IMAP assíncrono (asyncio) com a mesma interface pública do GmailClient.
+
+Vários comandos (ex.: UID FETCH de lotes diferentes) são enviados no mesmo
+socket sem esperar as respostas anteriores (pipelining), e os literais são
+lidos direto do stream com readexactly; as seções de anexos são repassadas em
+blocos para o arquivo, sem passar pela memória inteiras. As respostas são remontadas no
+formato do imaplib, então os parsers de imap_response/mime_structure e os
+filtros do GmailClient são reaproveitados sem mudanças.
+
+AsyncGmailClient expõe corrotinas; AsyncBackedGmailClient roda um event loop
+em uma thread própria e oferece a API síncrona usada por app.py e cli_extract.py.
+
+Leituras com comandos pendentes falham após `timeout` segundos sem dados (como o
+timeout de socket do imaplib), e um CancelToken em cancel_check fecha as
+conexões do cliente: a leitura em andamento termina na hora.
+"""
+import asyncio
+import contextvars
+import email
+import functools
+import inspect
+import os
+import re
+import ssl
+import threading
+from collections import deque
+from datetime import date
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from modules.app_logging import get_logger
+from modules.attachment_store import AttachmentStore, unique_names
+from modules.cancel_token import CancelToken, OperationCancelled
+from modules.email_gmail import HEADER_FIELDS, STATE_KEYS, GmailClient, _decode, _decode_header_value
+from modules.imap_response import (capability_code, chunked, fetch_section, parse_fetch_response,
+                                   parse_status_response, sequence_windows, uid_set)
+from modules.keyword_matcher import KeywordMatcher
+from modules.mime_structure import TransferDecoder, attachments_from_bodystructure
+from modules.search_query import (PROCESSED_KEYWORD, PROCESSED_LABEL, build_search_criteria, date_criteria,
+                                  gmail_raw_query, imap_date, imap_quote, processed_criteria)
+
+_LITERAL_END = re.compile(rb'\{(\d+)\}\r\n$')
+_SECTION_LITERAL = re.compile(rb'BODY\[([0-9.]*)\](?:<\d+>)? \{\d+\}\r\n$', re.I)
+_TAGGED = re.compile(rb'^(A\d+) (OK|NO|BAD)\b ?(.*)$', re.S)
+_UNTAGGED = re.compile(rb'^\* (?:(\d+) )?([A-Za-z-]+)\b ?(.*)$', re.S)
+log = get_logger('GMAIL')
+# CancelToken da chamada em andamento; as tarefas criadas nela herdam o valor
+_cancel_token: contextvars.ContextVar = contextvars.ContextVar('imap_cancel_token', default=None)
+
+
+def _cancellable(method):
+    """Versão asyncio de email_gmail._cancellable: com um CancelToken em
+    cancel_check, o cliente fica registrado no token durante a chamada e um
+    cancel() fecha as conexões dele (abort_threadsafe), interrompendo o que
+    estiver sendo lido; novos comandos não são enviados."""
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    async def wrapper(self, *args, **kwargs):
+        token = signature.bind(self, *args, **kwargs).arguments.get('cancel_check')
+        if not isinstance(token, CancelToken):
+            return await method(self, *args, **kwargs)
+        self._loop = asyncio.get_running_loop()
+        previous = _cancel_token.set(token)
+        try:
+            with token.watch(self):
+                return await method(self, *args, **kwargs)
+        except OperationCancelled:
+            # cancelado antes de haver resultados (ex.: durante o SEARCH)
+            log.info("%s cancelado pelo usuário", method.__name__)
+            return []
+        finally:
+            _cancel_token.reset(previous)
+    return wrapper
+
+
+class _Command:
+    """Comando em andamento: tag, tipo de resposta esperado e respostas não marcadas.
+    sinks: {seção: callback} que recebem o conteúdo de BODY[seção] em blocos.
+    """
+    __slots__ = ('tag', 'key', 'future', 'untagged', 'continuation', 'sinks')
+
+    def __init__(self, tag: str, key: str, future: asyncio.Future,
+                 sinks: Optional[Dict[str, Callable[[bytes], None]]] = None):
+        self.tag = tag
+        self.key = key
+        self.future = future
+        self.untagged: Dict[str, List[Any]] = {}
+        self.continuation: Optional[asyncio.Future] = None
+        self.sinks = sinks
+
+
+class AsyncIMAPConnection:
+    """Conexão IMAP sobre asyncio streams com vários comandos em voo.
+
+    O servidor responde os comandos na ordem em que chegam; as respostas não
+    marcadas (* ...) recebidas antes de uma conclusão marcada pertencem ao
+    comando mais antigo ainda pendente.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, host: str, port: int, use_ssl: bool = True, max_inflight: int = 8,
+                 timeout: Optional[float] = 30.0):
+        self.host = host
+        self.port = int(port)
+        self.use_ssl = use_ssl
+        self.timeout = float(timeout) if timeout else None
+        self.capabilities: Tuple[str, ...] = ()
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: deque = deque()
+        self._send_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(max(1, int(max_inflight)))
+        self._counter = 0
+        self.closed = False
+
+    @property
+    def inflight(self) -> int:
+        return len(self._pending)
+
+    async def open(self):
+        ctx = ssl.create_default_context() if self.use_ssl else None
+        self._reader, self._writer = await self._timed(asyncio.open_connection(self.host, self.port, ssl=ctx))
+        if self.closed:
+            # abortada (cancelamento) enquanto conectava
+            self._writer.close()
+            raise ConnectionError('Conexão IMAP encerrada')
+        greeting = await self._read_response(idle=False)
+        if not greeting or not _decode(self._head(greeting)).startswith('* OK'):
+            raise ConnectionError(f'Saudação IMAP inesperada: {greeting!r}')
+        self._reader_task = asyncio.ensure_future(self._read_loop())
+        await self._load_capabilities()
+
+    async def _load_capabilities(self):
+        status, data = await self.command('CAPABILITY')
+        if status == 'OK' and data and data[-1]:
+            self.capabilities = tuple(_decode(data[-1]).upper().split())
+
+    async def login(self, user: str, password: str):
+        status, data = await self.command('LOGIN', imap_quote(user), imap_quote(password))
+        if status == 'OK':
+            # capacidades pós-autenticação (ENABLE, CONDSTORE...), como refresh_capabilities no imaplib
+            caps = capability_code(data)
+            if caps is None:
+                await self._load_capabilities()
+            else:
+                self.capabilities = caps
+        return status, data
+
+    async def select(self, mailbox: str = 'INBOX'):
+        """SELECT; retorna (status, [EXISTS]) como conn.select do imaplib."""
+        return await self.command('SELECT', mailbox, key='EXISTS')
+
+    async def uid(self, cmd: str, *args, literal: Optional[bytes] = None,
+                  sinks: Optional[Dict[str, Callable[[bytes], None]]] = None):
+        """UID FETCH/SEARCH/...; retorna (status, data) no formato de imaplib.uid."""
+        return await self.command('UID', cmd.upper(), *args, key=cmd.upper(), literal=literal, sinks=sinks)
+
+    async def command(self, name: str, *args, key: Optional[str] = None,
+                      literal: Optional[bytes] = None,
+                      sinks: Optional[Dict[str, Callable[[bytes], None]]] = None):
+        """Envia um comando e aguarda sua conclusão marcada.
+        Outros comandos podem ser enviados enquanto este aguarda (até max_inflight).
+        Com sinks, as seções BODY[...] pedidas são entregues em blocos aos callbacks
+        e ficam vazias (b'') na resposta.
+        """
+        if self.closed:
+            raise ConnectionError('Conexão IMAP encerrada')
+        loop = asyncio.get_event_loop()
+        async with self._slots:
+            self._counter += 1
+            cmd = _Command(f'A{self._counter:04d}', (key or name).upper(), loop.create_future(), sinks)
+            line = ' '.join([cmd.tag, name] + [str(a) for a in args if a is not None]).encode('utf-8')
+            async with self._send_lock:
+                self._pending.append(cmd)
+                if literal is None:
+                    self._writer.write(line + b'\r\n')
+                elif 'LITERAL+' in self.capabilities:
+                    self._writer.write(line + b' {%d+}\r\n' % len(literal) + literal + b'\r\n')
+                else:
+                    # literal sincronizado: espera o "+" do servidor antes de enviar os dados
+                    cmd.continuation = loop.create_future()
+                    self._writer.write(line + b' {%d}\r\n' % len(literal))
+                    await self._timed(self._writer.drain())
+                    await asyncio.wait({cmd.continuation, cmd.future}, return_when=asyncio.FIRST_COMPLETED)
+                    if not cmd.future.done():
+                        self._writer.write(literal + b'\r\n')
+                await self._timed(self._writer.drain())
+            return await cmd.future
+
+    async def logout(self):
+        try:
+            if not self.closed:
+                await asyncio.wait_for(self.command('LOGOUT'), timeout=5)
+        except Exception:
+            pass
+        await self.abort()
+
+    async def abort(self):
+        """Fecha o socket; comandos pendentes falham com ConnectionError."""
+        self._close()
+
+    def _close(self):
+        self.closed = True
+        if self._writer is not None:
+            try:
+                self._writer.close()
+            except Exception:
+                pass
+        if self._reader_task is not None and self._reader_task is not asyncio.current_task():
+            self._reader_task.cancel()
+        self._fail_pending(ConnectionError('Conexão IMAP encerrada'))
+
+    # --- leitura ---
+    @staticmethod
+    def _head(parts: List[Any]) -> bytes:
+        first = parts[0]
+        return first[0] if isinstance(first, tuple) else first
+
+    async def _timed(self, op: Awaitable):
+        """Aguarda uma leitura/escrita por no máximo `timeout` segundos."""
+        if self.timeout is None:
+            return await op
+        try:
+            return await asyncio.wait_for(op, self.timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'Sem resposta do servidor IMAP em {self.timeout:g}s') from None
+
+    async def _read_response(self, idle: bool = True) -> List[Any]:
+        """Lê uma resposta completa: linhas + literais {n}, no formato do imaplib.
+        Com idle, esperar pela primeira linha sem comandos pendentes não expira.
+        """
+        parts: List[Any] = []
+        while True:
+            try:
+                line = await self._timed(self._reader.readline())
+                break
+            except TimeoutError:
+                # conexão ociosa; readline cancelado não consome dados do buffer
+                if not idle or self._pending:
+                    raise
+        if not line:
+            raise ConnectionError('Servidor IMAP encerrou a conexão')
+        # respostas não marcadas pertencem ao comando mais antigo (ver _dispatch)
+        sinks = self._pending[0].sinks if self._pending else None
+        while True:
+            m = _LITERAL_END.search(line)
+            if not m:
+                parts.append(line.rstrip(b'\r\n'))
+                return parts
+            size = int(m.group(1))
+            section = _SECTION_LITERAL.search(line) if sinks else None
+            sink = sinks.get(section.group(1).decode('ascii')) if section else None
+            if sink is None:
+                # literal lido de uma vez para o buffer, sem passar por readline
+                data = await self._timed(self._reader.readexactly(size))
+            else:
+                # seção de anexo: repassada em blocos, a memória fica limitada a chunk_size
+                data = b''
+                while size > 0:
+                    chunk = await self._timed(self._reader.readexactly(min(self.chunk_size, size)))
+                    size -= len(chunk)
+                    sink(chunk)
+            parts.append((line.rstrip(b'\r\n'), data))
+            line = await self._timed(self._reader.readline())
+            if not line:
+                raise ConnectionError('Servidor IMAP encerrou a conexão')
+
+    async def _read_loop(self):
+        try:
+            while True:
+                parts = await self._read_response()
+                self._dispatch(parts)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.closed = True
+            self._fail_pending(e if isinstance(e, ConnectionError) else ConnectionError(str(e)))
+
+    def _dispatch(self, parts: List[Any]):
+        head = self._head(parts)
+        if head.startswith(b'+'):
+            for cmd in self._pending:
+                if cmd.continuation is not None and not cmd.continuation.done():
+                    cmd.continuation.set_result(True)
+                    break
+            return
+        m = _TAGGED.match(head)
+        if m:
+            tag = m.group(1).decode()
+            cmd = next((c for c in self._pending if c.tag == tag), None)
+            if cmd is None:
+                return
+            self._pending.remove(cmd)
+            status = m.group(2).decode()
+            data = cmd.untagged.get(cmd.key) or [m.group(3)]
+            if not cmd.future.done():
+                cmd.future.set_result((status, data))
+            return
+        m = _UNTAGGED.match(head)
+        if not m:
+            return
+        number, kind, rest = m.group(1), m.group(2).decode().upper(), m.group(3)
+        if kind == 'BYE':
+            self.closed = True
+        if not self._pending:
+            return
+        # remove "* " e o nome do tipo, como o imaplib: b'12 (UID 5 ...'
+        prefix = number + b' ' if number is not None else b''
+        if number is not None and kind not in ('FETCH',):
+            value: List[Any] = [number]
+        else:
+            first = parts[0]
+            if isinstance(first, tuple):
+                value = [(prefix + _UNTAGGED.match(first[0]).group(3), first[1])] + list(parts[1:])
+            else:
+                value = [prefix + rest] + list(parts[1:])
+        self._pending[0].untagged.setdefault(kind, []).extend(value)
+
+    def _fail_pending(self, exc: Exception):
+        while self._pending:
+            cmd = self._pending.popleft()
+            for fut in (cmd.future, cmd.continuation):
+                if fut is not None and not fut.done():
+                    fut.set_exception(exc)
+
+
+class AsyncGmailClient:
+    """Versão asyncio do GmailClient: poucos sockets, muitos comandos em voo.
+    Os filtros e a montagem dos resultados são os mesmos do GmailClient.
+    """
+
+    fetch_batch_size = 100
+    discovery_mode = 'structure'
+
+    def __init__(self, server: str, port: int, user_email: str, password: str,
+                 connections: int = 2, max_inflight: int = 8, use_ssl: bool = True,
+                 store: Optional[AttachmentStore] = None, timeout: Optional[float] = 30.0):
+        self.server = server
+        self.port = int(port)
+        self.user_email = user_email
+        self.password = password
+        self.connections = max(1, int(connections))
+        self.max_inflight = max(1, int(max_inflight))
+        self.use_ssl = use_ssl
+        self.timeout = float(timeout) if timeout else None
+        self._conns: List[AsyncIMAPConnection] = []
+        self._opening: List[AsyncIMAPConnection] = []  # em login/SELECT, fora de _conns
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._sync_state: Optional[Dict[str, int]] = None
+        # Repositório de anexos (ver GmailClient): chaveado pelo UIDVALIDITY da INBOX
+        self.store = store
+        self.uidvalidity: Optional[int] = None
+
+    # mesmos helpers síncronos do GmailClient para o repositório de anexos
+    _account = GmailClient._account
+    _stored_attachments = GmailClient._stored_attachments
+    _store_downloaded = GmailClient._store_downloaded
+
+    async def _open(self) -> AsyncIMAPConnection:
+        conn = AsyncIMAPConnection(self.server, self.port, self.use_ssl, self.max_inflight, self.timeout)
+        self._opening.append(conn)
+        try:
+            await conn.open()
+            status, data = await conn.login(self.user_email, self.password)
+            if status != 'OK':
+                raise RuntimeError(f'Falha no login IMAP: {_decode(data[-1]) if data else status}')
+            await conn.select('INBOX')
+        except BaseException:
+            # sem isso o leitor da conexão meio aberta ficaria esperando para sempre
+            await conn.abort()
+            raise
+        finally:
+            self._opening.remove(conn)
+        return conn
+
+    async def _connection(self) -> AsyncIMAPConnection:
+        """Conexão com menos comandos em voo; abre novas até o limite.
+        Depois de um cancelamento (CancelToken da chamada) não reconecta."""
+        token = _cancel_token.get()
+        if token is not None:
+            token.check()
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            self._conns = [c for c in self._conns if not c.closed]
+            idle = [c for c in self._conns if c.inflight == 0]
+            if idle:
+                return idle[0]
+            if len(self._conns) < self.connections:
+                conn = await self._open()
+                self._conns.append(conn)
+                return conn
+            return min(self._conns, key=lambda c: c.inflight)
+
+    async def connect(self):
+        await self._connection()
+
+    async def close(self):
+        conns, self._conns = self._conns, []
+        await asyncio.gather(*(c.logout() for c in conns), return_exceptions=True)
+
+    def abort_threadsafe(self):
+        """Chamado pelo CancelToken (em outra thread): fecha as conexões no event loop."""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+
+        def close_all():
+            for conn in self._conns + self._opening:
+                conn._close()
+        try:
+            loop.call_soon_threadsafe(close_all)
+        except RuntimeError:
+            pass
+
+    async def _uid(self, cmd: str, *args, literal: Optional[bytes] = None,
+                   sinks: Optional[Dict[str, Callable[[bytes], None]]] = None, _retry: int = 1):
+        """UID cmd com uma nova tentativa em outra conexão se o socket cair."""
+        conn = await self._connection()
+        try:
+            return await conn.uid(cmd, *args, literal=literal, sinks=sinks)
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            await conn.abort()
+            if _retry > 0:
+                return await self._uid(cmd, *args, literal=literal, sinks=sinks, _retry=_retry - 1)
+            raise
+
+    async def _ordered(self, func: Callable[[Any], Awaitable], items: List):
+        """Executa func(item) concorrentemente e gera (item, resultado) na ordem de `items`.
+        No máximo connections * max_inflight tarefas ficam em andamento; se o
+        consumidor parar, as tarefas restantes são canceladas.
+        """
+        window = self.connections * self.max_inflight
+        pending: deque = deque()
+        it = iter(items)
+        try:
+            for item in it:
+                pending.append((item, asyncio.ensure_future(func(item))))
+                if len(pending) >= window:
+                    break
+            while pending:
+                item, task = pending.popleft()
+                result = await task
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.append((nxt, asyncio.ensure_future(func(nxt))))
+                yield item, result
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def _fetch_batch(self, batch: List[str], items: str) -> Dict[str, Dict]:
+        fetched: Dict[str, Dict] = {}
+        try:
+            status, data = await self._uid('fetch', uid_set(batch), f'(UID {items})')
+            if status == 'OK':
+                for attrs in parse_fetch_response(data):
+                    if attrs.get('UID'):
+                        fetched[str(attrs['UID'])] = attrs
+        except (ConnectionError, OSError, asyncio.IncompleteReadError, OperationCancelled):
+            pass
+        return fetched
+
+    async def _fetch_batches(self, uids: List[str], items: str, batch_size: Optional[int] = None):
+        """Lotes de UID FETCH enviados em pipeline; gerados na ordem dos UIDs."""
+        batches = list(chunked(uids, batch_size or self.fetch_batch_size))
+        async for batch, fetched in self._ordered(lambda b: self._fetch_batch(b, items), batches):
+            yield batch, fetched
+
+    async def _fetch_full(self, uid: str) -> Optional[bytes]:
+        status, msg_data = await self._uid('fetch', uid, '(BODY.PEEK[])')
+        if status != 'OK' or not msg_data:
+            return None
+        for part in msg_data:
+            if isinstance(part, tuple) and len(part) >= 2:
+                return part[1]
+        return None
+
+    async def list_recent(self, limit: int = 10,
+                          result_callback: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+        """Mesmo contrato de GmailClient.list_recent."""
+        try:
+            recent_uids = await self._search_window(limit, []) or []
+        except Exception:
+            return []
+        results: List[Dict] = []
+        async for batch, fetched in self._fetch_batches(recent_uids, HEADER_FIELDS):
+            for uid in batch:
+                try:
+                    attrs = fetched.get(uid)
+                    raw_headers = fetch_section(attrs) if attrs is not None else None
+                    if raw_headers is None:
+                        raw_headers = await self._fetch_full(uid)
+                        if not raw_headers:
+                            continue
+                    item = GmailClient._header_item(uid, email.message_from_bytes(raw_headers))
+                    results.append(item)
+                    if result_callback:
+                        try:
+                            result_callback(item)
+                        except Exception:
+                            pass
+                except Exception:
+                    continue
+        return results
+
+    async def count_inbox(self) -> int:
+        messages = (await self.mailbox_status()).get('MESSAGES')
+        if messages is not None:
+            return messages
+        return await self._select_count()
+
+    async def mailbox_status(self) -> Dict[str, int]:
+        """Mesmo contrato de GmailClient.mailbox_status."""
+        conn = await self._connection()
+        items = STATE_KEYS if 'CONDSTORE' in conn.capabilities else STATE_KEYS[:3]
+        try:
+            status, data = await conn.command('STATUS', 'INBOX', f"({' '.join(items)})")
+        except (ConnectionError, OSError):
+            return {}
+        if status != 'OK':
+            return {}
+        state = {k: v for k, v in parse_status_response(data).items() if k in STATE_KEYS}
+        if 'UIDVALIDITY' in state:
+            self.uidvalidity = state['UIDVALIDITY']
+        return state
+
+    async def sync_mailbox(self) -> Dict:
+        """Versão simplificada de GmailClient.sync_mailbox: detecta "nada mudou"
+        com um STATUS e lista os UIDs novos; não usa CHANGEDSINCE/VANISHED."""
+        prev, state = self._sync_state, await self.mailbox_status()
+        result = {'changed': True, 'messages': state.get('MESSAGES', 0), 'new': [], 'flags': [], 'vanished': []}
+        if state and prev and prev.get('UIDVALIDITY') == state.get('UIDVALIDITY') and prev.get('UIDNEXT'):
+            if all(prev.get(k) == state.get(k) for k in STATE_KEYS):
+                result['changed'] = False
+            elif state.get('UIDNEXT', 0) > prev['UIDNEXT']:
+                status, data = await self._uid('search', 'UID', f"{prev['UIDNEXT']}:*")
+                if status == 'OK' and data and data[0]:
+                    result['new'] = [u for u in _decode(data[0]).split() if int(u) >= prev['UIDNEXT']]
+        if state:
+            self._sync_state = state
+        return result
+
+    async def has_gmail_extensions(self) -> bool:
+        try:
+            return 'X-GM-EXT-1' in (await self._connection()).capabilities
+        except Exception:
+            return False
+
+    async def _select_count(self) -> int:
+        conn = await self._connection()
+        status, data = await conn.select('INBOX')
+        if status != 'OK' or not data:
+            return 0
+        try:
+            return int(_decode(data[0]))
+        except ValueError:
+            return 0
+
+    async def _messages_since(self, since: date, limit: int) -> int:
+        """Mesmo contrato de GmailClient._messages_since."""
+        total = await self._select_count()
+        conn = await self._connection()
+        try:
+            status, data = await conn.command('SEARCH', 'SINCE', imap_date(since))
+        except (ConnectionError, OSError):
+            return limit
+        if status != 'OK' or not data:
+            return limit
+        seqs = _decode(data[0]).split()
+        if not seqs:
+            return 0
+        return total - min(int(n) for n in seqs) + 1
+
+    async def _search_window(self, limit: int, criteria: List[str],
+                             raw_query: Optional[str] = None) -> Optional[List[str]]:
+        """Mesmo contrato de GmailClient._search_window."""
+        total = await self._select_count()
+        if total <= 0:
+            return []
+        uids: List[str] = []
+        for seqs in sequence_windows(total, int(limit), GmailClient.search_window_size):
+            if raw_query is not None:
+                try:
+                    status, data = await self._uid('search', 'CHARSET', 'UTF-8', seqs, *criteria,
+                                                   'X-GM-RAW', literal=raw_query.encode('utf-8'))
+                except Exception:
+                    status, data = 'NO', None
+                if status != 'OK':
+                    return None
+            else:
+                status, data = await self._uid('search', seqs, *criteria)
+            if status != 'OK' or not data:
+                break
+            if data[0]:
+                uids.extend(sorted(_decode(data[0]).split(), key=int, reverse=True))
+        return uids
+
+    async def _discover(self, uid: str, attrs: Optional[Dict]):
+        if attrs is not None and attrs.get('BODYSTRUCTURE') is not None:
+            try:
+                parts = attachments_from_bodystructure(attrs['BODYSTRUCTURE'])
+                header = GmailClient._header_item(uid, email.message_from_bytes(fetch_section(attrs) or b''))
+                return header, [(_decode_header_value(p['filename']), p['content_type']) for p in parts]
+            except Exception:
+                pass
+        try:
+            raw_email = fetch_section(attrs) if attrs is not None else None
+            if not raw_email:
+                raw_email = await self._fetch_full(uid)
+            if not raw_email:
+                return None
+            return GmailClient._scan_raw(uid, raw_email)
+        except Exception:
+            return None
+
+    @_cancellable
+    async def search_notes(
+        self,
+        note_types,
+        limit: int,
+        include_keywords: List[str],
+        exclude_keywords: List[str],
+        progress_cb: Optional[Callable[[int, int], None]] = None,
+        result_callback: Optional[Callable[[Dict], None]] = None,
+        cancel_check: Optional[Callable[[], bool]] = None,
+        server_filter: bool = True,
+        skip_processed: bool = False,
+        prioritize_senders: bool = False,
+        skip_negative_senders: bool = False,
+        max_results: int = 0,
+        since: Optional[date] = None,
+        before: Optional[date] = None,
+    ) -> List[Dict]:
+        """Mesmo contrato de GmailClient.search_notes. Sem cache local não há
+        histórico de remetentes: prioritize_senders e skip_negative_senders são ignorados."""
+        lim = int(limit)
+        if lim <= 0:
+            return []
+        results: List[Dict] = []
+
+        if isinstance(note_types, str):
+            types_set = {note_types.upper()}
+        else:
+            types_set = {t.upper() for t in (note_types or [])}
+        if not types_set:
+            types_set = {"PDF", "XML"}
+        target_exts = set()
+        if "PDF" in types_set:
+            target_exts.add('.pdf')
+        if "XML" in types_set:
+            target_exts.add('.xml')
+
+        if since is not None:
+            lim = min(lim, await self._messages_since(since, lim))
+            if lim <= 0:
+                return []
+
+        to_scan = None
+        gmail = await self.has_gmail_extensions()
+        if server_filter and gmail:
+            raw_query = gmail_raw_query(target_exts, exclude_keywords, skip_processed,
+                                        since, before)
+            log.info("Consulta X-GM-RAW: %s", raw_query)
+            to_scan = await self._search_window(lim, [], raw_query=raw_query)
+        if to_scan is None:
+            criteria = build_search_criteria(exclude_keywords) if server_filter else []
+            if skip_processed:
+                criteria += processed_criteria(gmail)
+            criteria += date_criteria(since, before)
+            if criteria:
+                log.info("Critérios no servidor: %s", ' '.join(criteria))
+            to_scan = await self._search_window(lim, criteria) or []
+
+        log.info("Buscando em %d emails (dentre os %d mais recentes)", len(to_scan), lim)
+        total = len(to_scan)
+        idx = 0
+        include, exclude = KeywordMatcher(include_keywords), KeywordMatcher(exclude_keywords)
+        if self.discovery_mode == 'structure':
+            batches = self._fetch_batches(to_scan, f'BODYSTRUCTURE {HEADER_FIELDS}')
+        else:
+            batches = self._fetch_batches(to_scan, 'BODY.PEEK[]', batch_size=1)
+        try:
+            async for batch, fetched in batches:
+                for uid in batch:
+                    if max_results and len(results) >= max_results:
+                        log.info("Limite de %d anexos atingido após %d/%d emails", max_results, idx, total)
+                        return results
+                    idx += 1
+                    if cancel_check and cancel_check():
+                        log.info("Busca cancelada pelo usuário após %d/%d emails", idx - 1, total)
+                        return results
+                    if progress_cb:
+                        progress_cb(idx, total)
+                    discovered = await self._discover(uid, fetched.get(uid))
+                    if discovered is None:
+                        continue
+                    header, attachments = discovered
+                    GmailClient._match_attachments(uid, header, attachments, target_exts,
+                                                   include, exclude, results, result_callback)
+        finally:
+            await batches.aclose()
+        return results
+
+    async def mark_processed(self, uids: List[str]) -> int:
+        """Mesmo contrato de GmailClient.mark_processed."""
+        uids = sorted({str(u) for u in uids if str(u).isdigit()}, key=int)
+        if not uids:
+            return 0
+        if await self.has_gmail_extensions():
+            item, value = '+X-GM-LABELS', f'({imap_quote(PROCESSED_LABEL)})'
+        else:
+            item, value = '+FLAGS.SILENT', f'({PROCESSED_KEYWORD})'
+        marked = 0
+        for batch in chunked(uids, self.fetch_batch_size):
+            try:
+                status, data = await self._uid('store', ','.join(batch), item, value)
+            except (ConnectionError, OSError) as e:
+                status, data = 'NO', [str(e).encode()]
+            if status != 'OK':
+                log.warning("Servidor recusou a marcação de processados (%s): %s", item, _decode(data[-1]) if data else status)
+                break
+            marked += len(batch)
+        log.info("%d emails marcados como processados", marked)
+        return marked
+
+    @_cancellable
+    async def download_attachments(self, selections: List[Dict], download_dir: str,
+                                   progress_cb: Optional[Callable[[int, int], None]] = None,
+                                   cancel_check: Optional[Callable[[], bool]] = None) -> List[Dict]:
+        """Mesmo contrato de GmailClient.download_attachments. Ao cancelar, as
+        tarefas em andamento são canceladas pelo próprio asyncio (ver _ordered)."""
+        os.makedirs(download_dir, exist_ok=True)
+        if self.store is not None and self.uidvalidity is None:
+            await self.mailbox_status()
+        by_uid: Dict[str, List[Dict]] = {}
+        for s in selections:
+            by_uid.setdefault(str(s['uid']), []).append(s)
+        local_names = unique_names([(str(s['uid']), s['filename']) for s in selections if s.get('filename')])
+        uids = list(by_uid.keys())
+        total = len(uids)
+        # Anexos já no repositório saem do disco; só o restante vai ao servidor
+        stored = self._stored_attachments(by_uid, local_names, download_dir)
+        pending = {uid: [s for s in by_uid[uid] if s.get('filename') not in
+                         {a['filename'] for a in stored.get(uid, [])}] for uid in uids}
+        structures: Dict[str, object] = {}
+        async for _, fetched in self._fetch_batches([u for u in uids if pending[u]], 'BODYSTRUCTURE'):
+            if cancel_check and cancel_check():
+                log.info("Download cancelado pelo usuário")
+                return []
+            for fuid, attrs in fetched.items():
+                structures[fuid] = attrs.get('BODYSTRUCTURE')
+
+        async def download_one(uid: str) -> List[Dict]:
+            saved = stored.get(uid, [])
+            if not pending[uid]:
+                return saved
+            wanted = {s['filename'] for s in pending[uid] if s.get('filename')}
+            types_map = {s['filename']: s.get('type', '') for s in pending[uid]}
+            names = {fname: local_names.get((uid, fname), fname) for fname in wanted}
+            try:
+                fetched = None
+                selected = GmailClient._plan_sections(structures.get(uid), wanted)
+                if selected == []:
+                    return saved
+                if selected:
+                    fetched = await self._stream_sections(uid, selected, types_map, download_dir, names)
+                if fetched is None:
+                    raw_email = await self._fetch_full(uid)
+                    if not raw_email:
+                        return saved
+                    fetched = GmailClient._save_from_raw(uid, raw_email, wanted, types_map, download_dir, names)
+            except Exception:
+                return saved
+            return saved + self._store_downloaded(uid, fetched)
+
+        out: List[Dict] = []
+        i = 0
+        async for _, saved in self._ordered(download_one, uids):
+            i += 1
+            if progress_cb:
+                progress_cb(i, total)
+            out.extend(saved)
+            if cancel_check and cancel_check() and i < total:
+                log.info("Download cancelado pelo usuário após %d/%d emails", i, total)
+                break
+        return out
+
+    async def _stream_sections(self, uid: str, selected: List[Tuple[str, Dict]], types_map: Dict[str, str],
+                               download_dir: str, names: Optional[Dict[str, str]] = None) -> Optional[List[Dict]]:
+        """Como GmailClient._stream_sections: o leitor da conexão entrega cada
+        BODY[seção] em blocos ao decodificador, que grava em '<nome>.part'.
+        Retorna None quando alguma seção não veio (cai no download completo).
+        """
+        def sink(fh, decoder):
+            def write(chunk: bytes):
+                # download cancelado: o leitor ainda consome o resto da resposta
+                if not fh.closed:
+                    fh.write(decoder.write(chunk))
+            return write
+
+        # mesmo nome repetido: fica o último, como na gravação direta
+        by_name = {fname: p for fname, p in selected}
+        targets = []
+        sinks: Dict[str, Callable[[bytes], None]] = {}
+        try:
+            for fname, p in by_name.items():
+                path = os.path.join(download_dir, (names or {}).get(fname, fname))
+                fh = open(path + '.part', 'wb')
+                decoder = TransferDecoder(p['encoding'])
+                targets.append((fname, p['section'], path, fh, decoder))
+                sinks[p['section']] = sink(fh, decoder)
+            sections = ' '.join(f'BODY.PEEK[{section}]' for _, section, _, _, _ in targets)
+            try:
+                # sem nova tentativa: parte dos blocos pode já ter sido gravada
+                status, data = await self._uid('fetch', uid, f'(UID {sections})', sinks=sinks, _retry=0)
+            except (ConnectionError, OSError, asyncio.IncompleteReadError):
+                return None
+            attrs = None
+            if status == 'OK':
+                attrs = next((a for a in parse_fetch_response(data) if str(a.get('UID')) == uid), None)
+            if attrs is None:
+                return None
+            for _, section, _, fh, decoder in targets:
+                # literais já foram gravados (vêm vazios); strings curtas chegam na própria resposta
+                raw = fetch_section(attrs, f'BODY[{section}]')
+                if raw is None:
+                    return None
+                fh.write(decoder.write(raw) + decoder.flush())
+                fh.close()
+            saved: List[Dict] = []
+            for fname, _, path, _, _ in targets:
+                if os.path.getsize(path + '.part') == 0:
+                    continue
+                os.replace(path + '.part', path)
+                saved.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
+            return saved
+        finally:
+            for _, _, path, fh, _ in targets:
+                fh.close()
+                if os.path.exists(path + '.part'):
+                    os.remove(path + '.part')
+
+    async def fetch_email(self, uid: str) -> Dict:
+        """Mesmo contrato de GmailClient.fetch_email."""
+        try:
+            raw_email = await self._fetch_full(uid)
+            if not raw_email:
+                raise RuntimeError('Resposta inesperada do servidor')
+            msg = email.message_from_bytes(raw_email)
+        except Exception as e:
+            raise RuntimeError(f'Erro ao buscar email: {e}')
+        return GmailClient._email_dict(uid, msg)
+
+
+class AsyncBackedGmailClient:
+    """API síncrona do GmailClient sobre o AsyncGmailClient.
+    Um único event loop em thread dedicada atende todas as chamadas; as
+    threads do app apenas aguardam o resultado. Callbacks (progresso,
+    resultados, cancelamento) são chamados a partir da thread do loop.
+    """
+
+    def __init__(self, server: str, port: int, user_email: str, password: str, **kwargs):
+        self._client = AsyncGmailClient(server, port, user_email, password, **kwargs)
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name='imap-asyncio', daemon=True)
+        self._thread.start()
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def connect(self):
+        self._run(self._client.connect())
+
+    def disconnect(self):
+        self._run(self._client.close())
+
+    def close(self):
+        """Encerra as conexões e o event loop."""
+        if not self._loop.is_running():
+            return
+        try:
+            self._run(self._client.close())
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+    def has_gmail_extensions(self) -> bool:
+        return self._run(self._client.has_gmail_extensions())
+
+    def list_recent(self, limit: int = 10, result_callback: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+        return self._run(self._client.list_recent(limit, result_callback=result_callback))
+
+    def count_inbox(self) -> int:
+        return self._run(self._client.count_inbox())
+
+    def mailbox_status(self) -> Dict[str, int]:
+        return self._run(self._client.mailbox_status())
+
+    def sync_mailbox(self) -> Dict:
+        return self._run(self._client.sync_mailbox())
+
+    def search_notes(self, *args, **kwargs) -> List[Dict]:
+        return self._run(self._client.search_notes(*args, **kwargs))
+
+    def download_attachments(self, selections: List[Dict], download_dir: str,
+                             progress_cb: Optional[Callable[[int, int], None]] = None,
+                             cancel_check: Optional[Callable[[], bool]] = None) -> List[Dict]:
+        return self._run(self._client.download_attachments(selections, download_dir, progress_cb=progress_cb,
+                                                           cancel_check=cancel_check))
+
+    def mark_processed(self, uids: List[str]) -> int:
+        return self._run(self._client.mark_processed(uids))
+
+    def fetch_email(self, uid: str) -> Dict:
+        return self._run(self._client.fetch_email(uid))
@@ -1,9 +1,40 @@
 import imaplib
 import email
+import logging
 from email.header import decode_header
 from typing import List, Dict, Callable, Optional, Tuple
 import base64
+import functools
+import inspect
+import json
 import threading
+import time
+from collections import deque
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from modules.app_logging import get_logger
+from modules.attachment_store import AttachmentStore, unique_names
+from modules.cancel_token import CancelToken, OperationCancelled, watching
+from modules.imap_pool import IMAPConnectionPool
+from modules.imap_stream import StreamFetchError, stream_sections
+from modules.keyword_matcher import KeywordMatcher, fold
+from modules.mail_cache import MailCache, filter_signature, message_day, sender_address
+from modules.imap_response import (chunked, expand_uid_set, fetch_section, parse_fetch_response,
+                                   parse_status_response, refresh_capabilities, sequence_windows, uid_set)
+from modules.mime_scan import part_payload, scan_attachments
+from modules.mime_structure import (TRANSFER_ENCODINGS, TransferDecoder, attachments_from_bodystructure,
+                                    decode_transfer_encoding)
+from modules.search_query import (PROCESSED_KEYWORD, PROCESSED_LABEL, build_search_criteria,
+                                  date_criteria, gmail_raw_query, imap_date, imap_quote, processed_criteria,
+                                  sender_criteria)
+
+HEADER_FIELDS = 'BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)]'
+# Códigos de resposta do SELECT/STATUS que descrevem o estado da pasta
+STATE_KEYS = ('MESSAGES', 'UIDVALIDITY', 'UIDNEXT', 'HIGHESTMODSEQ')
+
+log = get_logger('GMAIL')
 
 
 def _decode(value: Optional[bytes]) -> str:
@@ -34,30 +65,199 @@ def _decode_header_value(val: str) -> str:
         return val or ""
 
 
+def _cancellable(method):
+    """Durante a chamada, um cancel_check que seja CancelToken fica na thread
+    (e nas threads do pool): os comandos em andamento passam a ser interrompidos
+    fechando o socket, e não só entre um email e outro."""
+    signature = inspect.signature(method)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        token = signature.bind(self, *args, **kwargs).arguments.get('cancel_check')
+        if not isinstance(token, CancelToken):
+            return method(self, *args, **kwargs)
+        previous = getattr(self._thread_local, 'cancel', None)
+        self._thread_local.cancel = token
+        try:
+            return method(self, *args, **kwargs)
+        except OperationCancelled:
+            # cancelado antes de haver resultados (ex.: durante o SEARCH)
+            log.info("%s cancelado pelo usuário", method.__name__)
+            return []
+        finally:
+            self._thread_local.cancel = previous
+    return wrapper
+
+
 class GmailClient:
     """Cliente simples para Gmail via IMAP com suporte a múltiplas threads.
-    Cada thread terá sua própria conexão IMAP isolada usando threading.local()."""
+    Cada thread terá sua própria conexão IMAP isolada usando threading.local().
+    Buscas e downloads grandes são divididos em lotes de UIDs processados em
+    paralelo por um pool de até `pool_size` conexões."""
 
-    def __init__(self, server: str, port: int, user_email: str, password: str):
+    # Quantidade de UIDs por comando FETCH em lote
+    fetch_batch_size = 100
+    # Números de sequência por UID SEARCH ao percorrer a caixa do fim para o começo
+    search_window_size = 2000
+    # 'structure': lista anexos pelo BODYSTRUCTURE; 'full': baixa a mensagem inteira
+    discovery_mode = 'structure'
+    # Remetentes do histórico usados na busca priorizada e endereços por UID SEARCH FROM
+    priority_senders = 200
+    sender_search_chunk = 25
+    # Emails examinados sem nenhuma nota para o remetente ser tratado como negativo
+    negative_sender_min_scans = 20
+
+    def __init__(self, server: str, port: int, user_email: str, password: str, pool_size: int = 4,
+                 cache: Optional[MailCache] = None, store: Optional[AttachmentStore] = None,
+                 liveness_window: float = 60.0, use_ssl: bool = True, transport=None,
+                 timeout: Optional[float] = 30.0):
         self.server = server
         self.port = int(port)
+        # use_ssl=False apenas para servidores locais (ex.: modules/fake_imap.py em benchmarks)
+        self.use_ssl = use_ssl
+        # Objeto com open_connection(server, port, use_ssl, timeout): grava ou reproduz o tráfego (modules/imap_trace.py)
+        self.transport = transport
         self.user_email = user_email
         self.password = password
+        self.pool_size = max(1, int(pool_size))
+        # Tempo máximo (s) sem receber nada do servidor em um comando; None = espera indefinida
+        self.timeout = float(timeout) if timeout else None
+        # Conexão usada com sucesso há menos de tantos segundos dispensa o NOOP de verificação
+        self.liveness_window = float(liveness_window)
         # Armazena conexões por thread usando threading.local()
         self._thread_local = threading.local()
+        # Conexões extras para varreduras paralelas
+        self._pool = IMAPConnectionPool(self._open_connection, self.pool_size)
+        # Cache de cabeçalhos/anexos por (UIDVALIDITY, UID); opcional
+        self.cache = cache
+        self.uidvalidity: Optional[int] = None
+        # Repositório de anexos por SHA-256: o que já foi baixado não volta a ser buscado; opcional
+        self.store = store
+        # Último estado visto da INBOX (MESSAGES, UIDNEXT, HIGHESTMODSEQ...) e buscas feitas nele
+        self._sync_state: Optional[Dict[str, int]] = None
+        self._search_memo: Dict[str, Tuple[str, List[str]]] = {}
+
+    def _open_connection(self) -> imaplib.IMAP4:
+        """Abre uma nova conexão autenticada com a INBOX selecionada."""
+        token = self._cancel_token()
+        if token is not None:
+            token.check()
+        if self.transport is not None:
+            conn = self.transport.open_connection(self.server, self.port, self.use_ssl, timeout=self.timeout)
+        elif self.use_ssl:
+            conn = imaplib.IMAP4_SSL(self.server, self.port, timeout=self.timeout)
+        else:
+            conn = imaplib.IMAP4(self.server, self.port, timeout=self.timeout)
+        try:
+            with watching(token, conn):
+                _, login_data = conn.login(self.user_email, self.password)
+                refresh_capabilities(conn, login_data)
+                # QRESYNC precisa ser habilitado antes do SELECT (RFC 7162)
+                conn.qresync = False
+                if 'QRESYNC' in conn.capabilities and 'ENABLE' in conn.capabilities:
+                    try:
+                        status, _ = conn.enable('QRESYNC')
+                        conn.qresync = status == 'OK'
+                    except Exception:
+                        pass
+                conn.select('INBOX')
+        except OperationCancelled:
+            try:
+                conn.shutdown()
+            except Exception:
+                pass
+            raise
+        self._mark_alive(conn)
+        return conn
+
+    @staticmethod
+    def _mark_alive(conn):
+        """Registra o último comando bem-sucedido da conexão."""
+        conn.last_ok = time.monotonic()
+
+    def _is_alive(self, conn) -> bool:
+        return time.monotonic() - getattr(conn, 'last_ok', 0.0) < self.liveness_window
+
+    def _drop_connection(self):
+        """Descarta a conexão da thread atual (socket quebrado); a próxima é aberta sob demanda."""
+        conn, self._thread_local.conn = getattr(self._thread_local, 'conn', None), None
+        if conn is not None:
+            try:
+                conn.shutdown()
+            except Exception:
+                pass
 
     def _get_connection(self) -> imaplib.IMAP4_SSL:
         """Retorna a conexão IMAP para a thread atual, criando se necessário."""
         if not hasattr(self._thread_local, 'conn') or self._thread_local.conn is None:
-            self._thread_local.conn = imaplib.IMAP4_SSL(self.server, self.port)
-            self._thread_local.conn.login(self.user_email, self.password)
-            self._thread_local.conn.select('INBOX')
+            self._thread_local.conn = self._open_connection()
         return self._thread_local.conn
 
+    @contextmanager
+    def _pooled(self):
+        """Empresta uma conexão do pool para a thread atual durante o bloco."""
+        conn = self._pool.acquire()
+        previous = getattr(self._thread_local, 'conn', None)
+        self._thread_local.conn = conn
+        try:
+            yield
+        finally:
+            # _uid pode ter reconectado: devolve a conexão que estiver em uso
+            current = self._thread_local.conn
+            self._thread_local.conn = previous
+            self._pool.release(current)
+
+    def _cancel_token(self) -> Optional[CancelToken]:
+        """Token de cancelamento da operação em andamento nesta thread (ver _cancellable)."""
+        return getattr(self._thread_local, 'cancel', None)
+
+    def _ordered_parallel(self, func: Callable, items: List):
+        """Executa func(item) em paralelo usando conexões do pool.
+        Gera (item, resultado) na mesma ordem de `items`, mantendo no máximo
+        2 * pool_size tarefas em andamento. Se o consumidor parar (cancelamento),
+        as tarefas ainda não iniciadas são descartadas; as que já estão no
+        servidor são interrompidas pelo CancelToken da operação, se houver.
+        """
+        if self.pool_size <= 1 or len(items) <= 1:
+            for item in items:
+                yield item, func(item)
+            return
+        token = self._cancel_token()
+
+        def task(item):
+            self._thread_local.cancel = token
+            try:
+                with self._pooled():
+                    return func(item)
+            finally:
+                self._thread_local.cancel = None
+
+        executor = ThreadPoolExecutor(max_workers=self.pool_size)
+        pending = deque()
+        it = iter(items)
+        try:
+            for item in it:
+                pending.append((item, executor.submit(task, item)))
+                if len(pending) >= self.pool_size * 2:
+                    break
+            while pending:
+                item, fut = pending.popleft()
+                yield item, fut.result()
+                nxt = next(it, None)
+                if nxt is not None:
+                    pending.append((nxt, executor.submit(task, nxt)))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
     def connect(self):
         """Conecta a thread atual ao servidor IMAP."""
         self._get_connection()
 
+    def close(self):
+        """Desconecta a thread atual e encerra as conexões do pool."""
+        self.disconnect()
+        self._pool.close_all()
+
     def disconnect(self):
         """Desconecta a conexão da thread atual."""
         try:
@@ -71,15 +271,24 @@ class GmailClient:
             self._thread_local.conn = None
 
     def _ensure(self):
-        """Garante conexão ativa e INBOX selecionada. Reestabelece se necessário."""
+        """Garante conexão ativa e INBOX selecionada. Reestabelece se necessário.
+        O NOOP só é enviado se a conexão ficou mais de `liveness_window` segundos
+        sem comando bem-sucedido; falhas depois disso são tratadas por _uid.
+        """
         conn = self._get_connection()
+        if self._is_alive(conn):
+            return
         try:
-            status, _ = conn.noop()
+            with self._watched(conn):
+                status, _ = conn.noop()
             if status != 'OK':
                 raise imaplib.IMAP4.error('NOOP failed')
+            self._mark_alive(conn)
+        except OperationCancelled:
+            raise
         except Exception:
             # reconectar
-            self._thread_local.conn = None
+            self._drop_connection()
             conn = self._get_connection()
 
     def _safe_select_inbox(self):
@@ -87,31 +296,49 @@ class GmailClient:
         try:
             conn = self._get_connection()
             conn.select('INBOX')
+            self._mark_alive(conn)
         except Exception:
-            self._thread_local.conn = None
+            self._drop_connection()
             conn = self._get_connection()
 
+    @contextmanager
+    def _watched(self, conn):
+        """Comando interrompível pelo CancelToken da thread: se o cancelamento fechar
+        o socket no meio da resposta, a conexão é descartada (OperationCancelled)."""
+        try:
+            with watching(self._cancel_token(), conn):
+                yield conn
+        except OperationCancelled:
+            self._drop_connection()
+            raise
+
     # --- Robustez para comandos UID ---
-    def _uid(self, cmd: str, *args, _retry: int = 1):
+    def _uid(self, cmd: str, *args, _retry: int = 1, _literal: Optional[bytes] = None):
         """Executa comando UID com uma tentativa de reconexão se a resposta for inesperada.
         Retorna a tupla (status, data) como imaplib.uid.
+        _literal é enviado como literal IMAP ao final do comando (ex.: consulta X-GM-RAW).
+        Não há NOOP antes: se o socket estiver quebrado, reconecta e repete o comando.
+        Com um CancelToken na thread, o comando não é enviado depois do cancelamento
+        e um cancelamento durante a resposta fecha o socket (OperationCancelled).
         """
-        self._ensure()
+        token = self._cancel_token()
+        if token is not None:
+            token.check()
         conn = self._get_connection()
         try:
-            return conn.uid(cmd, *args)
-        except imaplib.IMAP4.error:
-            if _retry > 0:
-                self._thread_local.conn = None
-                conn = self._get_connection()
-                return self._uid(cmd, *args, _retry=_retry-1)
+            if _literal is not None:
+                conn.literal = _literal
+            with self._watched(conn):
+                result = conn.uid(cmd, *args)
+        except OperationCancelled:
             raise
         except Exception:
             if _retry > 0:
-                self._thread_local.conn = None
-                conn = self._get_connection()
-                return self._uid(cmd, *args, _retry=_retry-1)
+                self._drop_connection()
+                return self._uid(cmd, *args, _retry=_retry-1, _literal=_literal)
             raise
+        self._mark_alive(conn)
+        return result
 
     def list_recent(self, limit: int = 10, result_callback: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
         """Retorna os últimos N emails com cabeçalhos básicos.
@@ -119,55 +346,27 @@ class GmailClient:
         """
         self._ensure()
         try:
-            status, data = self._uid('search', None, 'ALL')
-            if status != 'OK' or not data or not data[0]:
-                return []
-            all_uids = _decode(data[0]).split()
-            if not all_uids:
-                return []
+            # só a janela das últimas N mensagens, não a lista de UIDs da caixa inteira
+            recent_uids = self._search_window(limit, []) or []  # mais recente primeiro
         except Exception:
             return []
-            
-        recent_uids = all_uids[-int(limit):]
+        if not recent_uids:
+            return []
         results: List[Dict] = []
-        for uid in reversed(recent_uids):  # mais recente primeiro
+        new_items: List[Dict] = []
+        # Cabeçalhos em lotes de UIDs: um round trip por lote em vez de um por email;
+        # os que já estão no cache não são buscados de novo
+        for uid, item, attrs in self._iter_fetched(recent_uids, HEADER_FIELDS, self._cached_headers(recent_uids)):
             try:
-                # Primeiro tenta buscar somente campos do cabeçalho
-                status, msg_data = self._uid('fetch', uid, '(BODY.PEEK[HEADER.FIELDS (FROM SUBJECT DATE)])')
-                tup = None
-                if status == 'OK' and msg_data:
-                    for part in msg_data:
-                        if isinstance(part, tuple) and len(part) >= 2:
-                            tup = part
-                            break
-                if tup is not None:
-                    raw_headers = tup[1]
-                    msg = email.message_from_bytes(raw_headers)
-                    subject = _decode_header_value(msg.get('Subject', ''))
-                    from_ = _decode_header_value(msg.get('From', ''))
-                    date_ = _decode_header_value(msg.get('Date', ''))
-                else:
-                    # Fallback: pega a mensagem completa e extrai cabeçalhos
-                    status, msg_full = self._uid('fetch', uid, '(BODY.PEEK[])')
-                    if status != 'OK' or not msg_full:
-                        continue
-                    raw_email = None
-                    for part in msg_full:
-                        if isinstance(part, tuple) and len(part) >= 2:
-                            raw_email = part[1]
-                            break
-                    if not raw_email:
-                        continue
-                    msg = email.message_from_bytes(raw_email)
-                    subject = _decode_header_value(msg.get('Subject', ''))
-                    from_ = _decode_header_value(msg.get('From', ''))
-                    date_ = _decode_header_value(msg.get('Date', ''))
-                item = {
-                    'uid': uid,
-                    'subject': subject,
-                    'from': from_,
-                    'date': date_,
-                }
+                if item is None:
+                    raw_headers = fetch_section(attrs) if attrs is not None else None
+                    if raw_headers is None:
+                        # Fallback: pega a mensagem completa e extrai cabeçalhos
+                        raw_headers = self._fetch_full(uid)
+                        if not raw_headers:
+                            continue
+                    item = self._header_item(uid, email.message_from_bytes(raw_headers))
+                    new_items.append(item)
                 results.append(item)
                 # Callback progressivo
                 if result_callback:
@@ -177,18 +376,83 @@ class GmailClient:
                         pass
             except Exception:
                 continue
+        if self.cache is not None and new_items:
+            self.cache.put_headers(self._account(), 'INBOX', new_items)
         return results
 
+    def _iter_fetched(self, uids: List[str], items: str, known: Dict[str, object],
+                      batch_size: Optional[int] = None):
+        """Gera (uid, valor em cache, atributos) na ordem de `uids`.
+        UIDs presentes em `known` saem com o valor do cache e sem FETCH; os demais
+        são buscados em lote por _fetch_batches e saem com valor None.
+        """
+        missing = [u for u in uids if u not in known]
+        batches = self._fetch_batches(missing, items, batch_size=batch_size)
+        ready: Dict[str, Optional[Dict]] = {}
+        try:
+            for uid in uids:
+                if uid in known:
+                    yield uid, known[uid], None
+                    continue
+                if uid not in ready:
+                    batch, fetched = next(batches)
+                    for b in batch:
+                        ready[b] = fetched.get(b)
+                yield uid, None, ready.pop(uid, None)
+        finally:
+            batches.close()
+
+    def _fetch_batches(self, uids: List[str], items: str, batch_size: Optional[int] = None):
+        """Busca `items` para os UIDs em lotes (UID FETCH 1201:1300 ...).
+        Os lotes são buscados em paralelo pelo pool de conexões, mas gerados como
+        (lote, {uid: atributos}) na ordem dos UIDs recebidos.
+        """
+        batches = list(chunked(uids, batch_size or self.fetch_batch_size))
+        for batch, fetched in self._ordered_parallel(lambda b: self._fetch_batch(b, items), batches):
+            yield batch, fetched
+
+    def _fetch_batch(self, batch: List[str], items: str) -> Dict[str, Dict]:
+        fetched: Dict[str, Dict] = {}
+        try:
+            status, data = self._uid('fetch', uid_set(batch), f'(UID {items})')
+            if status == 'OK':
+                for attrs in parse_fetch_response(data):
+                    if attrs.get('UID'):
+                        fetched[str(attrs['UID'])] = attrs
+        except Exception:
+            pass
+        return fetched
+
+    def _fetch_full(self, uid: str) -> Optional[bytes]:
+        """Baixa a mensagem completa (BODY.PEEK[]) de um UID."""
+        status, msg_data = self._uid('fetch', uid, '(BODY.PEEK[])')
+        if status != 'OK' or not msg_data:
+            return None
+        for part in msg_data:
+            if isinstance(part, tuple) and len(part) >= 2:
+                return part[1]
+        return None
+
+    @staticmethod
+    def _header_item(uid: str, msg) -> Dict:
+        return {
+            'uid': uid,
+            'subject': _decode_header_value(msg.get('Subject', '')),
+            'from': _decode_header_value(msg.get('From', '')),
+            'date': _decode_header_value(msg.get('Date', '')),
+        }
+
     def count_inbox(self) -> int:
         """Retorna a quantidade de emails na INBOX."""
+        # Um único STATUS responde; o EXISTS do SELECT fica como alternativa
+        messages = self.mailbox_status().get('MESSAGES')
+        if messages is not None:
+            return messages
         self._ensure()
-        # Método confiável: usar SEARCH ALL e contar
-        status, data = self._uid('search', None, 'ALL')
-        if status != 'OK' or not data:
-            return 0
-        return len(_decode(data[0]).split())
+        return self._select_count()
 
-    def _iter_message_attachments(self, msg) -> List[Tuple[str, str]]:
+    @staticmethod
+    def _iter_message_attachments(msg) -> List[Tuple[str, str]]:
         """Retorna lista (filename, content_type)."""
         found = []
         if msg.is_multipart():
@@ -205,69 +469,311 @@ class GmailClient:
                 found.append((filename, (msg.get_content_type() or '').lower()))
         return found
 
+    @_cancellable
     def download_attachments(self, selections: List[Dict], download_dir: str,
-                              progress_cb: Optional[Callable[[int, int], None]] = None) -> List[Dict]:
+                              progress_cb: Optional[Callable[[int, int], None]] = None,
+                              cancel_check: Optional[Callable[[], bool]] = None) -> List[Dict]:
         """Baixa anexos especificados por UID+filename.
         selections: [{uid, filename, type}] onde type é 'PDF' ou 'XML'.
-        Retorna lista com {uid, filename, path, type}
+        Retorna lista com {uid, filename, path, type} (+ sha256 quando há repositório).
+        O mesmo nome de arquivo vindo de emails diferentes é gravado como nome_<uid>.ext.
+        Cancelado (cancel_check), retorna só os emails já concluídos; com um
+        CancelToken, o download em andamento é interrompido na hora.
         """
         import os
         os.makedirs(download_dir, exist_ok=True)
         self._ensure()
+        if self.store is not None and self.uidvalidity is None:
+            self._select_state()
 
         # Agrupa por UID
         by_uid: Dict[str, List[Dict]] = {}
         for s in selections:
             by_uid.setdefault(str(s['uid']), []).append(s)
+        local_names = unique_names([(str(s['uid']), s['filename']) for s in selections if s.get('filename')])
 
         out: List[Dict] = []
         uids = list(by_uid.keys())
         total = len(uids)
-        for i, uid in enumerate(uids, start=1):
+        # Anexos já no repositório saem do disco; só o restante vai ao servidor
+        stored = self._stored_attachments(by_uid, local_names, download_dir)
+        pending = {uid: [s for s in by_uid[uid] if s.get('filename') not in
+                         {a['filename'] for a in stored.get(uid, [])}] for uid in uids}
+        # Estrutura MIME de todos os emails em lote, para baixar só as seções dos anexos
+        structures: Dict[str, object] = {}
+        for _, fetched in self._fetch_batches([u for u in uids if pending[u]], 'BODYSTRUCTURE'):
+            if cancel_check and cancel_check():
+                log.info("Download cancelado pelo usuário")
+                return out
+            for fuid, attrs in fetched.items():
+                structures[fuid] = attrs.get('BODYSTRUCTURE')
+
+        def download_one(uid: str) -> List[Dict]:
+            saved = stored.get(uid, [])
+            if not pending[uid]:
+                return saved
+            wanted = {s['filename'] for s in pending[uid] if s.get('filename')}
+            types_map = {s['filename']: s.get('type', '') for s in pending[uid]}
+            names = {fname: local_names.get((uid, fname), fname) for fname in wanted}
+            try:
+                fetched = self._download_sections(uid, structures.get(uid), wanted, types_map, download_dir, names)
+                if fetched is None:
+                    fetched = self._download_from_full(uid, wanted, types_map, download_dir, names)
+            except OperationCancelled:
+                return None
+            except Exception:
+                return saved
+            return saved + self._store_downloaded(uid, fetched)
+
+        # Emails baixados em paralelo; progresso e resultado seguem a ordem original
+        for i, (uid, saved) in enumerate(self._ordered_parallel(download_one, uids), start=1):
+            if saved is None:
+                log.info("Download cancelado pelo usuário após %d/%d emails", i - 1, total)
+                break
             if progress_cb:
                 progress_cb(i, total)
-            try:
-                status, msg_data = self._uid('fetch', uid, '(BODY.PEEK[])')
-                if status != 'OK' or not msg_data:
+            out.extend(saved)
+            if cancel_check and cancel_check() and i < total:
+                log.info("Download cancelado pelo usuário após %d/%d emails", i, total)
+                break
+        return out
+
+    def _stored_attachments(self, by_uid: Dict[str, List[Dict]], names: Dict[Tuple[str, str], str],
+                            download_dir: str) -> Dict[str, List[Dict]]:
+        """{uid: [anexos]} servidos pelo repositório local, já colocados em download_dir."""
+        import os
+        if self.store is None or self.uidvalidity is None:
+            return {}
+        account = self._account()
+        out: Dict[str, List[Dict]] = {}
+        for uid, sels in by_uid.items():
+            for s in sels:
+                fname = s.get('filename')
+                if not fname or any(a['filename'] == fname for a in out.get(uid, [])):
                     continue
-                tup = None
-                for part in msg_data:
-                    if isinstance(part, tuple):
-                        tup = part
-                        break
-                if not tup:
+                digest = self.store.lookup(account, self.uidvalidity, uid, fname)
+                if digest is None:
                     continue
-                msg = email.message_from_bytes(tup[1])
-                wanted = {s['filename'] for s in by_uid[uid] if s.get('filename')}
-                types_map = {s['filename']: s.get('type', '') for s in by_uid[uid]}
-                if msg.is_multipart():
-                    for part in msg.walk():
-                        disp = str(part.get('Content-Disposition') or '')
-                        if 'attachment' not in disp.lower():
-                            continue
-                        fname = _decode_header_value(part.get_filename() or '')
-                        if wanted and fname not in wanted:
-                            continue
-                        payload = part.get_payload(decode=True) or b''
-                        if not payload:
-                            continue
-                        path = os.path.join(download_dir, fname)
-                        with open(path, 'wb') as f:
-                            f.write(payload)
-                        out.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
-                else:
-                    fname = _decode_header_value(msg.get_filename() or '')
-                    if fname and (not wanted or fname in wanted):
-                        payload = msg.get_payload(decode=True) or b''
-                        if payload:
-                            path = os.path.join(download_dir, fname)
-                            with open(path, 'wb') as f:
-                                f.write(payload)
-                            out.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
-            except Exception:
+                path = os.path.join(download_dir, names.get((uid, fname), fname))
+                try:
+                    self.store.materialize(digest, path)
+                except OSError:
+                    continue
+                out.setdefault(uid, []).append({'uid': uid, 'filename': fname, 'path': path,
+                                                'type': s.get('type', ''), 'sha256': digest})
+        if out:
+            log.info("%d anexo(s) reaproveitado(s) do repositório local", sum(len(v) for v in out.values()))
+        return out
+
+    def _store_downloaded(self, uid: str, saved: List[Dict]) -> List[Dict]:
+        """Guarda os arquivos recém-baixados no repositório e anota o sha256 de cada um."""
+        if self.store is None or self.uidvalidity is None:
+            return saved
+        for item in saved:
+            try:
+                item['sha256'] = self.store.add(item['path'])
+                self.store.link(self._account(), self.uidvalidity, uid, item['filename'], item['sha256'])
+            except OSError as e:
+                log.warning("Não foi possível guardar %s no repositório: %s", item['filename'], e)
+        return saved
+
+    def _download_sections(self, uid: str, structure, wanted: set, types_map: Dict[str, str],
+                           download_dir: str, names: Optional[Dict[str, str]] = None) -> Optional[List[Dict]]:
+        """Baixa apenas as seções MIME dos anexos desejados (BODY.PEEK[2.1]...).
+        Retorna None quando não dá para usar o BODYSTRUCTURE (cai no download completo).
+        """
+        selected = self._plan_sections(structure, wanted)
+        if not selected:
+            return selected
+        return self._stream_sections(uid, selected, types_map, download_dir, names)
+
+    def _stream_sections(self, uid: str, selected: List[Tuple[str, Dict]], types_map: Dict[str, str],
+                         download_dir: str, names: Optional[Dict[str, str]] = None) -> Optional[List[Dict]]:
+        """Lê as seções em blocos e decodifica direto para os arquivos: a memória
+        usada fica limitada ao tamanho do bloco, qualquer que seja o anexo.
+        Grava em '<nome>.part' e só renomeia quando a seção chegou inteira.
+        """
+        import os
+        # mesmo nome repetido: fica o último, como na gravação direta
+        by_name = {fname: p for fname, p in selected}
+        targets = []
+        sinks: Dict[str, Callable[[bytes], None]] = {}
+        try:
+            for fname, p in by_name.items():
+                path = os.path.join(download_dir, (names or {}).get(fname, fname))
+                fh = open(path + '.part', 'wb')
+                decoder = TransferDecoder(p['encoding'])
+                targets.append((fname, p['section'], path, fh, decoder))
+                sinks[p['section']] = lambda chunk, fh=fh, decoder=decoder: fh.write(decoder.write(chunk))
+            self._ensure()
+            conn = self._get_connection()
+            try:
+                with self._watched(conn):
+                    received = stream_sections(conn, uid, sinks)
+                self._mark_alive(conn)
+            except StreamFetchError:
+                received = {}
+            except OperationCancelled:
+                raise
+            except (OSError, imaplib.IMAP4.error, ConnectionError):
+                # resposta interrompida: a conexão não é mais confiável
+                self._drop_connection()
+                received = {}
+            for _, _, _, fh, decoder in targets:
+                fh.write(decoder.flush())
+                fh.close()
+            if not all(received.get(section) for _, section, _, _, _ in targets):
+                return None
+            saved: List[Dict] = []
+            for fname, _, path, _, _ in targets:
+                if os.path.getsize(path + '.part') == 0:
+                    continue
+                os.replace(path + '.part', path)
+                saved.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
+            return saved
+        finally:
+            for _, _, path, fh, _ in targets:
+                fh.close()
+                if os.path.exists(path + '.part'):
+                    os.remove(path + '.part')
+
+    @staticmethod
+    def _plan_sections(structure, wanted: set) -> Optional[List[Tuple[str, Dict]]]:
+        """Escolhe as seções (filename, parte) a baixar; None se o BODYSTRUCTURE não servir."""
+        if structure is None:
+            return None
+        try:
+            parts = attachments_from_bodystructure(structure)
+        except ValueError:
+            return None
+        selected = []
+        for p in parts:
+            fname = _decode_header_value(p['filename'])
+            if not fname or (wanted and fname not in wanted):
+                continue
+            if p['encoding'] not in TRANSFER_ENCODINGS:
+                return None
+            selected.append((fname, p))
+        return selected
+
+    @staticmethod
+    def _save_sections(uid: str, data, selected: List[Tuple[str, Dict]], types_map: Dict[str, str],
+                       download_dir: str, names: Optional[Dict[str, str]] = None) -> Optional[List[Dict]]:
+        """Decodifica as seções da resposta do FETCH e grava os arquivos."""
+        import os
+        attrs = next((a for a in parse_fetch_response(data) if str(a.get('UID')) == uid), None)
+        if attrs is None:
+            return None
+        saved: List[Dict] = []
+        for fname, p in selected:
+            raw = fetch_section(attrs, f"BODY[{p['section']}]")
+            if raw is None:
+                return None
+            payload = decode_transfer_encoding(raw, p['encoding'])
+            if not payload:
                 continue
+            path = os.path.join(download_dir, (names or {}).get(fname, fname))
+            with open(path, 'wb') as f:
+                f.write(payload)
+            saved.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
+        return saved
+
+    def _download_from_full(self, uid: str, wanted: set, types_map: Dict[str, str],
+                            download_dir: str, names: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """Baixa a mensagem inteira e grava os anexos desejados."""
+        raw_email = self._fetch_full(uid)
+        if not raw_email:
+            return []
+        return self._save_from_raw(uid, raw_email, wanted, types_map, download_dir, names)
+
+    @classmethod
+    def _save_from_raw(cls, uid: str, buf, wanted: set, types_map: Dict[str, str], download_dir: str,
+                       names: Optional[Dict[str, str]] = None, start: int = 0,
+                       end: Optional[int] = None) -> List[Dict]:
+        """Como _save_from_message, mas localiza os anexos com a varredura MIME e
+        decodifica só o trecho de cada um (buf pode ser bytes ou mmap)."""
+        import os
+        _, parts = scan_attachments(buf, start, end)
+        selected = [(_decode_header_value(p['filename']), p) for p in parts]
+        selected = [(fname, p) for fname, p in selected if fname and (not wanted or fname in wanted)]
+        if any(p['encoding'] not in TRANSFER_ENCODINGS for _, p in selected):
+            # codificação que só o parser do email conhece (ex.: uuencode)
+            msg = email.message_from_bytes(bytes(buf[start:end]))
+            return cls._save_from_message(uid, msg, wanted, types_map, download_dir, names)
+        out: List[Dict] = []
+        for fname, p in selected:
+            payload = part_payload(buf, p)
+            if not payload:
+                continue
+            path = os.path.join(download_dir, (names or {}).get(fname, fname))
+            with open(path, 'wb') as f:
+                f.write(payload)
+            out.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
+        return out
+
+    @staticmethod
+    def _save_from_message(uid: str, msg, wanted: set, types_map: Dict[str, str],
+                           download_dir: str, names: Optional[Dict[str, str]] = None) -> List[Dict]:
+        """Grava os anexos desejados de uma mensagem já completa."""
+        import os
+        out: List[Dict] = []
+        if msg.is_multipart():
+            for part in msg.walk():
+                disp = str(part.get('Content-Disposition') or '')
+                if 'attachment' not in disp.lower():
+                    continue
+                fname = _decode_header_value(part.get_filename() or '')
+                if wanted and fname not in wanted:
+                    continue
+                payload = part.get_payload(decode=True) or b''
+                if not payload:
+                    continue
+                path = os.path.join(download_dir, (names or {}).get(fname, fname))
+                with open(path, 'wb') as f:
+                    f.write(payload)
+                out.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
+        else:
+            fname = _decode_header_value(msg.get_filename() or '')
+            if fname and (not wanted or fname in wanted):
+                payload = msg.get_payload(decode=True) or b''
+                if payload:
+                    path = os.path.join(download_dir, (names or {}).get(fname, fname))
+                    with open(path, 'wb') as f:
+                        f.write(payload)
+                    out.append({'uid': uid, 'filename': fname, 'path': path, 'type': types_map.get(fname, '')})
         return out
 
+    def mark_processed(self, uids: List[str]) -> int:
+        """Marca no servidor os emails cujos anexos já foram extraídos: rótulo
+        PROCESSED_LABEL (X-GM-LABELS) no Gmail, palavra-chave PROCESSED_KEYWORD nos
+        demais. Buscas com skip_processed deixam esses emails de fora, inclusive em
+        outras máquinas que usam a mesma caixa. Retorna quantos foram marcados."""
+        uids = sorted({str(u) for u in uids if str(u).isdigit()}, key=int)
+        if not uids:
+            return 0
+        self._ensure()
+        if self.has_gmail_extensions():
+            item, value = '+X-GM-LABELS', f'({imap_quote(PROCESSED_LABEL)})'
+        else:
+            item, value = '+FLAGS.SILENT', f'({PROCESSED_KEYWORD})'
+        marked = 0
+        for batch in chunked(uids, self.fetch_batch_size):
+            try:
+                status, data = self._uid('store', ','.join(batch), item, value)
+            except Exception as e:
+                status, data = 'NO', [str(e).encode()]
+            if status != 'OK':
+                log.warning("Servidor recusou a marcação de processados (%s): %s", item, _decode(data[-1]) if data else status)
+                break
+            marked += len(batch)
+        # as marcas mudam o resultado das buscas com skip_processed mesmo sem mudar UIDNEXT
+        self._search_memo.clear()
+        if self.cache is not None:
+            self.cache.clear_searches(self._account(), 'INBOX')
+        log.info("%d emails marcados como processados", marked)
+        return marked
+
+    @_cancellable
     def search_notes(
         self,
         note_types,  # List[str] ou str: 'PDF', 'XML' ou ambos
@@ -277,26 +783,40 @@ class GmailClient:
         progress_cb: Optional[Callable[[int, int], None]] = None,
         result_callback: Optional[Callable[[Dict], None]] = None,
         cancel_check: Optional[Callable[[], bool]] = None,
+        server_filter: bool = True,
+        skip_processed: bool = False,
+        prioritize_senders: bool = False,
+        skip_negative_senders: bool = False,
+        max_results: int = 0,
+        since: Optional[date] = None,
+        before: Optional[date] = None,
     ) -> List[Dict]:
         """Busca anexos PDF/XML nos últimos N emails, aplicando filtros.
         Retorna lista de dicts: {date, from, subject, filename, type, uid}
         Se result_callback for fornecido, chama-o progressivamente para cada resultado encontrado.
-        Se cancel_check for fornecido, verifica periodicamente se deve cancelar.
+        Se cancel_check for fornecido, verifica periodicamente se deve cancelar; um
+        CancelToken (modules/cancel_token.py) também interrompe o FETCH em andamento.
+        Com server_filter, as palavras-chave viram critérios do IMAP SEARCH e
+        só os emails devolvidos pelo servidor são verificados localmente.
+        Com skip_processed, emails marcados por mark_processed ficam de fora já
+        no SEARCH, então o trabalho acompanha só os emails novos.
+        Com o cache local, cada busca alimenta o histórico de remetentes; com
+        prioritize_senders, os emails de remetentes que já trouxeram notas são
+        examinados (e entregues ao result_callback) antes dos demais, e com
+        skip_negative_senders os remetentes que nunca trouxeram nota são pulados.
+        A lista retornada fica sempre na ordem da caixa (mais recente primeiro).
+        Condições de parada: max_results encerra a busca ao atingir tantos anexos
+        aceitos (o email em que o limite é atingido entra inteiro); since/before
+        (data de recebimento, before exclusivo) viram SINCE/BEFORE no servidor e,
+        com since, a janela não passa do primeiro email da data de corte.
+        Com o cache local, os resultados por email são salvos a cada 200 emails
+        examinados: numa busca cancelada ou interrompida, a próxima execução com
+        os mesmos filtros tira esses emails do cache e só busca o restante.
         """
         self._ensure()
-        status, data = self._uid('search', None, 'ALL')
-        if status != 'OK':
-            return []
-        all_uids = _decode(data[0]).split()
-        # Limitar para evitar scans gigantes que derrubam a conexão
         lim = int(limit)
         if lim <= 0:
             return []
-        # Cap suave para estabilidade (pode ser ajustado nas preferências futuramente)
-        MAX_SCAN = 5000
-        if lim > MAX_SCAN:
-            lim = MAX_SCAN
-        to_scan = list(reversed(all_uids[-lim:]))  # mais recente primeiro
         results: List[Dict] = []
 
         # Normaliza tipos
@@ -313,106 +833,510 @@ class GmailClient:
         if "XML" in types_set:
             target_exts.add('.xml')
 
-        print(f"[GMAIL] Buscando em {len(to_scan)} emails mais recentes")
-        print(f"[GMAIL] Tipos aceitos: {types_set}")
-        print(f"[GMAIL] Extensões aceitas: {target_exts}")
-        print(f"[GMAIL] Include keywords: {include_keywords}")
-        print(f"[GMAIL] Exclude keywords: {exclude_keywords}")
+        if since is not None:
+            # mensagens anteriores à data de corte não precisam nem entrar na janela
+            lim = min(lim, self._messages_since(since, lim))
+            if lim <= 0:
+                log.info("Nenhum email recebido desde %s", since.isoformat())
+                return []
+
+        to_scan = None
+        gmail = self.has_gmail_extensions()
+        if server_filter and gmail:
+            # Gmail: uma única consulta X-GM-RAW já devolve só emails com anexos candidatos,
+            # então não é preciso limitar a janela
+            raw_query = gmail_raw_query(target_exts, exclude_keywords, skip_processed,
+                                        since, before)
+            log.info("Consulta X-GM-RAW: %s", raw_query)
+            to_scan = self._search_window(lim, [], raw_query=raw_query)
+        if to_scan is None:
+            # Pré-filtro no servidor: emails com palavras de exclusão nem são examinados
+            criteria = build_search_criteria(exclude_keywords) if server_filter else []
+            if skip_processed:
+                criteria += processed_criteria(gmail)
+            criteria += date_criteria(since, before)
+            if criteria:
+                log.info("Critérios no servidor: %s", ' '.join(criteria))
+            to_scan = self._search_window(lim, criteria) or []  # mais recente primeiro
+
+        log.info("Buscando em %d emails (dentre os %d mais recentes)", len(to_scan), lim)
+        log.debug("Tipos aceitos: %s | extensões: %s", types_set, target_exts)
+        log.debug("Include keywords: %s | exclude keywords: %s", include_keywords, exclude_keywords)
 
+        # Cache local: resultados já avaliados com estes filtros e mensagens já listadas
+        known: Dict[str, Tuple[str, object]] = {}
+        use_cache = self._cache_ready()
+        position = {uid: i for i, uid in enumerate(to_scan)}
+        reordered = use_cache and (prioritize_senders or skip_negative_senders) and bool(to_scan)
+        if reordered:
+            to_scan = self._sender_order(lim, to_scan, prioritize_senders, skip_negative_senders)
         total = len(to_scan)
-        for idx, uid in enumerate(to_scan, start=1):
+        idx = 0
+        if use_cache:
+            account = self._account()
+            signature = filter_signature(target_exts, include_keywords, exclude_keywords)
+            for uid, accepted in self.cache.get_outcomes(account, 'INBOX', signature, to_scan).items():
+                known[uid] = ('outcome', accepted)
+            rest = [u for u in to_scan if u not in known]
+            for uid, message in self.cache.get_messages(account, 'INBOX', rest).items():
+                known[uid] = ('message', message)
+            if known:
+                log.info("%d de %d emails já estão no cache local", len(known), total)
+        cancelled = False
+        new_messages: List[Tuple[Dict, List[Tuple[str, str]]]] = []
+        new_outcomes: Dict[str, List[Dict]] = {}
+        sender_stats: Dict[str, Dict] = {}
+        # Palavras-chave compiladas uma vez para a busca inteira
+        include, exclude = KeywordMatcher(include_keywords), KeywordMatcher(exclude_keywords)
+
+        # Descoberta via BODYSTRUCTURE + cabeçalhos, em lote: corpo e anexos
+        # só são baixados depois, em download_attachments
+        if self.discovery_mode == 'structure':
+            fetch_items, batch_size = f'BODYSTRUCTURE {HEADER_FIELDS}', None
+        else:
+            fetch_items, batch_size = 'BODY.PEEK[]', 1
+        for uid, cached, attrs in self._iter_fetched(to_scan, fetch_items, known, batch_size):
+            if max_results and len(results) >= max_results:
+                log.info("Limite de %d anexos atingido após %d/%d emails", max_results, idx, total)
+                break
+            idx += 1
             # Verifica cancelamento
             if cancel_check and cancel_check():
-                print(f"[GMAIL] Busca cancelada pelo usuário após {idx-1}/{total} emails")
+                log.info("Busca cancelada pelo usuário após %d/%d emails", idx - 1, total)
+                cancelled = True
                 break
-                
+
             if progress_cb:
                 progress_cb(idx, total)
-            try:
-                # BODY.PEEK[] evita marcar como lido e é mais estável no Gmail
-                # Verificação periódica da conexão
-                if idx % 50 == 0:
-                    self._ensure()
-                status, msg_data = self._uid('fetch', uid, '(BODY.PEEK[])')
-                if status != 'OK' or not msg_data:
-                    continue
-                # Em algumas respostas há itens extra; filtra tuplas
-                tup = None
-                for part in msg_data:
-                    if isinstance(part, tuple):
-                        tup = part
-                        break
-                if not tup:
+            if cached is not None and cached[0] == 'outcome':
+                for item in cached[1]:
+                    results.append(item)
+                    if result_callback:
+                        result_callback(item)
+                continue
+            if cached is not None:
+                discovered = cached[1]
+            else:
+                discovered = self._discover(uid, attrs)
+                if discovered is None:
+                    # Pula mensagens com resposta inesperada
                     continue
-                raw_email = tup[1]
-                msg = email.message_from_bytes(raw_email)
+                new_messages.append(discovered)
+            header, attachments = discovered
+            accepted: List[Dict] = []
+            self._match_attachments(uid, header, attachments, target_exts,
+                                    include, exclude, accepted, result_callback)
+            results.extend(accepted)
+            new_outcomes[uid] = accepted
+            if use_cache:
+                self._count_sender(sender_stats, header, accepted)
+                if len(new_outcomes) >= 200:
+                    self._store_scan(signature, new_messages, new_outcomes, sender_stats)
+        if use_cache:
+            self._store_scan(signature, new_messages, new_outcomes, sender_stats)
+            if cancelled:
+                log.info("Progresso salvo; a próxima busca com estes filtros reaproveita os emails já examinados")
+        if reordered:
+            # sort estável: os anexos de um mesmo email mantêm a ordem
+            results.sort(key=lambda r: position.get(str(r['uid']), 0))
+        return results
+
+    def _messages_since(self, since: date, limit: int) -> int:
+        """Quantas das mensagens mais recentes começam na primeira recebida desde `since`
+        (SEARCH SINCE pelos números de sequência); `limit` se o servidor não responder."""
+        total = self._select_state().get('MESSAGES', 0)
+        conn = self._get_connection()
+        try:
+            with self._watched(conn):
+                status, data = conn.search(None, 'SINCE', imap_date(since))
+        except OperationCancelled:
+            raise
+        except Exception:
+            self._drop_connection()
+            return limit
+        if status != 'OK' or not data:
+            return limit
+        seqs = _decode(data[0]).split()
+        if not seqs:
+            return 0
+        return total - min(int(n) for n in seqs) + 1
+
+    def _sender_order(self, limit: int, to_scan: List[str], prioritize: bool, skip_negative: bool) -> List[str]:
+        """Reordena a janela pelo histórico de remetentes: primeiro os emails dos
+        remetentes que já trouxeram notas (UID SEARCH FROM ...), depois o resto.
+        Com skip_negative, tira da janela os emails de remetentes que nunca
+        trouxeram nota. O FROM do servidor compara por trecho do endereço, então
+        essa exclusão é aproximada (por isso é opcional)."""
+        account = self._account()
+        if skip_negative:
+            negative = self._uids_from(limit, self.cache.negative_senders(
+                account, self.negative_sender_min_scans, self.priority_senders))
+            skipped = [u for u in to_scan if u in negative]
+            if skipped:
+                log.info("%d emails de remetentes sem notas no histórico ignorados", len(skipped))
+                to_scan = [u for u in to_scan if u not in negative]
+        if prioritize:
+            priority = self._uids_from(limit, self.cache.top_senders(account, self.priority_senders))
+            first = [u for u in to_scan if u in priority]
+            if first:
+                log.info("%d emails de remetentes conhecidos examinados primeiro", len(first))
+                to_scan = first + [u for u in to_scan if u not in priority]
+        return to_scan
+
+    def _uids_from(self, limit: int, senders: List[str]) -> set:
+        """UIDs dentre as `limit` mensagens mais recentes enviados por algum dos endereços."""
+        uids: set = set()
+        for chunk in chunked(senders, self.sender_search_chunk):
+            criteria = sender_criteria(chunk)
+            if criteria:
+                uids.update(self._search_window(limit, [criteria]) or [])
+        return uids
+
+    @staticmethod
+    def _count_sender(stats: Dict[str, Dict], header: Dict, accepted: List[Dict]):
+        """Acumula o email examinado no histórico do remetente (gravado por _store_scan)."""
+        addr = sender_address(header.get('from', ''))
+        if not addr:
+            return
+        st = stats.setdefault(addr, {'scanned': 0, 'hits': 0, 'last_seen': None, 'last_hit': None})
+        day = message_day(header.get('date', ''))
+        st['scanned'] += 1
+        if day and day > (st['last_seen'] or ''):
+            st['last_seen'] = day
+        if accepted:
+            st['hits'] += 1
+            if day and day > (st['last_hit'] or ''):
+                st['last_hit'] = day
+
+    def _store_scan(self, signature: str, messages: List, outcomes: Dict[str, List[Dict]],
+                    senders: Optional[Dict[str, Dict]] = None):
+        """Grava no cache o que foi descoberto/avaliado e esvazia as listas."""
+        account = self._account()
+        if messages:
+            self.cache.put_messages(account, 'INBOX', messages)
+        if outcomes:
+            self.cache.put_outcomes(account, 'INBOX', signature, outcomes)
+        if senders:
+            self.cache.record_senders(account, senders)
+            senders.clear()
+        messages.clear()
+        outcomes.clear()
+
+    def _account(self) -> str:
+        return f"{self.user_email}|{self.server}"
+
+    def _cache_ready(self) -> bool:
+        """Valida o cache contra o UIDVALIDITY atual da INBOX (descarta se mudou)."""
+        if self.cache is None or self.uidvalidity is None:
+            return False
+        self.cache.validate(self._account(), 'INBOX', self.uidvalidity)
+        return True
+
+    def _cached_headers(self, uids: List[str]) -> Dict[str, Dict]:
+        if self.cache is None:
+            return {}
+        self._select_count()  # atualiza o UIDVALIDITY
+        if not self._cache_ready():
+            return {}
+        return self.cache.get_headers(self._account(), 'INBOX', uids)
+
+    def has_gmail_extensions(self) -> bool:
+        """True se o servidor anuncia X-GM-EXT-1 (X-GM-RAW, X-GM-LABELS...)."""
+        try:
+            return 'X-GM-EXT-1' in self._get_connection().capabilities
+        except Exception:
+            return False
+
+    def _search_window(self, limit: int, criteria: List[str],
+                       raw_query: Optional[str] = None) -> Optional[List[str]]:
+        """UIDs dentre as `limit` mensagens mais recentes que atendem aos critérios.
+        A caixa é percorrida do fim para o começo em intervalos de números de
+        sequência (ex.: 298001:300000) de até search_window_size mensagens, então
+        memória e tempo dependem de `limit`, não do tamanho da caixa. Retorna do
+        mais recente ao mais antigo.
+        Com raw_query, usa X-GM-RAW; retorna None se o servidor recusar a consulta.
+        """
+        state = self._select_state()
+        total = state.get('MESSAGES', 0)
+        if total <= 0:
+            return []
+        # Caixa no mesmo estado (UIDNEXT/MESSAGES/HIGHESTMODSEQ) da última busca igual: mesmos UIDs
+        query = json.dumps([int(limit), criteria, raw_query], ensure_ascii=False)
+        fingerprint = self._state_fingerprint(state)
+        if 'HIGHESTMODSEQ' not in state and (PROCESSED_KEYWORD in query or PROCESSED_LABEL in query):
+            # sem CONDSTORE, uma marcação (STORE) feita em outra máquina não muda o estado:
+            # buscas que dependem das marcas não podem ser reaproveitadas
+            fingerprint = None
+        memo = self._memo_get(query, fingerprint)
+        if memo is not None:
+            log.info("INBOX sem alterações desde a última busca; reutilizando %d UIDs", len(memo))
+            return memo
+        uids: List[str] = []
+        for seqs in sequence_windows(total, int(limit), self.search_window_size):
+            found = self._search_seq(seqs, criteria, raw_query)
+            if found is None:
+                return None if raw_query is not None else uids
+            uids.extend(found)
+        self._memo_put(query, fingerprint, uids)
+        return uids
+
+    def _search_seq(self, seqs: str, criteria: List[str], raw_query: Optional[str] = None) -> Optional[List[str]]:
+        """UID SEARCH restrito ao intervalo de sequência `seqs`; UIDs do mais recente ao
+        mais antigo, ou None se o servidor recusar o comando."""
+        if raw_query is not None:
+            try:
+                status, data = self._uid('search', 'CHARSET', 'UTF-8', seqs, *criteria,
+                                         'X-GM-RAW', _literal=raw_query.encode('utf-8'))
             except Exception:
-                # Pula mensagens com resposta inesperada
-                continue
+                status, data = 'NO', None
+        else:
+            status, data = self._uid('search', None, seqs, *criteria)
+        if status != 'OK' or not data:
+            return None
+        return sorted(_decode(data[0]).split(), key=int, reverse=True) if data[0] else []
 
-            subject = _decode_header_value(msg.get('Subject', ''))
-            from_ = _decode_header_value(msg.get('From', ''))
-            date_ = _decode_header_value(msg.get('Date', ''))
+    def _select_count(self) -> int:
+        """Reseleciona a INBOX e retorna a quantidade de mensagens (EXISTS)."""
+        return self._select_state().get('MESSAGES', 0)
 
-            # Filtros por palavras-chave (subject e from)
-            subj_from_text = f"{subject} {from_}".lower()
-            
-            # Verifica exclusões no subject/from primeiro
-            if exclude_keywords and any(k.lower() in subj_from_text for k in exclude_keywords):
+    def _select_state(self) -> Dict[str, int]:
+        """Reseleciona a INBOX e retorna MESSAGES (EXISTS), UIDVALIDITY, UIDNEXT e
+        HIGHESTMODSEQ informados nos códigos de resposta do SELECT."""
+        conn = self._get_connection()
+        try:
+            with self._watched(conn):
+                status, data = conn.select('INBOX')
+        except (OSError, imaplib.IMAP4.abort):
+            # socket quebrado: reconecta e repete o SELECT
+            self._drop_connection()
+            conn = self._get_connection()
+            with self._watched(conn):
+                status, data = conn.select('INBOX')
+        if status != 'OK' or not data:
+            return {}
+        self._mark_alive(conn)
+        state: Dict[str, int] = {}
+        try:
+            state['MESSAGES'] = int(_decode(data[0]))
+        except ValueError:
+            state['MESSAGES'] = 0
+        for code in STATE_KEYS[1:]:
+            try:
+                _, value = conn.response(code)
+                if value and value[-1]:
+                    state[code] = int(_decode(value[-1]).split()[0])
+            except (ValueError, TypeError, IndexError):
+                pass
+        if 'UIDVALIDITY' in state:
+            self.uidvalidity = state['UIDVALIDITY']
+        return state
+
+    def mailbox_status(self) -> Dict[str, int]:
+        """STATUS da INBOX (MESSAGES, UIDVALIDITY, UIDNEXT e, com CONDSTORE, HIGHESTMODSEQ)
+        em um único round trip. Retorna {} se o servidor não responder."""
+        self._ensure()
+        conn = self._get_connection()
+        items = list(STATE_KEYS if 'CONDSTORE' in conn.capabilities else STATE_KEYS[:3])
+        try:
+            status, data = conn.status('INBOX', f"({' '.join(items)})")
+        except Exception:
+            # socket quebrado: uma nova tentativa com outra conexão
+            self._drop_connection()
+            try:
+                conn = self._get_connection()
+                status, data = conn.status('INBOX', f"({' '.join(items)})")
+            except Exception:
+                return {}
+        if status != 'OK':
+            return {}
+        self._mark_alive(conn)
+        state = {k: v for k, v in parse_status_response(data).items() if k in STATE_KEYS}
+        if 'UIDVALIDITY' in state:
+            self.uidvalidity = state['UIDVALIDITY']
+        return state
+
+    def sync_mailbox(self) -> Dict:
+        """Compara a INBOX com a última sincronização usando um STATUS.
+        Se nada mudou (mesmo UIDVALIDITY, UIDNEXT, MESSAGES e HIGHESTMODSEQ), retorna
+        changed=False sem outros comandos. Senão, com CONDSTORE usa UID FETCH
+        (CHANGEDSINCE modseq [VANISHED]) para saber o que entrou, mudou ou foi
+        expurgado (VANISHED exige QRESYNC); sem CONDSTORE, só os UIDs novos.
+        Retorna {changed, messages, new, flags, vanished} (listas de UIDs).
+        """
+        prev = self._sync_state
+        if prev is None and self.cache is not None:
+            prev = self.cache.get_state(self._account(), 'INBOX')
+        state = self.mailbox_status()
+        result = {'changed': True, 'messages': state.get('MESSAGES', 0), 'new': [], 'flags': [], 'vanished': []}
+        if not state:
+            return result
+        if prev and prev.get('UIDVALIDITY') == state.get('UIDVALIDITY') and prev.get('UIDNEXT'):
+            if all(prev.get(k) == state.get(k) for k in STATE_KEYS):
+                result['changed'] = False
+            elif prev.get('HIGHESTMODSEQ') and state.get('HIGHESTMODSEQ'):
+                self._changes_since(prev, result)
+            elif state.get('UIDNEXT', 0) > prev['UIDNEXT']:
+                status, data = self._uid('search', None, 'UID', f"{prev['UIDNEXT']}:*")
+                if status == 'OK' and data and data[0]:
+                    result['new'] = [u for u in _decode(data[0]).split() if int(u) >= prev['UIDNEXT']]
+        if result['vanished'] and self._cache_ready():
+            self.cache.forget(self._account(), 'INBOX', result['vanished'])
+        self._sync_state = state
+        if self.cache is not None:
+            self.cache.put_state(self._account(), 'INBOX', state)
+        return result
+
+    def _changes_since(self, prev: Dict[str, int], result: Dict):
+        """Preenche new/flags/vanished com UID FETCH 1:* (CHANGEDSINCE n [VANISHED])."""
+        self._ensure()
+        conn = self._get_connection()
+        qresync = getattr(conn, 'qresync', False)
+        conn.response('VANISHED')  # descarta respostas antigas
+        modifier = f"(CHANGEDSINCE {prev['HIGHESTMODSEQ']}{' VANISHED' if qresync else ''})"
+        status, data = self._uid('fetch', '1:*', '(UID FLAGS)', modifier)
+        if status != 'OK':
+            return
+        # _uid pode ter reconectado: as respostas VANISHED ficam na conexão que respondeu
+        conn = self._get_connection()
+        for attrs in parse_fetch_response(data):
+            if not attrs.get('UID'):
                 continue
+            uid = str(attrs['UID'])
+            (result['new'] if int(uid) >= prev['UIDNEXT'] else result['flags']).append(uid)
+        if qresync:
+            _, vanished = conn.response('VANISHED')
+            for line in vanished or []:
+                text = _decode(line).replace('(EARLIER)', '').strip()
+                result['vanished'].extend(str(u) for u in expand_uid_set(text))
 
-            # Se há keywords de inclusão, verifica se o EMAIL (subject/from) contém alguma
-            # Isso permite encontrar notas fiscais mesmo que o nome do anexo não tenha as keywords
-            email_has_keyword = False
-            if include_keywords:
-                email_has_keyword = any(k.lower() in subj_from_text for k in include_keywords)
-                # Se o email não tem keywords, pula este email inteiro
-                if not email_has_keyword:
-                    continue
+    @staticmethod
+    def _state_fingerprint(state: Dict[str, int]) -> Optional[str]:
+        if 'UIDVALIDITY' not in state or 'UIDNEXT' not in state:
+            return None
+        return json.dumps([state.get(k) for k in STATE_KEYS])
 
-            attachments = self._iter_message_attachments(msg)
-            if attachments:
-                print(f"[GMAIL] UID {uid}: {len(attachments)} anexo(s) - {[f for f, _ in attachments]}")
-                if email_has_keyword:
-                    print(f"[GMAIL]   Email contém keywords - subject: '{subject[:50]}...'")
+    def _memo_get(self, query: str, fingerprint: Optional[str]) -> Optional[List[str]]:
+        if fingerprint is None:
+            return None
+        memo = self._search_memo.get(query)
+        if memo is not None and memo[0] == fingerprint:
+            return list(memo[1])
+        if self.cache is not None:
+            return self.cache.get_search(self._account(), 'INBOX', query, fingerprint)
+        return None
+
+    def _memo_put(self, query: str, fingerprint: Optional[str], uids: List[str]):
+        if fingerprint is None:
+            return
+        self._search_memo[query] = (fingerprint, list(uids))
+        if self.cache is not None:
+            self.cache.put_search(self._account(), 'INBOX', query, fingerprint, uids)
+
+    def _discover(self, uid: str, attrs: Optional[Dict]) -> Optional[Tuple[Dict, List[Tuple[str, str]]]]:
+        """Retorna (cabeçalhos, [(filename, content_type)]) de uma mensagem.
+        Usa o BODYSTRUCTURE quando disponível; senão baixa a mensagem completa.
+        """
+        if attrs is not None and attrs.get('BODYSTRUCTURE') is not None:
+            try:
+                parts = attachments_from_bodystructure(attrs['BODYSTRUCTURE'])
+                header = self._header_item(uid, email.message_from_bytes(fetch_section(attrs) or b''))
+                return header, [(_decode_header_value(p['filename']), p['content_type']) for p in parts]
+            except Exception:
+                pass
+        try:
+            raw_email = fetch_section(attrs) if attrs is not None else None
+            if not raw_email:
+                # BODY.PEEK[] evita marcar como lido e é mais estável no Gmail
+                raw_email = self._fetch_full(uid)
+            if not raw_email:
+                return None
+            return self._scan_raw(uid, raw_email)
+        except Exception:
+            return None
+
+    @classmethod
+    def _scan_raw(cls, uid: str, buf, start: int = 0,
+                  end: Optional[int] = None) -> Tuple[Dict, List[Tuple[str, str]]]:
+        """(cabeçalhos, [(filename, content_type)]) de uma mensagem bruta, pela varredura
+        MIME: só os cabeçalhos das partes são lidos, nenhum conteúdo é decodificado."""
+        hdr, parts = scan_attachments(buf, start, end)
+        return cls._header_item(uid, hdr), [(_decode_header_value(p['filename']), p['content_type']) for p in parts]
+
+    @staticmethod
+    def _match_attachments(uid: str, header: Dict, attachments: List[Tuple[str, str]],
+                           target_exts: set, include: KeywordMatcher, exclude: KeywordMatcher,
+                           results: List[Dict], result_callback: Optional[Callable[[Dict], None]]):
+        """Aplica os filtros de palavras-chave e extensão aos anexos de uma mensagem.
+        include/exclude comparam sem acentos nem maiúsculas (ver keyword_matcher)."""
+        subject = header['subject']
+        from_ = header['from']
+        date_ = header['date']
+
+        # Filtros por palavras-chave (subject e from), normalizados uma única vez
+        subj_from_text = fold(f"{subject} {from_}")
+
+        # Verifica exclusões no subject/from primeiro
+        if exclude.search_folded(subj_from_text):
+            return
+
+        # Se há keywords de inclusão, verifica se o EMAIL (subject/from) contém alguma
+        # Isso permite encontrar notas fiscais mesmo que o nome do anexo não tenha as keywords
+        email_has_keyword = False
+        if include:
+            email_has_keyword = include.search_folded(subj_from_text)
+            # Se o email não tem keywords, pula este email inteiro
+            if not email_has_keyword:
+                return
+
+        # Detalhes por anexo só no nível DEBUG; no nível padrão nada é formatado aqui
+        debug = log.isEnabledFor(logging.DEBUG)
+        if attachments and debug:
+            log.debug("UID %s: %d anexo(s) - %s", uid, len(attachments), [f for f, _ in attachments])
+            if email_has_keyword:
+                log.debug("  Email contém keywords - subject: '%s...'", subject[:50])
+        
+        for fname, ctype in attachments:
+            fname_l = (fname or '').lower()
+            if not fname_l:
+                if debug:
+                    log.debug("  - Anexo sem nome, pulando")
+                continue
+            if not any(fname_l.endswith(ext) for ext in target_exts):
+                if debug:
+                    log.debug("  - '%s' não termina com %s, pulando", fname, target_exts)
+                continue
             
-            for fname, ctype in attachments:
-                fname_l = (fname or '').lower()
-                if not fname_l:
-                    print(f"[GMAIL]   - Anexo sem nome, pulando")
-                    continue
-                if not any(fname_l.endswith(ext) for ext in target_exts):
-                    print(f"[GMAIL]   - '{fname}' não termina com {target_exts}, pulando")
-                    continue
-                
-                # Se o EMAIL já passou pelo filtro de keywords, aceita o anexo
-                # Caso contrário, verifica se o nome do arquivo contém keywords
-                if include_keywords and not email_has_keyword:
-                    # Email não tem keywords, verifica apenas o nome do arquivo
-                    file_has_keyword = any(k.lower() in fname_l for k in include_keywords)
-                    if not file_has_keyword:
-                        print(f"[GMAIL]   - '{fname}' não contém keywords {include_keywords}, pulando")
-                        continue
-                
-                # Exclusões: se alguma keyword de exclusão estiver no nome, pula
-                if exclude_keywords and any(k.lower() in fname_l for k in exclude_keywords):
-                    print(f"[GMAIL]   - '{fname}' contém keyword de exclusão, pulando")
+            # Se o EMAIL já passou pelo filtro de keywords, aceita o anexo
+            # Caso contrário, verifica se o nome do arquivo contém keywords
+            fname_folded = fold(fname)
+            if include and not email_has_keyword:
+                # Email não tem keywords, verifica apenas o nome do arquivo
+                file_has_keyword = include.search_folded(fname_folded)
+                if not file_has_keyword:
+                    if debug:
+                        log.debug("  - '%s' não contém keywords %s, pulando", fname, include.keywords)
                     continue
-                
-                print(f"[GMAIL]   ✓ '{fname}' ACEITO!")
-                result_item = {
-                    'uid': uid,
-                    'date': date_,
-                    'from': from_,
-                    'subject': subject,
-                    'filename': fname,
-                    'type': 'PDF' if fname_l.endswith('.pdf') else 'XML'
-                }
-                results.append(result_item)
-                # Callback progressivo
-                if result_callback:
-                    result_callback(result_item)
-        return results
+            
+            # Exclusões: se alguma keyword de exclusão estiver no nome, pula
+            if exclude.search_folded(fname_folded):
+                if debug:
+                    log.debug("  - '%s' contém keyword de exclusão, pulando", fname)
+                continue
+            
+            if debug:
+                log.debug("  ✓ '%s' ACEITO!", fname)
+            result_item = {
+                'uid': uid,
+                'date': date_,
+                'from': from_,
+                'subject': subject,
+                'filename': fname,
+                'type': 'PDF' if fname_l.endswith('.pdf') else 'XML'
+            }
+            results.append(result_item)
+            # Callback progressivo
+            if result_callback:
+                result_callback(result_item)
 
     def fetch_email(self, uid: str) -> Dict:
         """Baixa o email completo e retorna metadados, texto e HTML."""
@@ -432,7 +1356,11 @@ class GmailClient:
             msg = email.message_from_bytes(raw_email)
         except Exception as e:
             raise RuntimeError(f'Erro ao buscar email: {e}')
+        return self._email_dict(uid, msg)
 
+    @classmethod
+    def _email_dict(cls, uid: str, msg) -> Dict:
+        """Metadados, texto, HTML e mapa de imagens inline de uma mensagem."""
         subject = _decode_header_value(msg.get('Subject', ''))
         from_ = _decode_header_value(msg.get('From', ''))
         date_ = _decode_header_value(msg.get('Date', ''))
@@ -496,7 +1424,7 @@ class GmailClient:
                 except Exception:
                     body_text = "Erro ao decodificar conteúdo do email"
 
-        attachments = self._iter_message_attachments(msg)
+        attachments = cls._iter_message_attachments(msg)
         return {
             'uid': uid,
             'subject': subject,
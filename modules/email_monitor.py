@@ -0,0 +1,209 @@
+"""Monitor de novos emails na INBOX por IMAP IDLE (RFC 2177).
+
+Uma única conexão fica aberta em IDLE e o servidor avisa com "* N EXISTS"
+quando chega email, sem polling. O IDLE é renovado antes do limite de 29
+minutos dos servidores; se o servidor não anunciar IDLE, usa NOOP a cada
+`check_interval` segundos. Em qualquer falha a conexão é refeita com espera
+crescente.
+"""
+import imaplib
+import re
+import select
+import threading
+import time
+from typing import Callable, Optional
+
+from modules.app_logging import get_logger
+from modules.imap_response import refresh_capabilities
+
+_EXISTS = re.compile(rb'^\* (\d+) EXISTS', re.I)
+_EXPUNGE = re.compile(rb'^\* (\d+) EXPUNGE', re.I)
+log = get_logger('MONITOR')
+
+
+class EmailMonitor:
+    """Observa a INBOX em uma thread própria e chama `callback()` quando chegam emails."""
+
+    # Renova o IDLE antes dos 29 minutos de inatividade tolerados pelo servidor
+    idle_refresh = 25 * 60
+    # Intervalo para verificar o pedido de parada enquanto espera o servidor
+    poll_tick = 1.0
+
+    def __init__(self, email: str, password: str, check_interval: int = 300,
+                 server: str = 'imap.gmail.com', port: int = 993, timeout: Optional[float] = 30.0):
+        self.email = email
+        self.password = password
+        self.check_interval = max(5, int(check_interval))
+        self.server = server
+        self.port = int(port)
+        # Tempo máximo (s) de espera do servidor na conexão, no login e nos comandos;
+        # o IDLE não é afetado (a espera por emails novos usa select, ver _LineReader)
+        self.timeout = float(timeout) if timeout else None
+        self._callback: Optional[Callable[[], None]] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[imaplib.IMAP4] = None
+        self._known = 0
+        self._tag = 0
+        self.mode = ''  # 'idle' ou 'poll', conforme o servidor
+
+    def start_monitoring(self, callback: Callable[[], None]):
+        """Inicia o monitoramento em background."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._callback = callback
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='email-monitor', daemon=True)
+        self._thread.start()
+
+    def stop_monitoring(self):
+        """Para o monitoramento (responde em até ~1 s)."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+        self._thread = None
+
+    # --- laço principal ---
+    def _run(self):
+        backoff = 5
+        while not self._stop.is_set():
+            try:
+                self._connect()
+                backoff = 5
+                if self.mode == 'idle':
+                    self._idle_loop()
+                else:
+                    self._poll_loop()
+            except Exception as e:
+                if self._stop.is_set():
+                    break
+                log.warning("Conexão perdida (%s); nova tentativa em %ds", e, backoff)
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 300)
+            finally:
+                self._disconnect()
+
+    def _connect(self):
+        conn = imaplib.IMAP4_SSL(self.server, self.port, timeout=self.timeout)
+        _, login_data = conn.login(self.email, self.password)
+        refresh_capabilities(conn, login_data)
+        status, data = conn.select('INBOX', readonly=True)
+        if status != 'OK':
+            raise imaplib.IMAP4.error('Falha ao selecionar INBOX')
+        self._conn = conn
+        self._known = int(data[0]) if data and data[0] else 0
+        self.mode = 'idle' if 'IDLE' in conn.capabilities else 'poll'
+        log.info("Observando INBOX (%d emails, modo %s)", self._known, self.mode)
+
+    def _disconnect(self):
+        conn, self._conn = self._conn, None
+        if conn is None:
+            return
+        try:
+            conn.logout()
+        except Exception:
+            pass
+
+    def _notify(self):
+        if self._callback:
+            try:
+                self._callback()
+            except Exception as e:
+                log.error("Erro no callback: %s", e)
+
+    def _poll_loop(self):
+        """Sem IDLE: NOOP periódico; o servidor informa EXISTS na resposta."""
+        while not self._stop.wait(self.check_interval):
+            status, _ = self._conn.noop()
+            if status != 'OK':
+                raise imaplib.IMAP4.error('NOOP falhou')
+            _, exists = self._conn.response('EXISTS')
+            if exists and exists[-1]:
+                count = int(exists[-1])
+                if count > self._known:
+                    self._known = count
+                    self._notify()
+                else:
+                    self._known = count
+
+    # --- IDLE ---
+    def _idle_loop(self):
+        while not self._stop.is_set():
+            if self._idle_once():
+                self._notify()
+
+    def _idle_once(self) -> bool:
+        """Um ciclo de IDLE. Retorna True se chegou email novo.
+        Termina com DONE quando chega email, no limite idle_refresh ou na parada.
+        """
+        sock = self._conn.sock
+        self._tag += 1
+        tag = b'IDL%d' % self._tag
+        self._conn.send(tag + b' IDLE\r\n')
+        reader = _LineReader(sock)
+        line = reader.readline(self._stop, timeout=30)
+        if line is None or not line.startswith(b'+'):
+            raise imaplib.IMAP4.abort(f'IDLE recusado: {line!r}')
+        deadline = time.monotonic() + self.idle_refresh
+        arrived = False
+        while not self._stop.is_set() and time.monotonic() < deadline and not arrived:
+            line = reader.readline(self._stop, timeout=self.poll_tick)
+            if line is None:
+                continue
+            m = _EXISTS.match(line)
+            if m:
+                count = int(m.group(1))
+                arrived = count > self._known
+                self._known = count
+            elif _EXPUNGE.match(line):
+                self._known = max(0, self._known - 1)
+            elif line.upper().startswith(b'* BYE'):
+                raise imaplib.IMAP4.abort('Servidor encerrou a conexão')
+        self._conn.send(b'DONE\r\n')
+        # aguarda a conclusão do IDLE (mesmo durante a parada, por pouco tempo)
+        end = time.monotonic() + 10
+        while time.monotonic() < end:
+            line = reader.readline(None, timeout=self.poll_tick)
+            if line is None:
+                continue
+            m = _EXISTS.match(line)
+            if m:
+                count = int(m.group(1))
+                arrived = arrived or count > self._known
+                self._known = count
+            if line.startswith(tag + b' '):
+                if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                    raise imaplib.IMAP4.abort(f'IDLE terminou com erro: {line!r}')
+                return arrived
+        raise imaplib.IMAP4.abort('Servidor não concluiu o IDLE')
+
+
+class _LineReader:
+    """Leitura de linhas direto do socket, com timeout curto para poder parar.
+    Durante o IDLE o imaplib não tem dados pendentes, então ler o socket aqui
+    não rouba respostas dele.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = b''
+
+    def readline(self, stop: Optional[threading.Event], timeout: float) -> Optional[bytes]:
+        end = time.monotonic() + timeout
+        while b'\n' not in self.buf:
+            if stop is not None and stop.is_set():
+                return None
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                return None
+            pending = getattr(self.sock, 'pending', None)
+            if not (pending and pending()):
+                ready, _, _ = select.select([self.sock], [], [], min(remaining, 1.0))
+                if not ready:
+                    continue
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                raise imaplib.IMAP4.abort('Conexão encerrada pelo servidor')
+            self.buf += chunk
+        line, _, self.buf = self.buf.partition(b'\n')
+        return line.rstrip(b'\r')
@@ -0,0 +1,903 @@
+"""Servidor IMAP4rev1 local (falso) para testes e benchmarks do GmailClient.
+
+Serve uma caixa sintética em memória, sem TLS, com latência opcional por
+comando e contadores de round trips e bytes trafegados. Implementa apenas o
+subconjunto de IMAP usado pelo SimpleNFE (LOGIN, SELECT/EXAMINE, STATUS,
+SEARCH, FETCH, STORE, IDLE, ENABLE, CONDSTORE/QRESYNC e X-GM-RAW).
+"""
+import base64
+import email
+import email.message
+import email.utils
+import random
+import re
+import socketserver
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.header import Header, decode_header
+from typing import Any, Dict, List, Optional, Tuple
+
+CRLF = b'\r\n'
+
+# ----------------------------------------------------------------------------
+# Caixa de correio
+# ----------------------------------------------------------------------------
+
+
+class FakeMessage:
+    def __init__(self, uid: int, raw: bytes, internaldate: datetime, modseq: int,
+                 flags=None, labels=None):
+        self.uid = uid
+        self.raw = raw
+        self.internaldate = internaldate
+        self.modseq = modseq
+        self.flags = set(flags or [])
+        self.labels = set(labels or [])
+        self._tree = None
+        self._hdr = None
+
+    @property
+    def tree(self) -> '_Node':
+        if self._tree is None:
+            self._tree = _Node(self.raw)
+        return self._tree
+
+    @property
+    def headers(self) -> email.message.Message:
+        if self._hdr is None:
+            self._hdr = self.tree.hdr
+        return self._hdr
+
+
+class FakeMailbox:
+    """Caixa INBOX em memória, segura para várias sessões simultâneas."""
+
+    def __init__(self, uidvalidity: int = 1):
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.highestmodseq = 1
+        self.messages: List[FakeMessage] = []
+        self.expunged: List[Tuple[int, int]] = []  # (uid, modseq)
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+
+    def append(self, raw: bytes, internaldate: Optional[datetime] = None, flags=None) -> int:
+        with self.lock:
+            uid = self.uidnext
+            self.uidnext += 1
+            self.highestmodseq += 1
+            self.messages.append(FakeMessage(uid, raw, internaldate or datetime.now(timezone.utc),
+                                             self.highestmodseq, flags))
+            self.changed.notify_all()
+            return uid
+
+    def expunge(self, uid: int):
+        with self.lock:
+            self.highestmodseq += 1
+            self.messages = [m for m in self.messages if m.uid != uid]
+            self.expunged.append((uid, self.highestmodseq))
+            self.changed.notify_all()
+
+    def touch(self, msg: FakeMessage):
+        with self.lock:
+            self.highestmodseq += 1
+            msg.modseq = self.highestmodseq
+            self.changed.notify_all()
+
+
+# ----------------------------------------------------------------------------
+# Árvore MIME com offsets brutos (para BODYSTRUCTURE e BODY[n.m])
+# ----------------------------------------------------------------------------
+
+
+def _split_header(raw: bytes) -> Tuple[bytes, bytes]:
+    for sep in (b'\r\n\r\n', b'\n\n'):
+        idx = raw.find(sep)
+        if idx >= 0:
+            return raw[:idx + len(sep) // 2], raw[idx + len(sep):]
+    return raw, b''
+
+
+class _Node:
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        self.header, self.body = _split_header(raw)
+        self.hdr = email.message_from_bytes(self.header + b'\r\n')
+        self.children: List['_Node'] = []
+        if self.hdr.get_content_maintype() == 'multipart':
+            boundary = self.hdr.get_boundary()
+            if boundary:
+                self.children = [_Node(p) for p in _split_multipart(self.body, boundary.encode())]
+
+    def child(self, path: List[int]) -> Optional['_Node']:
+        node = self
+        for n in path:
+            if node.children:
+                if n < 1 or n > len(node.children):
+                    return None
+                node = node.children[n - 1]
+            elif n == 1 and node is self:
+                continue  # mensagem simples: seção 1 é o próprio corpo
+            else:
+                return None
+        return node
+
+
+def _split_multipart(body: bytes, boundary: bytes) -> List[bytes]:
+    delim = b'--' + boundary
+    parts = []
+    pos = body.find(delim)
+    if pos < 0:
+        return parts
+    while True:
+        line_end = body.find(b'\n', pos)
+        if line_end < 0:
+            break
+        if body[pos + len(delim):pos + len(delim) + 2] == b'--':
+            break
+        start = line_end + 1
+        nxt = body.find(b'\n' + delim, start)
+        if nxt < 0:
+            parts.append(body[start:])
+            break
+        end = nxt
+        if end > start and body[end - 1:end] == b'\r':
+            end -= 1
+        parts.append(body[start:end])
+        pos = nxt + 1
+    return parts
+
+
+def _q(value: Optional[str]) -> str:
+    if value is None:
+        return 'NIL'
+    value = str(value)
+    if any(ord(c) > 127 for c in value):
+        value = Header(value, 'utf-8').encode()
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _params(msg: email.message.Message, header: str) -> str:
+    params = msg.get_params(header=header) or []
+    out = []
+    for k, v in params[1:]:
+        if isinstance(v, tuple):
+            v = email.utils.collapse_rfc2231_value(v)
+        out.append(f"{_q(k.upper())} {_q(v)}")
+    return '(' + ' '.join(out) + ')' if out else 'NIL'
+
+
+def _bodystructure(node: _Node) -> str:
+    msg = node.hdr
+    disp = 'NIL'
+    if msg.get('Content-Disposition'):
+        dtype = (msg.get_content_disposition() or 'attachment').upper()
+        disp = f"({_q(dtype)} {_params(msg, 'content-disposition')})"
+    if node.children:
+        kids = ''.join(_bodystructure(c) for c in node.children)
+        return f"({kids} {_q(msg.get_content_subtype().upper())} {_params(msg, 'content-type')} {disp} NIL NIL)"
+    maintype = msg.get_content_maintype().upper()
+    subtype = msg.get_content_subtype().upper()
+    enc = (msg.get('Content-Transfer-Encoding') or '7BIT').strip().upper()
+    cid = msg.get('Content-ID')
+    size = len(node.body)
+    fields = f"{_q(maintype)} {_q(subtype)} {_params(msg, 'content-type')} {_q(cid)} NIL {_q(enc)} {size}"
+    if maintype == 'TEXT':
+        fields += ' ' + str(node.body.count(b'\n'))
+    return f"({fields} NIL {disp} NIL NIL)"
+
+
+def _section(msg: FakeMessage, spec: str) -> bytes:
+    spec = spec.strip()
+    up = spec.upper()
+    tree = msg.tree
+    if up == '':
+        return msg.raw
+    if up == 'TEXT':
+        return tree.body
+    if up == 'HEADER':
+        return tree.header + b'\r\n'
+    m = re.match(r'^((?:\d+\.)*)HEADER\.FIELDS(\.NOT)?\s*\((.*)\)$', up)
+    if m:
+        node = tree.child([int(x) for x in m.group(1).split('.') if x]) if m.group(1) else tree
+        names = {n.strip().lower() for n in m.group(3).split()}
+        neg = bool(m.group(2))
+        out = b''
+        for line in re.split(rb'\r?\n(?![ \t])', node.header.rstrip(b'\r\n')):
+            name = line.split(b':', 1)[0].strip().lower().decode('latin-1')
+            if (name in names) != neg:
+                out += line + CRLF
+        return out + CRLF
+    m = re.match(r'^([\d.]+?)(?:\.(MIME|HEADER|TEXT))?$', up)
+    if m:
+        node = tree.child([int(x) for x in m.group(1).split('.')])
+        if node is None:
+            return b''
+        if m.group(2) in ('MIME', 'HEADER'):
+            return node.header + b'\r\n'
+        if m.group(2) == 'TEXT':
+            return node.body
+        return node.body
+    return b''
+
+
+# ----------------------------------------------------------------------------
+# Geração de caixa sintética
+# ----------------------------------------------------------------------------
+
+_SUPPLIERS = ['nfe@fornecedor{:03d}.com.br'.format(i) for i in range(40)]
+_NOISE = ['news@loja{:02d}.com'.format(i) for i in range(20)]
+
+
+def _nfe_xml(rng: random.Random, n_items: int, pad: int) -> bytes:
+    dets = []
+    for i in range(1, n_items + 1):
+        q = rng.randint(1, 20)
+        v = round(rng.uniform(1, 500), 2)
+        dets.append(
+            f'<det nItem="{i}"><prod><xProd>Produto {rng.randint(1, 9999)}</xProd>'
+            f'<qCom>{q}</qCom><vUnCom>{v:.2f}</vUnCom><vProd>{q * v:.2f}</vProd></prod></det>'
+        )
+    body = ''.join(dets)
+    xml = ('<?xml version="1.0" encoding="UTF-8"?><nfeProc xmlns="http://www.portalfiscal.inf.br/nfe">'
+           f'<NFe><infNFe>{body}</infNFe></NFe><!--{"x" * pad}--></nfeProc>')
+    return xml.encode('utf-8')
+
+
+def _b64_lines(data: bytes) -> bytes:
+    enc = base64.b64encode(data)
+    return CRLF.join(enc[i:i + 76] for i in range(0, len(enc), 76))
+
+
+def build_message(subject: str, sender: str, date: datetime, text: str,
+                  attachments: List[Tuple[str, str, bytes]], boundary: str) -> bytes:
+    head = (
+        f"From: {sender}\r\n"
+        f"To: financeiro@example.com\r\n"
+        f"Subject: {Header(subject, 'utf-8').encode() if any(ord(c) > 127 for c in subject) else subject}\r\n"
+        f"Date: {email.utils.format_datetime(date)}\r\n"
+        f"Message-ID: <{boundary}@fake>\r\n"
+        "MIME-Version: 1.0\r\n"
+    ).encode()
+    if not attachments:
+        return head + b"Content-Type: text/plain; charset=utf-8\r\n\r\n" + text.encode('utf-8') + CRLF
+    out = head + f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n\r\n'.encode()
+    out += f"--{boundary}\r\nContent-Type: text/plain; charset=utf-8\r\n\r\n".encode() + text.encode('utf-8') + CRLF
+    for fname, ctype, payload in attachments:
+        out += (f"--{boundary}\r\nContent-Type: {ctype}; name=\"{fname}\"\r\n"
+                f"Content-Disposition: attachment; filename=\"{fname}\"\r\n"
+                "Content-Transfer-Encoding: base64\r\n\r\n").encode()
+        out += _b64_lines(payload) + CRLF
+    out += f"--{boundary}--\r\n".encode()
+    return out
+
+
+def generate_mailbox(count: int = 500, nfe_ratio: float = 0.3, xml_size: int = 8 * 1024,
+                     pdf_size: int = 64 * 1024, image_size: int = 128 * 1024,
+                     seed: int = 42, uidvalidity: int = 1) -> FakeMailbox:
+    """Gera uma caixa sintética com mistura de NF-e (XML+PDF), newsletters e anexos."""
+    rng = random.Random(seed)
+    box = FakeMailbox(uidvalidity)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    for i in range(count):
+        date = start + timedelta(hours=6 * i)
+        roll = rng.random()
+        boundary = f"b{seed}_{i}"
+        if roll < nfe_ratio:
+            num = rng.randint(1000, 99999)
+            sender = rng.choice(_SUPPLIERS)
+            xml = _nfe_xml(rng, rng.randint(1, 8), max(0, xml_size - 600))
+            pdf = b'%PDF-1.4\n' + bytes(rng.getrandbits(8) for _ in range(min(pdf_size, 2048))) * max(1, pdf_size // 2048)
+            atts = [(f"NFe{num}.xml", 'application/xml', xml), (f"DANFE{num}.pdf", 'application/pdf', pdf)]
+            raw = build_message(f"Nota fiscal eletrônica NF-e {num}", sender, date,
+                                "Segue NF-e em anexo.", atts, boundary)
+        elif roll < nfe_ratio + 0.2:
+            sender = rng.choice(_NOISE)
+            img = bytes(rng.getrandbits(8) for _ in range(256)) * max(1, image_size // 256)
+            raw = build_message(f"Promo da semana {i}", sender, date, "Ofertas imperdíveis!",
+                                [(f"banner{i}.png", 'image/png', img)], boundary)
+        else:
+            sender = rng.choice(_NOISE + ['colega@example.com'])
+            raw = build_message(f"Assunto qualquer {i}", sender, date, "Olá " * 50, [], boundary)
+        box.append(raw, date)
+    return box
+
+
+# ----------------------------------------------------------------------------
+# Parser de comandos
+# ----------------------------------------------------------------------------
+
+
+def _tokenize(data: bytes, literals: Optional[Dict[bytes, str]] = None) -> List[Any]:
+    pos = 0
+    stack: List[List[Any]] = [[]]
+    while pos < len(data):
+        c = data[pos:pos + 1]
+        if c in (b' ', b'\r', b'\n'):
+            pos += 1
+        elif c == b'(':
+            stack.append([])
+            pos += 1
+        elif c == b')':
+            lst = stack.pop()
+            stack[-1].append(lst)
+            pos += 1
+        elif c == b'"':
+            pos += 1
+            buf = bytearray()
+            while pos < len(data) and data[pos:pos + 1] != b'"':
+                if data[pos:pos + 1] == b'\\':
+                    pos += 1
+                buf += data[pos:pos + 1]
+                pos += 1
+            pos += 1
+            stack[-1].append(bytes(buf).decode('utf-8', errors='replace'))
+        elif c == b'\x00':
+            end = data.index(b'\x00', pos + 1)
+            stack[-1].append((literals or {}).get(data[pos + 1:end]))
+            pos = end + 1
+        else:
+            start = pos
+            depth = 0
+            while pos < len(data):
+                ch = data[pos:pos + 1]
+                if ch == b'[':
+                    depth += 1
+                elif ch == b']':
+                    depth -= 1
+                elif depth <= 0 and ch in (b' ', b'(', b')', b'\r', b'\n'):
+                    break
+                pos += 1
+            stack[-1].append(data[start:pos].decode('latin-1'))
+    return stack[0]
+
+
+
+def _parse_date(s: str) -> datetime:
+    return datetime.strptime(s, '%d-%b-%Y').replace(tzinfo=timezone.utc)
+
+
+def _seqset(spec: str, maxval: int) -> set:
+    out = set()
+    for piece in spec.split(','):
+        if ':' in piece:
+            a, b = piece.split(':', 1)
+            a = maxval if a == '*' else int(a)
+            b = maxval if b == '*' else int(b)
+            lo, hi = min(a, b), max(a, b)
+            out.update(range(lo, hi + 1))
+        else:
+            out.add(maxval if piece == '*' else int(piece))
+    return out
+
+
+def _decoded(msg: FakeMessage, name: str) -> str:
+    val = msg.headers.get(name, '') or ''
+    out = ''
+    for part, enc in decode_header(val):
+        out += part.decode(enc or 'utf-8', errors='ignore') if isinstance(part, bytes) else part
+    return out
+
+
+def _gm_raw_match(msg: FakeMessage, query: str) -> bool:
+    """Avaliação simplificada da sintaxe de busca do Gmail."""
+    subject = _decoded(msg, 'Subject').lower()
+    sender = _decoded(msg, 'From').lower()
+    names = [(n.hdr.get_filename() or '').lower() for n in _walk(msg.tree)]
+    names = [n for n in names if n]
+
+    def term(tok: str) -> bool:
+        low = tok.lower().strip()
+        if low == 'has:attachment':
+            return bool(names)
+        if low.startswith('filename:'):
+            alts = [a for a in re.split(r'[()\s]+', low[9:]) if a and a != 'or']
+            return any(n.endswith('.' + a) or a in n for a in alts for n in names)
+        if low.startswith('label:'):
+            return low[6:] in {lbl.lower() for lbl in msg.labels}
+        if low.startswith(('after:', 'before:')):
+            op, value = low.split(':', 1)
+            d = datetime.strptime(value, '%Y/%m/%d').replace(tzinfo=timezone.utc)
+            day = msg.internaldate.replace(hour=0, minute=0, second=0, microsecond=0)
+            return day >= d if op == 'after' else day < d
+        if low.startswith('subject:'):
+            return low[8:].strip('"') in subject
+        if low.startswith('from:'):
+            return low[5:].strip('"') in sender
+        return low.strip('"') in f"{subject} {sender}"
+
+    tokens = re.findall(r'-?\{[^}]*\}|-?[\w.-]+:\([^)]*\)|-?[\w.-]+:"[^"]*"|-?"[^"]*"|\S+', query)
+    for tok in tokens:
+        neg = tok.startswith('-')
+        if neg:
+            tok = tok[1:]
+        if tok.startswith('{'):
+            words = re.findall(r'[\w.-]+:"[^"]*"|"[^"]*"|\S+', tok[1:-1])
+            ok = any(term(w) for w in words)
+        else:
+            ok = term(tok)
+        if ok == neg:
+            return False
+    return True
+
+
+def _walk(node: _Node):
+    yield node
+    for c in node.children:
+        yield from _walk(c)
+
+
+# ----------------------------------------------------------------------------
+# Servidor
+# ----------------------------------------------------------------------------
+
+
+class _Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commands: Dict[str, int] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.connections = 0
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                'commands': dict(self.commands),
+                'round_trips': sum(self.commands.values()),
+                'bytes_in': self.bytes_in,
+                'bytes_out': self.bytes_out,
+                'connections': self.connections,
+            }
+
+    def reset(self):
+        with self.lock:
+            self.commands.clear()
+            self.bytes_in = self.bytes_out = self.connections = 0
+
+
+class _Session(socketserver.StreamRequestHandler):
+    server: 'FakeIMAPServer'
+
+    def setup(self):
+        super().setup()
+        self.selected = False
+        self.authenticated = False
+        self.qresync = False
+        # literais {n} recebidos no comando atual, referenciados por \x00<n>\x00
+        self.literals: Dict[bytes, str] = {}
+        with self.server.stats.lock:
+            self.server.stats.connections += 1
+
+    # -- I/O --
+    def _send(self, data: bytes):
+        with self.server.stats.lock:
+            self.server.stats.bytes_out += len(data)
+        self.wfile.write(data)
+
+    def _line(self, text) -> None:
+        if isinstance(text, str):
+            text = text.encode('utf-8')
+        self._send(text + CRLF)
+
+    def _read_command(self) -> Optional[bytes]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        self.literals = {}
+        data = b''
+        while True:
+            with self.server.stats.lock:
+                self.server.stats.bytes_in += len(line)
+            m = re.search(rb'\{(\d+)(\+?)\}\r?\n$', line)
+            if not m:
+                data += line
+                return data
+            data += line[:m.start()]
+            if not m.group(2):
+                self._line(b'+ go ahead')
+                self.wfile.flush()
+            lit = self.rfile.read(int(m.group(1)))
+            key = str(len(self.literals)).encode()
+            self.literals[key] = lit.decode('utf-8', errors='replace')
+            data += b'\x00' + key + b'\x00'
+            line = self.rfile.readline()
+
+    def handle(self):
+        caps = self.server.capabilities(False)
+        self._line(f"* OK [CAPABILITY {caps}] Fake IMAP pronto")
+        while True:
+            try:
+                raw = self._read_command()
+            except (ConnectionError, OSError):
+                return
+            if raw is None:
+                return
+            toks = _tokenize(raw, self.literals)
+            if len(toks) < 2:
+                self._line(b'* BAD comando vazio')
+                continue
+            tag, name, args = toks[0], str(toks[1]).upper(), toks[2:]
+            uid = False
+            if name == 'UID' and args:
+                uid, name, args = True, str(args[0]).upper(), args[1:]
+            key = f"UID {name}" if uid else name
+            with self.server.stats.lock:
+                self.server.stats.commands[key] = self.server.stats.commands.get(key, 0) + 1
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            try:
+                handler = getattr(self, f"cmd_{name.replace('-', '_').lower()}", None)
+                if handler is None:
+                    self._line(f"{tag} BAD comando desconhecido {name}")
+                else:
+                    result = handler(tag, args, uid)
+                    if result == 'LOGOUT':
+                        self.wfile.flush()
+                        return
+            except (ConnectionError, OSError):
+                return
+            except Exception as e:  # pragma: no cover - diagnóstico
+                self._line(f"{tag} BAD erro interno: {e}")
+            try:
+                self.wfile.flush()
+            except OSError:
+                return
+
+    # -- comandos --
+    def cmd_capability(self, tag, args, uid):
+        self._line(f"* CAPABILITY {self.server.capabilities(self.authenticated)}")
+        self._line(f"{tag} OK CAPABILITY concluído")
+
+    def cmd_login(self, tag, args, uid):
+        user = str(args[0]) if args else ''
+        pwd = str(args[1]) if len(args) > 1 else ''
+        if self.server.password is not None and pwd != self.server.password:
+            self._line(f"{tag} NO [AUTHENTICATIONFAILED] Invalid credentials (Failure)")
+            return
+        self.authenticated = True
+        if self.server.gmail_ext:
+            # como o Gmail: as capacidades pós-login vêm no próprio OK
+            self._line(f"{tag} OK [CAPABILITY {self.server.capabilities(True)}] {user} autenticado")
+        else:
+            self._line(f"{tag} OK {user} autenticado")
+
+    def cmd_noop(self, tag, args, uid):
+        if self.selected:
+            self._line(f"* {len(self.server.mailbox.messages)} EXISTS")
+        self._line(f"{tag} OK NOOP concluído")
+
+    def cmd_logout(self, tag, args, uid):
+        self._line(b'* BYE saindo')
+        self._line(f"{tag} OK LOGOUT concluído")
+        return 'LOGOUT'
+
+    def cmd_close(self, tag, args, uid):
+        self.selected = False
+        self._line(f"{tag} OK CLOSE concluído")
+
+    def cmd_enable(self, tag, args, uid):
+        names = [str(a).upper() for a in args]
+        enabled = [n for n in names if n in ('CONDSTORE', 'QRESYNC')]
+        if 'QRESYNC' in enabled and self.server.qresync:
+            self.qresync = True
+        self._line(f"* ENABLED {' '.join(enabled)}")
+        self._line(f"{tag} OK ENABLE concluído")
+
+    def cmd_select(self, tag, args, uid):
+        box = self.server.mailbox
+        with box.lock:
+            self.selected = True
+            self._line(b'* FLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft)')
+            self._line(b'* OK [PERMANENTFLAGS (\\Answered \\Flagged \\Deleted \\Seen \\Draft \\*)] Flags')
+            self._line(f"* {len(box.messages)} EXISTS")
+            self._line(b'* 0 RECENT')
+            self._line(f"* OK [UIDVALIDITY {box.uidvalidity}] UIDs válidos")
+            self._line(f"* OK [UIDNEXT {box.uidnext}] Próximo UID")
+            if self.server.condstore:
+                self._line(f"* OK [HIGHESTMODSEQ {box.highestmodseq}] modseq")
+            # QRESYNC: SELECT INBOX (QRESYNC (uidvalidity modseq))
+            if len(args) > 1 and isinstance(args[1], list) and self.qresync:
+                params = args[1]
+                if len(params) >= 2 and str(params[0]).upper() == 'QRESYNC' and isinstance(params[1], list):
+                    q = params[1]
+                    if int(q[0]) == box.uidvalidity:
+                        since = int(q[1])
+                        gone = [u for u, ms in box.expunged if ms > since]
+                        if gone:
+                            self._line(f"* VANISHED (EARLIER) {','.join(map(str, gone))}")
+                        for seq, m in enumerate(box.messages, start=1):
+                            if m.modseq > since:
+                                self._line(f"* {seq} FETCH (UID {m.uid} FLAGS ({' '.join(sorted(m.flags))}) MODSEQ ({m.modseq}))")
+            self._line(f"{tag} OK [READ-WRITE] SELECT concluído")
+
+    cmd_examine = cmd_select
+
+    def cmd_status(self, tag, args, uid):
+        box = self.server.mailbox
+        items = [str(a).upper() for a in (args[1] if len(args) > 1 and isinstance(args[1], list) else [])]
+        vals = {
+            'MESSAGES': len(box.messages), 'UIDNEXT': box.uidnext, 'UIDVALIDITY': box.uidvalidity,
+            'UNSEEN': sum(1 for m in box.messages if '\\Seen' not in m.flags), 'RECENT': 0,
+        }
+        if self.server.condstore:
+            vals['HIGHESTMODSEQ'] = box.highestmodseq
+        out = ' '.join(f"{k} {vals[k]}" for k in items if k in vals)
+        self._line(f"* STATUS {args[0]} ({out})")
+        self._line(f"{tag} OK STATUS concluído")
+
+    def cmd_idle(self, tag, args, uid):
+        box = self.server.mailbox
+        self._line(b'+ idling')
+        self.wfile.flush()
+        with box.lock:
+            known = len(box.messages)
+        sock = self.request
+        while True:
+            with box.lock:
+                if len(box.messages) != known:
+                    known = len(box.messages)
+                    self._line(f"* {known} EXISTS")
+                    self.wfile.flush()
+            import select as _select
+            r, _, _ = _select.select([sock], [], [], 0.05)
+            if r:
+                line = self.rfile.readline()
+                if not line or line.strip().upper() == b'DONE':
+                    break
+        self._line(f"{tag} OK IDLE terminado")
+
+    def _messages(self, spec: str, uid: bool) -> List[Tuple[int, FakeMessage]]:
+        box = self.server.mailbox
+        msgs = list(enumerate(box.messages, start=1))
+        if not msgs:
+            return []
+        if uid:
+            wanted = _seqset(spec, box.messages[-1].uid)
+            return [(s, m) for s, m in msgs if m.uid in wanted]
+        wanted = _seqset(spec, len(msgs))
+        return [(s, m) for s, m in msgs if s in wanted]
+
+    def _eval(self, keys: List[Any], seq: int, msg: FakeMessage, nmsgs: int) -> bool:
+        i = 0
+
+        def one() -> bool:
+            nonlocal i
+            k = keys[i]
+            i += 1
+            if isinstance(k, list):
+                return self._eval(k, seq, msg, nmsgs)
+            ku = str(k).upper()
+            if ku == 'ALL':
+                return True
+            if ku == 'NOT':
+                return not one()
+            if ku == 'OR':
+                a = one()
+                b = one()
+                return a or b
+            if ku in ('SUBJECT', 'FROM', 'TO'):
+                val = str(keys[i]).lower()
+                i += 1
+                return val in _decoded(msg, ku.capitalize()).lower()
+            if ku in ('BODY', 'TEXT'):
+                val = str(keys[i]).lower()
+                i += 1
+                return val.encode() in msg.raw.lower()
+            if ku == 'HEADER':
+                name, val = str(keys[i]), str(keys[i + 1]).lower()
+                i += 2
+                return val in _decoded(msg, name).lower()
+            if ku in ('SINCE', 'BEFORE', 'ON', 'SENTSINCE', 'SENTBEFORE'):
+                d = _parse_date(str(keys[i]))
+                i += 1
+                day = msg.internaldate.replace(hour=0, minute=0, second=0, microsecond=0)
+                if ku.endswith('SINCE'):
+                    return day >= d
+                if ku.endswith('BEFORE'):
+                    return day < d
+                return day == d
+            if ku in ('KEYWORD', 'UNKEYWORD'):
+                flag = str(keys[i]).lower()
+                i += 1
+                has = flag in {f.lower() for f in msg.flags}
+                return has if ku == 'KEYWORD' else not has
+            if ku in ('SEEN', 'UNSEEN'):
+                has = '\\Seen' in msg.flags
+                return has if ku == 'SEEN' else not has
+            if ku == 'UID':
+                wanted = _seqset(str(keys[i]), self.server.mailbox.messages[-1].uid)
+                i += 1
+                return msg.uid in wanted
+            if ku == 'MODSEQ':
+                val = int(keys[i])
+                i += 1
+                return msg.modseq >= val
+            if ku == 'LARGER':
+                val = int(keys[i])
+                i += 1
+                return len(msg.raw) > val
+            if ku == 'SMALLER':
+                val = int(keys[i])
+                i += 1
+                return len(msg.raw) < val
+            if ku == 'X-GM-RAW':
+                q = str(keys[i])
+                i += 1
+                return _gm_raw_match(msg, q)
+            if re.match(r'^[\d:*,]+$', ku):
+                return seq in _seqset(ku, nmsgs)
+            raise ValueError(f"chave de busca não suportada: {k}")
+
+        ok = True
+        while i < len(keys):
+            if not one():
+                ok = False
+        return ok
+
+    def cmd_search(self, tag, args, uid):
+        box = self.server.mailbox
+        if args and str(args[0]).upper() == 'CHARSET':
+            args = args[2:]
+        if 'X-GM-RAW' in [str(a).upper() for a in args if not isinstance(a, list)] and not self.server.gmail_ext:
+            self._line(f"{tag} BAD X-GM-RAW não suportado")
+            return
+        with box.lock:
+            msgs = list(enumerate(box.messages, start=1))
+            hits = [(s, m) for s, m in msgs if self._eval(args, s, m, len(msgs))]
+        nums = [str(m.uid if uid else s) for s, m in hits]
+        self._line(('* SEARCH ' + ' '.join(nums)).rstrip())
+        self._line(f"{tag} OK SEARCH concluído")
+
+    def cmd_fetch(self, tag, args, uid):
+        box = self.server.mailbox
+        spec = str(args[0])
+        items = args[1] if isinstance(args[1], list) else [args[1]]
+        changedsince = None
+        vanished = False
+        if len(args) > 2 and isinstance(args[2], list):
+            mods = [str(x).upper() if not isinstance(x, list) else x for x in args[2]]
+            for j, mod in enumerate(mods):
+                if mod == 'CHANGEDSINCE':
+                    changedsince = int(args[2][j + 1])
+                if mod == 'VANISHED':
+                    vanished = True
+        names = [str(x) for x in items]
+        if len(names) == 1 and names[0].upper() in ('ALL', 'FAST', 'FULL'):
+            names = ['FLAGS', 'INTERNALDATE', 'RFC822.SIZE']
+        with box.lock:
+            selected = self._messages(spec, uid)
+            if vanished and changedsince is not None and uid:
+                wanted = _seqset(spec, box.uidnext)
+                gone = [u for u, ms in box.expunged if ms > changedsince and u in wanted]
+                if gone:
+                    self._line(f"* VANISHED (EARLIER) {','.join(map(str, gone))}")
+            for seq, m in selected:
+                if changedsince is not None and m.modseq <= changedsince:
+                    continue
+                self._send_fetch(seq, m, names, uid, changedsince is not None)
+        self._line(f"{tag} OK FETCH concluído")
+
+    def _send_fetch(self, seq: int, m: FakeMessage, names: List[str], uid: bool, modseq: bool):
+        parts: List[bytes] = []
+        upper = [n.upper() for n in names]
+        if uid and 'UID' not in upper:
+            upper.insert(0, 'UID')
+            names.insert(0, 'UID')
+        if modseq and 'MODSEQ' not in upper:
+            names.append('MODSEQ')
+        for name in names:
+            nu = name.upper()
+            if nu == 'UID':
+                parts.append(f"UID {m.uid}".encode())
+            elif nu == 'FLAGS':
+                parts.append(f"FLAGS ({' '.join(sorted(m.flags))})".encode())
+            elif nu == 'INTERNALDATE':
+                parts.append(f'INTERNALDATE "{m.internaldate.strftime("%d-%b-%Y %H:%M:%S +0000")}"'.encode())
+            elif nu == 'RFC822.SIZE':
+                parts.append(f"RFC822.SIZE {len(m.raw)}".encode())
+            elif nu == 'MODSEQ':
+                parts.append(f"MODSEQ ({m.modseq})".encode())
+            elif nu == 'X-GM-LABELS':
+                parts.append(f"X-GM-LABELS ({' '.join(_q(lbl) for lbl in sorted(m.labels))})".encode())
+            elif nu in ('BODYSTRUCTURE', 'BODY'):
+                parts.append(f"{nu} {_bodystructure(m.tree)}".encode())
+            elif nu.startswith('BODY[') or nu.startswith('BODY.PEEK['):
+                inner = name[name.index('[') + 1:name.rindex(']')]
+                partial = re.search(r'<(\d+)(?:\.(\d+))?>$', name)
+                data = _section(m, inner)
+                label = f"BODY[{inner}]"
+                if partial:
+                    off = int(partial.group(1))
+                    ln = int(partial.group(2)) if partial.group(2) else len(data)
+                    data = data[off:off + ln]
+                    label += f"<{off}>"
+                if nu.startswith('BODY[') and '\\Seen' not in m.flags:
+                    m.flags.add('\\Seen')
+                parts.append(label.encode() + f" {{{len(data)}}}".encode() + CRLF + data)
+            elif nu == 'RFC822':
+                parts.append(f"RFC822 {{{len(m.raw)}}}".encode() + CRLF + m.raw)
+            elif nu == 'RFC822.HEADER':
+                data = m.tree.header + CRLF
+                parts.append(f"RFC822.HEADER {{{len(data)}}}".encode() + CRLF + data)
+        self._send(f"* {seq} FETCH (".encode() + b' '.join(parts) + b')' + CRLF)
+
+    def cmd_store(self, tag, args, uid):
+        box = self.server.mailbox
+        spec, op = str(args[0]), str(args[1]).upper()
+        vals = args[2] if isinstance(args[2], list) else [args[2]]
+        vals = [str(v) for v in vals]
+        silent = op.endswith('.SILENT')
+        with box.lock:
+            for seq, m in self._messages(spec, uid):
+                target = m.labels if 'X-GM-LABELS' in op else m.flags
+                if op.startswith('+'):
+                    target.update(vals)
+                elif op.startswith('-'):
+                    target.difference_update(vals)
+                else:
+                    target.clear()
+                    target.update(vals)
+                box.touch(m)
+                if not silent:
+                    self._line(f"* {seq} FETCH (UID {m.uid} FLAGS ({' '.join(sorted(m.flags))}))")
+        self._line(f"{tag} OK STORE concluído")
+
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """Servidor IMAP local. Use como context manager:
+
+        with FakeIMAPServer(generate_mailbox(1000), latency=0.02) as srv:
+            client = GmailClient('127.0.0.1', srv.port, 'u', 'p', use_ssl=False)
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox: Optional[FakeMailbox] = None, host: str = '127.0.0.1', port: int = 0,
+                 latency: float = 0.0, password: Optional[str] = None, gmail_ext: bool = False,
+                 idle: bool = True, condstore: bool = True, qresync: bool = True):
+        super().__init__((host, port), _Session)
+        self.mailbox = mailbox or FakeMailbox()
+        self.latency = latency
+        self.password = password
+        self.gmail_ext = gmail_ext
+        self.idle = idle
+        self.condstore = condstore
+        self.qresync = qresync
+        self.stats = _Stats()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def capabilities(self, authenticated: bool = True) -> str:
+        """Como o Gmail, ENABLE, UIDPLUS, CONDSTORE e QRESYNC só são anunciados depois do LOGIN."""
+        caps = ['IMAP4rev1', 'LITERAL+']
+        if self.idle:
+            caps.append('IDLE')
+        if self.gmail_ext:
+            caps.append('X-GM-EXT-1')
+        if authenticated:
+            caps.extend(['UIDPLUS', 'ENABLE'])
+            if self.condstore:
+                caps.append('CONDSTORE')
+            if self.qresync:
+                caps.append('QRESYNC')
+        return ' '.join(caps)
+
+    def start(self) -> 'FakeIMAPServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,66 @@
+"""Pool limitado de conexões IMAP autenticadas, compartilhado entre threads."""
+import queue
+import threading
+from typing import Callable, List, Optional
+
+
+class IMAPConnectionPool:
+    """Mantém até `size` conexões prontas (login + INBOX selecionada).
+    As conexões são criadas sob demanda pela `factory` e devolvidas com release().
+    """
+
+    def __init__(self, factory: Callable[[], object], size: int = 4):
+        self.factory = factory
+        self.size = max(1, int(size))
+        self._idle: "queue.LifoQueue" = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    def acquire(self, timeout: Optional[float] = None):
+        """Retorna uma conexão livre, criando uma nova se o limite permitir."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self.factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        return self._idle.get(timeout=timeout)
+
+    def release(self, conn, broken: bool = False):
+        """Devolve a conexão ao pool; conexões quebradas são descartadas."""
+        if conn is None or broken:
+            with self._lock:
+                self._created = max(0, self._created - 1)
+            if conn is not None:
+                self._close(conn)
+            return
+        self._idle.put(conn)
+
+    def close_all(self):
+        """Encerra todas as conexões ociosas."""
+        conns: List[object] = []
+        while True:
+            try:
+                conns.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        with self._lock:
+            self._created = max(0, self._created - len(conns))
+        for conn in conns:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.logout()
+        except Exception:
+            pass
@@ -0,0 +1,256 @@
+"""Utilitários para montar comandos e interpretar respostas IMAP do imaplib.
+
+O imaplib devolve as respostas de FETCH como uma lista "achatada" de bytes e
+tuplas (prefixo, literal). Aqui essa lista é remontada por mensagem e
+convertida em dicionários {ATRIBUTO: valor}, permitindo buscar vários UIDs
+em um único comando.
+"""
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+_MSG_START = re.compile(rb'^(\d+) \(')
+_LITERAL_END = re.compile(rb'\{(\d+)\}$')
+_CAPABILITY_CODE = re.compile(rb'\[CAPABILITY ([^\]]*)\]', re.I)
+# Marcador interno para literais (NUL não aparece em texto IMAP)
+_MARK = b'\x00'
+
+
+def uid_set(uids: Iterable) -> str:
+    """Compacta UIDs em um sequence-set IMAP (ex.: '1201:1300,1305')."""
+    nums = sorted({int(u) for u in uids})
+    if not nums:
+        return ''
+    ranges = []
+    start = prev = nums[0]
+    for n in nums[1:]:
+        if n == prev + 1:
+            prev = n
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = n
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ','.join(ranges)
+
+
+def expand_uid_set(text: str) -> List[int]:
+    """Expande um sequence-set de UIDs ('41,43:45') em uma lista ordenada."""
+    out = set()
+    for piece in (text or '').replace(' ', '').split(','):
+        if not piece:
+            continue
+        a, _, b = piece.partition(':')
+        try:
+            lo, hi = int(a), int(b or a)
+        except ValueError:
+            continue
+        out.update(range(min(lo, hi), max(lo, hi) + 1))
+    return sorted(out)
+
+
+def chunked(seq: Sequence, size: int) -> Iterator[List]:
+    """Divide uma sequência em blocos de até `size` itens."""
+    size = max(1, int(size))
+    for i in range(0, len(seq), size):
+        yield list(seq[i:i + size])
+
+
+def sequence_windows(total: int, count: int, size: int) -> Iterator[str]:
+    """Intervalos de números de sequência ('lo:hi') cobrindo as `count` últimas
+    mensagens de uma caixa com `total`, do fim para o começo, com até `size` cada."""
+    size = max(1, int(size))
+    first = max(1, total - int(count) + 1)
+    hi = total
+    while hi >= first:
+        lo = max(first, hi - size + 1)
+        yield f'{lo}:{hi}'
+        hi = lo - 1
+
+
+class _Tokenizer:
+    def __init__(self, text: bytes, literals: List[bytes]):
+        self.text = text
+        self.literals = literals
+        self.pos = 0
+
+    def _skip_spaces(self):
+        while self.pos < len(self.text) and self.text[self.pos:self.pos + 1] == b' ':
+            self.pos += 1
+
+    def parse_value(self) -> Any:
+        self._skip_spaces()
+        if self.pos >= len(self.text):
+            return None
+        ch = self.text[self.pos:self.pos + 1]
+        if ch == b'(':
+            self.pos += 1
+            out = []
+            while True:
+                self._skip_spaces()
+                if self.pos >= len(self.text):
+                    return out
+                if self.text[self.pos:self.pos + 1] == b')':
+                    self.pos += 1
+                    return out
+                out.append(self.parse_value())
+        if ch == b'"':
+            return self._parse_quoted()
+        if ch == _MARK:
+            end = self.text.index(_MARK, self.pos + 1)
+            idx = int(self.text[self.pos + 1:end])
+            self.pos = end + 1
+            return self.literals[idx]
+        return self._parse_atom()
+
+    def _parse_quoted(self) -> str:
+        self.pos += 1
+        buf = bytearray()
+        while self.pos < len(self.text):
+            c = self.text[self.pos:self.pos + 1]
+            if c == b'\\' and self.pos + 1 < len(self.text):
+                buf += self.text[self.pos + 1:self.pos + 2]
+                self.pos += 2
+                continue
+            self.pos += 1
+            if c == b'"':
+                break
+            buf += c
+        return bytes(buf).decode('utf-8', errors='replace')
+
+    def _parse_atom(self) -> Optional[str]:
+        start = self.pos
+        depth = 0
+        while self.pos < len(self.text):
+            c = self.text[self.pos:self.pos + 1]
+            if c == b'[':
+                depth += 1
+            elif c == b']':
+                depth = max(0, depth - 1)
+            elif depth == 0 and c in (b' ', b'(', b')'):
+                break
+            self.pos += 1
+        atom = self.text[start:self.pos].decode('latin-1')
+        if atom.upper() == 'NIL':
+            return None
+        return atom
+
+
+def _group_messages(data: Iterable) -> Iterator[tuple]:
+    """Agrupa os elementos do imaplib por mensagem: (texto com marcadores, literais)."""
+    text = b''
+    literals: List[bytes] = []
+    started = False
+    for part in data or []:
+        if part is None:
+            continue
+        if isinstance(part, tuple):
+            head = part[0] if isinstance(part[0], bytes) else bytes(str(part[0]), 'latin-1')
+            body = part[1] if len(part) > 1 else b''
+            if isinstance(body, str):
+                body = body.encode('utf-8', errors='ignore')
+        else:
+            head = part if isinstance(part, bytes) else bytes(str(part), 'latin-1')
+            body = None
+        if _MSG_START.match(head):
+            if started:
+                yield text, literals
+            text, literals, started = b'', [], True
+        elif not started:
+            continue
+        if body is not None:
+            head = _LITERAL_END.sub(b'', head)
+            head += _MARK + str(len(literals)).encode() + _MARK
+            literals.append(body)
+        text += head
+    if started:
+        yield text, literals
+
+
+def parse_fetch_response(data: Iterable) -> List[Dict[str, Any]]:
+    """Converte o retorno de conn.fetch/conn.uid('fetch') em uma lista de dicts.
+    Cada dict tem as chaves em maiúsculas (UID, FLAGS, BODYSTRUCTURE, BODY[...])
+    e 'SEQ' com o número de sequência. Literais viram bytes, strings viram str.
+    """
+    out: List[Dict[str, Any]] = []
+    for text, literals in _group_messages(data):
+        m = _MSG_START.match(text)
+        if not m:
+            continue
+        tok = _Tokenizer(text, literals)
+        tok.pos = len(m.group(1))
+        values = tok.parse_value()
+        if not isinstance(values, list):
+            continue
+        attrs: Dict[str, Any] = {'SEQ': m.group(1).decode()}
+        for i in range(0, len(values) - 1, 2):
+            key = values[i]
+            if not isinstance(key, str):
+                continue
+            # BODY.PEEK[...] sempre volta como BODY[...]
+            attrs[key.upper()] = values[i + 1]
+        out.append(attrs)
+    return out
+
+
+def parse_status_response(data: Iterable) -> Dict[str, int]:
+    """Converte '* STATUS INBOX (MESSAGES 10 UIDNEXT 11)' em {'MESSAGES': 10, 'UIDNEXT': 11}."""
+    out: Dict[str, int] = {}
+    for line in data or []:
+        if isinstance(line, tuple):
+            line = line[0]
+        if not isinstance(line, bytes):
+            continue
+        start = line.rfind(b'(')
+        items = line[start + 1:].rstrip(b')').split() if start >= 0 else []
+        for i in range(0, len(items) - 1, 2):
+            if items[i + 1].isdigit():
+                out[items[i].decode('latin-1').upper()] = int(items[i + 1])
+    return out
+
+
+def capability_code(data: Iterable) -> Optional[tuple]:
+    """Capacidades do código [CAPABILITY ...] de uma resposta (ex.: o OK do LOGIN),
+    em maiúsculas; None se a resposta não trouxer o código."""
+    for line in data or []:
+        if isinstance(line, tuple):
+            line = line[0]
+        if isinstance(line, str):
+            line = line.encode('utf-8', errors='ignore')
+        if not isinstance(line, bytes):
+            continue
+        m = _CAPABILITY_CODE.search(line)
+        if m:
+            return tuple(m.group(1).decode('latin-1').upper().split())
+    return None
+
+
+def refresh_capabilities(conn, login_data) -> tuple:
+    """Atualiza conn.capabilities (imaplib) depois do LOGIN. O imaplib guarda só as
+    capacidades da saudação, e servidores como o Gmail anunciam ENABLE, CONDSTORE
+    e QRESYNC só depois da autenticação. Usa o [CAPABILITY ...] do OK do LOGIN
+    quando o servidor o envia; senão, pergunta de novo com CAPABILITY."""
+    caps = capability_code(login_data)
+    if caps is None:
+        try:
+            typ, data = conn.capability()
+        except conn.error:
+            typ, data = 'NO', []
+        if typ == 'OK' and data and data[-1]:
+            line = data[-1] if isinstance(data[-1], bytes) else str(data[-1]).encode()
+            caps = tuple(line.decode('latin-1').upper().split())
+    if caps:
+        conn.capabilities = caps
+    return conn.capabilities
+
+
+def fetch_section(attrs: Dict[str, Any], prefix: str = 'BODY[') -> Optional[bytes]:
+    """Retorna o conteúdo da primeira seção BODY[...] encontrada nos atributos."""
+    prefix = prefix.upper()
+    for key, val in attrs.items():
+        if key.startswith(prefix):
+            if val is None:
+                return b''
+            if isinstance(val, str):
+                return val.encode('utf-8', errors='ignore')
+            if isinstance(val, bytes):
+                return val
+    return None
@@ -0,0 +1,67 @@
+"""UID FETCH de seções MIME lido em blocos, sem carregar o literal inteiro.
+
+O imaplib sempre lê cada literal {n} para um único bytes na memória. Aqui o
+comando é enviado e a resposta lida direto do arquivo da conexão (conn.file),
+repassando o conteúdo de cada BODY[seção] em blocos de `chunk_size` para um
+callback (ex.: decodificador + arquivo). A conexão continua utilizável pelo
+imaplib depois, pois a resposta é consumida até a linha marcada.
+"""
+import itertools
+import re
+from typing import Callable, Dict
+
+_LITERAL_SECTION = re.compile(rb'BODY\[([0-9.]*)\](?:<\d+>)? \{(\d+)\}\r?\n$', re.I)
+_QUOTED_SECTION = re.compile(rb'BODY\[([0-9.]*)\](?:<\d+>)? "((?:[^"\\]|\\.)*)"', re.I)
+_ANY_LITERAL = re.compile(rb'\{(\d+)\}\r?\n$')
+_tags = itertools.count(1)
+
+
+class StreamFetchError(Exception):
+    """O servidor recusou o FETCH ou a resposta veio em formato inesperado."""
+
+
+def stream_sections(conn, uid: str, sinks: Dict[str, Callable[[bytes], None]],
+                    chunk_size: int = 64 * 1024) -> Dict[str, bool]:
+    """Envia UID FETCH uid (BODY.PEEK[s1] BODY.PEEK[s2] ...) e entrega o conteúdo
+    bruto de cada seção a sinks[seção] em blocos. Retorna {seção: recebida}.
+    Levanta StreamFetchError se o servidor responder NO/BAD.
+    """
+    tag = b'STRM%d' % next(_tags)
+    items = ' '.join(f'BODY.PEEK[{s}]' for s in sinks)
+    conn.send(tag + f' UID FETCH {uid} (UID {items})\r\n'.encode('ascii'))
+    received = {s: False for s in sinks}
+    f = conn.file
+    while True:
+        line = f.readline()
+        if not line:
+            raise ConnectionError('Conexão encerrada durante o FETCH')
+        if line.startswith(tag + b' '):
+            if line[len(tag) + 1:].upper().startswith(b'OK'):
+                return received
+            raise StreamFetchError(line.decode('utf-8', errors='replace').strip())
+        # uma resposta pode ter vários literais: "... BODY[2] {n}" + dados + " BODY[3] {m}" ...
+        while True:
+            for m in _QUOTED_SECTION.finditer(line):
+                section = m.group(1).decode('ascii')
+                if section in sinks:
+                    sinks[section](re.sub(rb'\\(.)', rb'\1', m.group(2)))
+                    received[section] = True
+            m = _LITERAL_SECTION.search(line)
+            size = int(m.group(2)) if m else None
+            if size is None:
+                other = _ANY_LITERAL.search(line)
+                if other is None:
+                    break
+                size = int(other.group(1))
+            sink = sinks.get(m.group(1).decode('ascii')) if m else None
+            remaining = size
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    raise ConnectionError('Conexão encerrada durante o FETCH')
+                remaining -= len(chunk)
+                if sink is not None:
+                    sink(chunk)
+            if m and sink is not None:
+                received[m.group(1).decode('ascii')] = True
+            line = f.readline()
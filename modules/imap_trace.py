@@ -0,0 +1,311 @@
+"""Gravação e reprodução do tráfego IMAP de uma sessão do GmailClient.
+
+TraceRecorder grava em um arquivo JSON Lines (gzip se o nome terminar em .gz)
+tudo o que cada conexão envia e recebe, com o tempo de cada evento. O comando
+LOGIN é gravado como LOGIN "user" "password" e o endereço do usuário é trocado
+nas linhas de protocolo do servidor; o conteúdo das mensagens fica intacto.
+
+TraceReplay entrega a gravação de volta sem rede: cada comando do cliente é
+respondido com a resposta gravada para o mesmo comando (sem a tag), então não
+importa em qual conexão do pool ele cai. Com time_scale=0 responde na hora
+(mede só o custo de CPU de parsing e filtros); com 1.0 repete o tempo de
+resposta original do servidor.
+
+Os dois se ligam ao GmailClient pelo parâmetro `transport`:
+
+    rec = TraceRecorder('sessao.jsonl.gz')
+    client = GmailClient(server, port, email, senha, transport=rec)
+    ...
+    rec.close()
+
+    client = GmailClient(server, port, 'user', 'password', transport=TraceReplay('sessao.jsonl.gz'))
+
+A reprodução só é fiel se o cliente repetir os mesmos comandos: grave e
+reproduza sem cache local nem repositório de anexos e com os mesmos filtros.
+"""
+import base64
+import gzip
+import imaplib
+import itertools
+import json
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Deque, Dict, List, Optional, Tuple
+
+from modules.app_logging import get_logger
+
+TRACE_FORMAT = 'simplenfe-imap-trace'
+TRACE_VERSION = 1
+
+_LOGIN = re.compile(rb'^(\S+) LOGIN (?:"((?:[^"\\]|\\.)*)"|(\S+)) ', re.I)
+_LITERAL = re.compile(rb'\{(\d+)(\+?)\}$')
+
+log = get_logger('TRACE')
+
+
+def _open(path: str, mode: str):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def scrub_login(data: bytes) -> Tuple[bytes, Optional[bytes]]:
+    """(comando sem credenciais, usuário encontrado) para um comando LOGIN."""
+    m = _LOGIN.match(data)
+    if m is None:
+        return data, None
+    return m.group(1) + b' LOGIN "user" "password"\r\n', m.group(2) or m.group(3)
+
+
+def _command_key(data: bytes) -> bytes:
+    """Comando sem a tag (chave para achar a resposta gravada)."""
+    data = scrub_login(bytes(data))[0]
+    parts = data.split(b' ', 1)
+    return parts[1] if len(parts) > 1 else b''
+
+
+# ----------------------------------------------------------------------------
+# Gravação
+# ----------------------------------------------------------------------------
+
+
+class _RecordingFile:
+    """Envolve conn.file: linhas (readline) e literais (read) lidos pelo cliente são gravados."""
+
+    def __init__(self, inner, emit):
+        self._inner = inner
+        self._emit = emit
+
+    def readline(self, *args):
+        line = self._inner.readline(*args)
+        if line:
+            self._emit('S', line)
+        return line
+
+    def read(self, *args):
+        data = self._inner.read(*args)
+        if data:
+            self._emit('L', data)
+        return data
+
+    def close(self):
+        self._inner.close()
+
+
+class TraceRecorder:
+    """Grava todas as conexões abertas por open_connection em um único arquivo."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._t0 = time.monotonic()
+        self._secrets: List[bytes] = []
+        self._fh = _open(path, 'w')
+        self._write({'format': TRACE_FORMAT, 'version': TRACE_VERSION,
+                     'created': datetime.now().isoformat(timespec='seconds')})
+
+    def _write(self, obj: Dict):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.write(json.dumps(obj) + '\n')
+
+    def _event(self, conn_id: int, kind: str, data: bytes):
+        if kind == 'C':
+            data, user = scrub_login(data)
+            if user and user not in self._secrets:
+                self._secrets.append(user)
+        elif kind == 'S':
+            for secret in self._secrets:
+                data = data.replace(secret, b'user')
+        self._write({'c': conn_id, 't': round(time.monotonic() - self._t0, 6), 'k': kind,
+                     'b': base64.b64encode(data).decode('ascii')})
+
+    def open_connection(self, host: str, port: int, use_ssl: bool = True,
+                        timeout: Optional[float] = None) -> imaplib.IMAP4:
+        recorder = self
+        conn_id = next(self._ids)
+        base = imaplib.IMAP4_SSL if use_ssl else imaplib.IMAP4
+
+        class RecordingIMAP(base):
+            def open(self, *args, **kwargs):
+                super().open(*args, **kwargs)
+                self.file = _RecordingFile(self.file, lambda k, d: recorder._event(conn_id, k, d))
+
+            def send(self, data):
+                recorder._event(conn_id, 'C', bytes(data))
+                super().send(data)
+
+        return RecordingIMAP(host, port, timeout=timeout)
+
+    def close(self):
+        with self._lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+        log.info("Tráfego IMAP gravado em %s", self.path)
+
+
+# ----------------------------------------------------------------------------
+# Reprodução
+# ----------------------------------------------------------------------------
+
+
+def load_exchanges(path: str) -> Tuple[bytes, Dict[bytes, Deque[Dict]]]:
+    """Lê uma gravação e monta (saudação, {comando sem tag: fila de respostas})."""
+    events: Dict[int, List[Tuple[float, str, bytes]]] = {}
+    with _open(path, 'r') as f:
+        header = json.loads(f.readline() or '{}')
+        if header.get('format') != TRACE_FORMAT:
+            raise ValueError(f'{path} não é uma gravação de tráfego IMAP')
+        for line in f:
+            if line.strip():
+                ev = json.loads(line)
+                events.setdefault(ev['c'], []).append((ev['t'], ev['k'], base64.b64decode(ev['b'])))
+    greeting = b''
+    exchanges: Dict[bytes, Deque[Dict]] = {}
+    for conn_events in events.values():
+        conn_greeting = bytearray()
+        cur: Optional[Dict] = None
+        for t, kind, data in conn_events:
+            if kind == 'C':
+                if cur is None:
+                    cur = {'tag': data.split(b' ', 1)[0], 'cmd': bytearray(), 'resp': bytearray(), 't': t}
+                cur['cmd'] += data
+                cur['t'] = t
+                continue
+            if cur is None:
+                conn_greeting += data
+            elif kind == 'S' and data.startswith(cur['tag'] + b' '):
+                exchanges.setdefault(_command_key(cur['cmd']), deque()).append({
+                    'untagged': bytes(cur['resp']),
+                    'tail': data[len(cur['tag']) + 1:],
+                    'dt': max(0.0, t - cur['t']),
+                })
+                cur = None
+            elif kind == 'S' and data.startswith(b'+'):
+                continue  # continuação de literal: a reprodução gera a sua
+            else:
+                cur['resp'] += data
+        if not greeting and conn_greeting:
+            greeting = bytes(conn_greeting)
+    return greeting, exchanges
+
+
+class _ReplayFile:
+    """Buffer lido pelo imaplib (readline/read) e alimentado pelas respostas gravadas."""
+
+    def __init__(self):
+        self._buf = bytearray()
+        self._pos = 0
+
+    def feed(self, data: bytes):
+        if self._pos:
+            del self._buf[:self._pos]
+            self._pos = 0
+        self._buf += data
+
+    def readline(self, limit: int = -1) -> bytes:
+        end = self._buf.find(b'\n', self._pos)
+        end = len(self._buf) if end < 0 else end + 1
+        if limit is not None and limit >= 0:
+            end = min(end, self._pos + limit)
+        data = bytes(self._buf[self._pos:end])
+        self._pos = end
+        return data
+
+    def read(self, size: int = -1) -> bytes:
+        end = len(self._buf) if size is None or size < 0 else min(len(self._buf), self._pos + size)
+        data = bytes(self._buf[self._pos:end])
+        self._pos = end
+        return data
+
+    def close(self):
+        pass
+
+
+class TraceReplay:
+    """Reproduz uma gravação: cada conexão aberta recebe a saudação gravada e
+    cada comando, a resposta gravada para ele. `misses` conta comandos que não
+    estavam na gravação (respondidos com BAD)."""
+
+    def __init__(self, path: str, time_scale: float = 0.0):
+        self.path = path
+        self.time_scale = max(0.0, float(time_scale))
+        self.greeting, self._exchanges = load_exchanges(path)
+        self._lock = threading.Lock()
+        self.misses = 0
+        log.info("Gravação %s: %d comandos distintos", path, len(self._exchanges))
+
+    def _answer(self, command: bytes) -> Tuple[bytes, bytes, float]:
+        """(respostas não marcadas, resto da linha marcada, tempo gravado)."""
+        key = _command_key(command)
+        with self._lock:
+            queue = self._exchanges.get(key)
+            if queue:
+                # repetições além das gravadas reaproveitam a última resposta
+                ex = queue.popleft() if len(queue) > 1 else queue[0]
+                return ex['untagged'], ex['tail'], ex['dt']
+            verb = key.split(b' ', 1)[0].strip().upper()
+            if verb in (b'NOOP', b'CHECK'):
+                return b'', b'OK ' + verb + b' completed\r\n', 0.0
+            if verb == b'LOGOUT':
+                return b'* BYE replay\r\n', b'OK LOGOUT completed\r\n', 0.0
+            self.misses += 1
+        log.warning("Comando ausente da gravação: %.120r", key)
+        return b'', b'BAD comando ausente da gravacao\r\n', 0.0
+
+    def open_connection(self, host: str, port: int, use_ssl: bool = True,
+                        timeout: Optional[float] = None) -> imaplib.IMAP4:
+        replay = self
+
+        class ReplayIMAP(imaplib.IMAP4):
+            def open(self, host='', port=imaplib.IMAP4_PORT, timeout=None):
+                self.host, self.port = host, port
+                self.sock = None
+                self.file = _ReplayFile()
+                self.file.feed(replay.greeting)
+                self._pending = bytearray()
+                self._acked = 0
+
+            def send(self, data):
+                self._pending += data
+                complete, literals = _command_complete(self._pending)
+                # literal síncrono {n}: o cliente espera o "+" antes de enviar os dados
+                if literals > self._acked:
+                    self.file.feed(b'+ go ahead\r\n' * (literals - self._acked))
+                    self._acked = literals
+                if not complete:
+                    return
+                command, self._pending, self._acked = bytes(self._pending), bytearray(), 0
+                tag = command.split(b' ', 1)[0]
+                untagged, tail, dt = replay._answer(command)
+                if replay.time_scale and dt:
+                    time.sleep(dt * replay.time_scale)
+                self.file.feed(untagged + tag + b' ' + tail)
+
+            def shutdown(self):
+                self.file.close()
+
+        return ReplayIMAP(host, port)
+
+
+def _command_complete(buf: bytearray) -> Tuple[bool, int]:
+    """(comando completo?, literais síncronos já anunciados) para os bytes enviados até agora."""
+    pos = 0
+    literals = 0
+    while True:
+        eol = buf.find(b'\r\n', pos)
+        if eol < 0:
+            return False, literals
+        m = _LITERAL.search(bytes(buf[pos:eol]))
+        if m is None:
+            return eol + 2 == len(buf), literals
+        if not m.group(2):
+            literals += 1
+        pos = eol + 2 + int(m.group(1))
+        if pos > len(buf):
+            return False, literals
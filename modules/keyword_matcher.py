@@ -0,0 +1,52 @@
+"""Filtro de palavras-chave compilado uma vez por busca.
+
+As palavras e os textos examinados (assunto, remetente, nome do anexo) são
+normalizados com NFKD sem acentos + casefold, então "eletrônica", "Eletronica"
+e "ELETRÔNICA" casam entre si. Todas as palavras viram uma única expressão
+regular organizada como trie (n(?:f(?:ce|e)|ota)), de modo que o custo por
+caractere quase não cresce mesmo com centenas de nomes de fornecedores.
+"""
+import re
+import unicodedata
+from typing import Dict, Iterable, List, Optional
+
+
+def fold(text: Optional[str]) -> str:
+    """Remove acentos (NFKD sem marcas combinantes) e aplica casefold."""
+    if not text:
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def _trie_pattern(node: Dict) -> str:
+    # '' marca o fim de uma palavra; como basta conter alguma palavra, o resto
+    # do ramo (palavras mais longas com o mesmo início) é redundante
+    if '' in node:
+        return ''
+    branches = [re.escape(ch) + _trie_pattern(child) for ch, child in sorted(node.items())]
+    return branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+
+
+class KeywordMatcher:
+    """Verifica se um texto contém alguma das palavras-chave (após fold)."""
+
+    def __init__(self, keywords: Iterable[str]):
+        self.keywords: List[str] = [k for k in (keywords or []) if k and k.strip()]
+        trie: Dict = {}
+        for word in {fold(k.strip()) for k in self.keywords}:
+            node = trie
+            for ch in word:
+                node = node.setdefault(ch, {})
+            node[''] = {}
+        self._regex = re.compile(_trie_pattern(trie)) if trie else None
+
+    def __bool__(self) -> bool:
+        return self._regex is not None
+
+    def search_folded(self, folded: str) -> bool:
+        """Como search(), para um texto já passado por fold()."""
+        return self._regex is not None and self._regex.search(folded) is not None
+
+    def search(self, text: Optional[str]) -> bool:
+        return self.search_folded(fold(text))
@@ -0,0 +1,281 @@
+"""Fonte de emails offline: exportação .mbox (Google Takeout), pasta Maildir ou arquivos .eml.
+
+O .mbox é mapeado em memória (mmap) e dividido em mensagens pelos offsets das
+linhas "From " de separação, sem carregar o arquivo inteiro: só a mensagem
+examinada é copiada para a memória. MailArchive tem a mesma interface pública
+do GmailClient (list_recent, search_notes, download_attachments, fetch_email),
+com a mesma descoberta de anexos e os mesmos filtros de palavras-chave, então a
+interface e a CLI processam um arquivo de vários GB na velocidade do disco.
+
+Os "UIDs" são as posições das mensagens no arquivo (1, 2, 3...); as últimas
+posições são tratadas como as mais recentes, como na INBOX.
+"""
+import email
+import mmap
+import os
+from datetime import date
+from typing import Callable, Dict, List, Optional, Tuple
+
+from modules.app_logging import get_logger
+from modules.attachment_store import AttachmentStore, unique_names
+from modules.email_gmail import GmailClient
+from modules.keyword_matcher import KeywordMatcher
+from modules.mail_cache import message_day
+from modules.mime_scan import header_end
+
+MBOX_EXTS = ('.mbox', '.mbx')
+EML_EXTS = ('.eml',)
+
+log = get_logger('ARQUIVO')
+
+
+def is_maildir(path: str) -> bool:
+    return os.path.isdir(os.path.join(path, 'cur')) or os.path.isdir(os.path.join(path, 'new'))
+
+
+def mbox_spans(buf, size: int) -> List[Tuple[int, int]]:
+    """[(início, fim)] de cada mensagem do mbox, sem a linha "From " separadora."""
+    spans: List[Tuple[int, int]] = []
+    pos = 0 if buf[:5] == b'From ' else buf.find(b'\nFrom ')
+    while 0 <= pos < size:
+        if buf[pos:pos + 1] == b'\n':
+            pos += 1
+        start = buf.find(b'\n', pos)
+        if start < 0:
+            break
+        start += 1
+        nxt = buf.find(b'\nFrom ', start)
+        end = size if nxt < 0 else nxt
+        # a linha em branco antes do separador não faz parte da mensagem
+        if end > start and buf[end - 1:end] == b'\r':
+            end -= 1
+        if end > start:
+            spans.append((start, end))
+        pos = nxt
+    return spans
+
+
+class MailArchive:
+    """Emails de um .mbox, de uma pasta Maildir (cur/ e new/), de .eml avulsos ou
+    de uma pasta com .mbox/.eml, com a interface de leitura do GmailClient."""
+
+    def __init__(self, path: str, store: Optional[AttachmentStore] = None):
+        self.path = os.path.abspath(path)
+        # Repositório de anexos: só para anotar o sha256 (cache de extração), o arquivo já é local
+        self.store = store
+        self._files: List[str] = []
+        self._maps: Dict[int, mmap.mmap] = {}
+        self._handles: Dict[int, object] = {}
+        # (índice do arquivo, início, fim); fim None = arquivo inteiro
+        self._spans: List[Tuple[int, int, Optional[int]]] = []
+        self._index()
+
+    # --- índice ---
+    def _index(self):
+        if os.path.isdir(self.path):
+            if is_maildir(self.path):
+                for sub in ('cur', 'new'):
+                    folder = os.path.join(self.path, sub)
+                    if os.path.isdir(folder):
+                        # nomes do Maildir começam pelo timestamp de entrega
+                        for name in sorted(os.listdir(folder)):
+                            if not name.startswith('.'):
+                                self._add_message_file(os.path.join(folder, name))
+            else:
+                for name in sorted(os.listdir(self.path)):
+                    full = os.path.join(self.path, name)
+                    if os.path.isfile(full) and name.lower().endswith(MBOX_EXTS):
+                        self._add_mbox(full)
+                    elif os.path.isfile(full) and name.lower().endswith(EML_EXTS):
+                        self._add_message_file(full)
+        elif self.path.lower().endswith(EML_EXTS):
+            self._add_message_file(self.path)
+        else:
+            self._add_mbox(self.path)
+        log.info("%s: %d emails em %d arquivo(s)", self.path, len(self._spans), len(self._files))
+
+    def _add_message_file(self, path: str):
+        self._files.append(path)
+        self._spans.append((len(self._files) - 1, 0, None))
+
+    def _add_mbox(self, path: str):
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        self._files.append(path)
+        idx = len(self._files) - 1
+        fh = open(path, 'rb')
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._handles[idx] = fh
+        self._maps[idx] = mm
+        self._spans.extend((idx, start, end) for start, end in mbox_spans(mm, size))
+
+    def _buffer(self, uid: str) -> Tuple[object, int, int]:
+        """(buffer, início, fim) da mensagem: o próprio mmap do .mbox, sem cópia,
+        ou o conteúdo de um arquivo de mensagem avulso."""
+        idx, start, end = self._spans[int(uid) - 1]
+        mm = self._maps.get(idx)
+        if mm is None:
+            with open(self._files[idx], 'rb') as f:
+                data = f.read()
+            return data, 0, len(data)
+        return mm, start, end
+
+    def _raw(self, uid: str, headers_only: bool = False) -> bytes:
+        buf, start, end = self._buffer(uid)
+        if headers_only:
+            end = header_end(buf, start, end)
+        return buf[start:end]
+
+    def _uids_newest_first(self, limit: int) -> List[str]:
+        total = len(self._spans)
+        return [str(i) for i in range(total, max(0, total - int(limit)), -1)]
+
+    # --- interface do GmailClient ---
+    def connect(self):
+        pass
+
+    def disconnect(self):
+        pass
+
+    def close(self):
+        """Libera os mapeamentos de memória e os arquivos abertos."""
+        for mm in self._maps.values():
+            mm.close()
+        for fh in self._handles.values():
+            fh.close()
+        self._maps.clear()
+        self._handles.clear()
+
+    def count_inbox(self) -> int:
+        return len(self._spans)
+
+    def sync_mailbox(self) -> Dict:
+        """O arquivo não muda enquanto está aberto."""
+        return {'changed': True, 'messages': len(self._spans), 'new': [], 'flags': [], 'vanished': []}
+
+    def has_gmail_extensions(self) -> bool:
+        return False
+
+    def list_recent(self, limit: int = 10, result_callback: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+        """Mesmo contrato de GmailClient.list_recent (só os cabeçalhos são lidos)."""
+        results: List[Dict] = []
+        for uid in self._uids_newest_first(limit):
+            try:
+                item = GmailClient._header_item(uid, email.message_from_bytes(self._raw(uid, headers_only=True)))
+            except Exception:
+                continue
+            results.append(item)
+            if result_callback:
+                try:
+                    result_callback(item)
+                except Exception:
+                    pass
+        return results
+
+    def search_notes(
+        self,
+        note_types,
+        limit: int,
+        include_keywords: List[str],
+        exclude_keywords: List[str],
+        progress_cb: Optional[Callable[[int, int], None]] = None,
+        result_callback: Optional[Callable[[Dict], None]] = None,
+        cancel_check: Optional[Callable[[], bool]] = None,
+        server_filter: bool = True,
+        skip_processed: bool = False,
+        prioritize_senders: bool = False,
+        skip_negative_senders: bool = False,
+        max_results: int = 0,
+        since: Optional[date] = None,
+        before: Optional[date] = None,
+    ) -> List[Dict]:
+        """Mesmo contrato de GmailClient.search_notes; as opções de servidor e de
+        histórico de remetentes são ignoradas (todas as mensagens são examinadas
+        localmente, na velocidade do disco). since/before usam o cabeçalho Date,
+        já que o arquivo não guarda a data de recebimento."""
+        if isinstance(note_types, str):
+            types_set = {note_types.upper()}
+        else:
+            types_set = {t.upper() for t in (note_types or [])}
+        if not types_set:
+            types_set = {"PDF", "XML"}
+        target_exts = set()
+        if "PDF" in types_set:
+            target_exts.add('.pdf')
+        if "XML" in types_set:
+            target_exts.add('.xml')
+
+        include, exclude = KeywordMatcher(include_keywords), KeywordMatcher(exclude_keywords)
+        to_scan = self._uids_newest_first(limit)
+        total = len(to_scan)
+        log.info("Buscando em %d emails de %s", total, self.path)
+        results: List[Dict] = []
+        for idx, uid in enumerate(to_scan, start=1):
+            if cancel_check and cancel_check():
+                log.info("Busca cancelada pelo usuário após %d/%d emails", idx - 1, total)
+                break
+            if max_results and len(results) >= max_results:
+                log.info("Limite de %d anexos atingido após %d/%d emails", max_results, idx - 1, total)
+                break
+            if progress_cb:
+                progress_cb(idx, total)
+            try:
+                # varredura MIME direto no mmap: só os cabeçalhos das partes são lidos
+                header, attachments = GmailClient._scan_raw(uid, *self._buffer(uid))
+            except Exception:
+                continue
+            if since or before:
+                day = message_day(header['date'])
+                if day is None or (since and day < since.isoformat()) or (before and day >= before.isoformat()):
+                    continue
+            GmailClient._match_attachments(uid, header, attachments, target_exts,
+                                           include, exclude, results, result_callback)
+        return results
+
+    def download_attachments(self, selections: List[Dict], download_dir: str,
+                             progress_cb: Optional[Callable[[int, int], None]] = None,
+                             cancel_check: Optional[Callable[[], bool]] = None) -> List[Dict]:
+        """Mesmo contrato de GmailClient.download_attachments."""
+        os.makedirs(download_dir, exist_ok=True)
+        by_uid: Dict[str, List[Dict]] = {}
+        for s in selections:
+            by_uid.setdefault(str(s['uid']), []).append(s)
+        local_names = unique_names([(str(s['uid']), s['filename']) for s in selections if s.get('filename')])
+        out: List[Dict] = []
+        total = len(by_uid)
+        for i, (uid, sels) in enumerate(by_uid.items(), start=1):
+            if cancel_check and cancel_check():
+                log.info("Extração cancelada pelo usuário após %d/%d emails", i - 1, total)
+                break
+            wanted = {s['filename'] for s in sels if s.get('filename')}
+            types_map = {s['filename']: s.get('type', '') for s in sels}
+            names = {fname: local_names.get((uid, fname), fname) for fname in wanted}
+            try:
+                buf, start, end = self._buffer(uid)
+                saved = GmailClient._save_from_raw(uid, buf, wanted, types_map, download_dir, names, start, end)
+            except Exception as e:
+                log.warning("Falha ao extrair anexos do email %s: %s", uid, e)
+                saved = []
+            if self.store is not None:
+                for item in saved:
+                    try:
+                        item['sha256'] = self.store.add(item['path'])
+                    except OSError:
+                        pass
+            out.extend(saved)
+            if progress_cb:
+                progress_cb(i, total)
+        return out
+
+    def mark_processed(self, uids: List[str]) -> int:
+        """O arquivo é somente leitura: nada é marcado."""
+        return 0
+
+    def fetch_email(self, uid: str) -> Dict:
+        """Mesmo contrato de GmailClient.fetch_email."""
+        try:
+            msg = email.message_from_bytes(self._raw(uid))
+        except (IndexError, ValueError, OSError) as e:
+            raise RuntimeError(f'Erro ao ler email: {e}')
+        return GmailClient._email_dict(uid, msg)
@@ -0,0 +1,268 @@
+"""Cache local (SQLite) de metadados de emails já examinados.
+
+Cada mensagem é identificada por (conta, pasta, UIDVALIDITY, UID): enquanto o
+servidor mantiver o mesmo UIDVALIDITY, um UID sempre aponta para a mesma
+mensagem, então cabeçalhos e lista de anexos podem ser reaproveitados. Quando
+o UIDVALIDITY muda, tudo daquela pasta é descartado.
+
+Também guarda o resultado dos filtros por assinatura (tipos + palavras-chave),
+para que uma busca repetida não precise reavaliar nem baixar nada, e o estado
+da última sincronização (UIDNEXT, HIGHESTMODSEQ...) com os UIDs devolvidos por
+cada SEARCH naquele estado. Os resultados por assinatura são gravados durante
+a busca, então uma busca cancelada ou interrompida não reexamina o que já viu.
+
+O histórico de remetentes (por conta, independente do UIDVALIDITY) conta
+quantos emails de cada endereço foram examinados e quantos trouxeram anexos
+aceitos, para que a busca examine primeiro os fornecedores conhecidos.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+from email.utils import parseaddr, parsedate_to_datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from modules.app_paths import app_path
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS mailboxes (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uidvalidity INTEGER NOT NULL,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS messages (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    attachments TEXT,
+    PRIMARY KEY (account, mailbox, uid)
+);
+CREATE TABLE IF NOT EXISTS outcomes (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    uid INTEGER NOT NULL,
+    signature TEXT NOT NULL,
+    accepted TEXT NOT NULL,
+    PRIMARY KEY (account, mailbox, signature, uid)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    state TEXT NOT NULL,
+    PRIMARY KEY (account, mailbox)
+);
+CREATE TABLE IF NOT EXISTS senders (
+    account TEXT NOT NULL,
+    address TEXT NOT NULL,
+    scanned INTEGER NOT NULL DEFAULT 0,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_seen TEXT,
+    last_hit TEXT,
+    PRIMARY KEY (account, address)
+);
+CREATE TABLE IF NOT EXISTS searches (
+    account TEXT NOT NULL,
+    mailbox TEXT NOT NULL,
+    query TEXT NOT NULL,
+    state TEXT NOT NULL,
+    uids TEXT NOT NULL,
+    PRIMARY KEY (account, mailbox, query)
+);
+"""
+
+# SQLite limita a quantidade de parâmetros por consulta
+_IN_CHUNK = 500
+
+
+def filter_signature(target_exts: Iterable[str], include_keywords: List[str],
+                     exclude_keywords: List[str]) -> str:
+    """Identificador estável de um conjunto de filtros de busca."""
+    payload = json.dumps([sorted(target_exts or []), list(include_keywords or []),
+                          list(exclude_keywords or [])], ensure_ascii=False)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def sender_address(from_header: str) -> str:
+    """Endereço do remetente em minúsculas ('' se não houver)."""
+    return (parseaddr(from_header or '')[1] or '').strip().lower()
+
+
+def message_day(date_header: str) -> Optional[str]:
+    """Data do cabeçalho Date em ISO (AAAA-MM-DD), ou None se ilegível."""
+    try:
+        return parsedate_to_datetime(date_header).date().isoformat()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class MailCache:
+    """Cache SQLite thread-safe; uma instância pode ser compartilhada por vários clientes."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or app_path('mail_cache.sqlite3')
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.executescript(_SCHEMA)
+        self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def clear(self):
+        """Apaga todo o conteúdo do cache."""
+        with self._lock:
+            self._db.executescript('DELETE FROM mailboxes; DELETE FROM messages; DELETE FROM outcomes; '
+                                   'DELETE FROM sync_state; DELETE FROM searches; '
+                                   'DELETE FROM senders;')
+            self._db.commit()
+
+    def validate(self, account: str, mailbox: str, uidvalidity: int) -> bool:
+        """Registra o UIDVALIDITY atual; se mudou, descarta a pasta. Retorna True se o cache continua válido."""
+        with self._lock:
+            row = self._db.execute('SELECT uidvalidity FROM mailboxes WHERE account=? AND mailbox=?',
+                                   (account, mailbox)).fetchone()
+            if row is not None and row[0] == int(uidvalidity):
+                return True
+            for table in ('messages', 'outcomes'):
+                self._db.execute(f'DELETE FROM {table} WHERE account=? AND mailbox=?', (account, mailbox))
+            self._db.execute('INSERT OR REPLACE INTO mailboxes (account, mailbox, uidvalidity) VALUES (?, ?, ?)',
+                             (account, mailbox, int(uidvalidity)))
+            self._db.commit()
+            return row is None
+
+    def _select_in(self, sql: str, params: Tuple, uids: List[str]) -> List[tuple]:
+        rows: List[tuple] = []
+        with self._lock:
+            for i in range(0, len(uids), _IN_CHUNK):
+                chunk = [int(u) for u in uids[i:i + _IN_CHUNK]]
+                marks = ','.join('?' * len(chunk))
+                rows.extend(self._db.execute(sql.format(marks=marks), params + tuple(chunk)).fetchall())
+        return rows
+
+    def get_headers(self, account: str, mailbox: str, uids: List[str]) -> Dict[str, Dict]:
+        """{uid: {uid, subject, from, date}} para os UIDs já conhecidos."""
+        rows = self._select_in('SELECT uid, subject, sender, date FROM messages '
+                               'WHERE account=? AND mailbox=? AND uid IN ({marks})', (account, mailbox), uids)
+        return {str(r[0]): {'uid': str(r[0]), 'subject': r[1], 'from': r[2], 'date': r[3]} for r in rows}
+
+    def get_messages(self, account: str, mailbox: str,
+                     uids: List[str]) -> Dict[str, Tuple[Dict, List[Tuple[str, str]]]]:
+        """{uid: (cabeçalhos, [(filename, content_type)])} para UIDs com anexos já listados."""
+        rows = self._select_in('SELECT uid, subject, sender, date, attachments FROM messages '
+                               'WHERE account=? AND mailbox=? AND attachments IS NOT NULL AND uid IN ({marks})',
+                               (account, mailbox), uids)
+        out = {}
+        for uid, subject, sender, date, attachments in rows:
+            header = {'uid': str(uid), 'subject': subject, 'from': sender, 'date': date}
+            out[str(uid)] = (header, [tuple(a) for a in json.loads(attachments)])
+        return out
+
+    def put_headers(self, account: str, mailbox: str, headers: List[Dict]):
+        """Grava cabeçalhos sem apagar a lista de anexos já conhecida."""
+        with self._lock:
+            self._db.executemany(
+                'INSERT INTO messages (account, mailbox, uid, subject, sender, date) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (account, mailbox, uid) DO UPDATE SET '
+                'subject=excluded.subject, sender=excluded.sender, date=excluded.date',
+                [(account, mailbox, int(h['uid']), h['subject'], h['from'], h['date']) for h in headers])
+            self._db.commit()
+
+    def put_messages(self, account: str, mailbox: str,
+                     messages: List[Tuple[Dict, List[Tuple[str, str]]]]):
+        """Grava cabeçalhos e lista de anexos (filename, content_type)."""
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO messages (account, mailbox, uid, subject, sender, date, attachments) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(account, mailbox, int(h['uid']), h['subject'], h['from'], h['date'],
+                  json.dumps([list(a) for a in atts], ensure_ascii=False)) for h, atts in messages])
+            self._db.commit()
+
+    def get_outcomes(self, account: str, mailbox: str, signature: str, uids: List[str]) -> Dict[str, List[Dict]]:
+        """{uid: [resultados aceitos]} dos UIDs já avaliados com estes filtros ([] = rejeitado)."""
+        rows = self._select_in('SELECT uid, accepted FROM outcomes WHERE account=? AND mailbox=? '
+                               'AND signature=? AND uid IN ({marks})', (account, mailbox, signature), uids)
+        return {str(uid): json.loads(accepted) for uid, accepted in rows}
+
+    def put_outcomes(self, account: str, mailbox: str, signature: str, outcomes: Dict[str, List[Dict]]):
+        with self._lock:
+            self._db.executemany(
+                'INSERT OR REPLACE INTO outcomes (account, mailbox, uid, signature, accepted) VALUES (?, ?, ?, ?, ?)',
+                [(account, mailbox, int(uid), signature, json.dumps(items, ensure_ascii=False))
+                 for uid, items in outcomes.items()])
+            self._db.commit()
+
+    def forget(self, account: str, mailbox: str, uids: List[int]):
+        """Remove UIDs expurgados no servidor (VANISHED)."""
+        if not uids:
+            return
+        with self._lock:
+            for table in ('messages', 'outcomes'):
+                self._db.executemany(f'DELETE FROM {table} WHERE account=? AND mailbox=? AND uid=?',
+                                     [(account, mailbox, int(u)) for u in uids])
+            self._db.commit()
+
+    def get_state(self, account: str, mailbox: str) -> Optional[Dict[str, int]]:
+        with self._lock:
+            row = self._db.execute('SELECT state FROM sync_state WHERE account=? AND mailbox=?',
+                                   (account, mailbox)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_state(self, account: str, mailbox: str, state: Dict[str, int]):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO sync_state (account, mailbox, state) VALUES (?, ?, ?)',
+                             (account, mailbox, json.dumps(state, sort_keys=True)))
+            self._db.commit()
+
+    def record_senders(self, account: str, stats: Dict[str, Dict]):
+        """Soma ao histórico {endereço: {scanned, hits, last_seen, last_hit}} de uma busca."""
+        if not stats:
+            return
+        with self._lock:
+            self._db.executemany(
+                'INSERT INTO senders (account, address, scanned, hits, last_seen, last_hit) VALUES (?, ?, ?, ?, ?, ?) '
+                'ON CONFLICT (account, address) DO UPDATE SET '
+                'scanned=scanned+excluded.scanned, hits=hits+excluded.hits, '
+                'last_seen=MAX(COALESCE(last_seen, excluded.last_seen), COALESCE(excluded.last_seen, last_seen)), '
+                'last_hit=MAX(COALESCE(last_hit, excluded.last_hit), COALESCE(excluded.last_hit, last_hit))',
+                [(account, addr, st.get('scanned', 0), st.get('hits', 0), st.get('last_seen'), st.get('last_hit'))
+                 for addr, st in stats.items() if addr])
+            self._db.commit()
+
+    def top_senders(self, account: str, limit: int = 200) -> List[str]:
+        """Remetentes que já trouxeram anexos aceitos, dos mais frequentes e recentes aos demais."""
+        with self._lock:
+            rows = self._db.execute('SELECT address FROM senders WHERE account=? AND hits > 0 '
+                                    'ORDER BY hits DESC, last_hit DESC LIMIT ?', (account, int(limit))).fetchall()
+        return [r[0] for r in rows]
+
+    def negative_senders(self, account: str, min_scanned: int = 20, limit: int = 200) -> List[str]:
+        """Remetentes com pelo menos `min_scanned` emails examinados e nenhum anexo aceito."""
+        with self._lock:
+            rows = self._db.execute('SELECT address FROM senders WHERE account=? AND hits = 0 AND scanned >= ? '
+                                    'ORDER BY scanned DESC LIMIT ?', (account, int(min_scanned), int(limit))).fetchall()
+        return [r[0] for r in rows]
+
+    def get_search(self, account: str, mailbox: str, query: str, state: str) -> Optional[List[str]]:
+        """UIDs de uma busca feita com a caixa exatamente neste estado, se houver."""
+        with self._lock:
+            row = self._db.execute('SELECT uids FROM searches WHERE account=? AND mailbox=? AND query=? AND state=?',
+                                   (account, mailbox, query, state)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put_search(self, account: str, mailbox: str, query: str, state: str, uids: List[str]):
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO searches (account, mailbox, query, state, uids) '
+                             'VALUES (?, ?, ?, ?, ?)', (account, mailbox, query, state, json.dumps(uids)))
+            self._db.commit()
+
+    def clear_searches(self, account: str, mailbox: str):
+        """Descarta as buscas memorizadas da pasta (ex.: depois de mudar flags nela)."""
+        with self._lock:
+            self._db.execute('DELETE FROM searches WHERE account=? AND mailbox=?', (account, mailbox))
+            self._db.commit()
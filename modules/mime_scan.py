@@ -0,0 +1,155 @@
+"""Varredura leve de mensagens MIME brutas para listar anexos.
+
+Em vez de montar um email.message.Message completo (que decodifica cabeçalhos e
+cria objetos para cada parte, inclusive imagens de vários MB), percorre os
+bytes pelas linhas de boundary e só interpreta os cabeçalhos de cada parte
+(Content-Type, Content-Disposition, Content-Transfer-Encoding). Cada anexo
+sai com os offsets do conteúdo bruto, então o arquivo pode ser extraído
+depois fatiando os bytes e decodificando só aquela parte.
+
+Funciona sobre bytes ou mmap (ver modules.mail_archive): nada além dos
+cabeçalhos é copiado. O critério de anexo é o mesmo de
+GmailClient._iter_message_attachments e a numeração das seções segue o
+BODYSTRUCTURE (1, 2.1, ...). Corpos message/delivery-status e
+message/external-body não são desmontados (nunca trazem anexos).
+"""
+from email.message import Message
+from email.parser import BytesHeaderParser
+from typing import Dict, List, Optional, Tuple
+
+from modules.mime_structure import decode_transfer_encoding
+
+# Partes aninhadas além disso são ignoradas (mensagem malformada/maliciosa)
+MAX_DEPTH = 20
+
+_header_parser = BytesHeaderParser()
+
+
+def header_end(buf, start: int, end: int) -> int:
+    """Offset logo após a linha em branco que encerra o cabeçalho em buf[start:end]
+    (end se não houver corpo). Cabeçalho vazio: a parte começa com a linha em branco."""
+    if buf[start:start + 1] == b'\n':
+        return start + 1
+    if buf[start:start + 2] == b'\r\n':
+        return start + 2
+    lf = buf.find(b'\n\n', start, end)
+    crlf = buf.find(b'\r\n\r\n', start, end)
+    cands = [i for i in (lf + 2 if lf >= 0 else -1, crlf + 4 if crlf >= 0 else -1) if i >= 0]
+    return min(cands) if cands else end
+
+
+def parse_headers(buf, start: int = 0, end: Optional[int] = None) -> Tuple[Message, int]:
+    """(cabeçalhos como Message sem corpo, offset do início do corpo)."""
+    end = len(buf) if end is None else end
+    body = header_end(buf, start, end)
+    return _header_parser.parsebytes(bytes(buf[start:body])), body
+
+
+def _is_delimiter(buf, pos: int, line_start: int, end: int, delim: bytes) -> bool:
+    if pos != line_start and buf[pos - 1:pos] != b'\n':
+        return False
+    after = buf[pos + len(delim):pos + len(delim) + 2]
+    return after == b'--' or after[:1] in (b'\r', b'\n', b' ', b'\t', b'') or pos + len(delim) >= end
+
+
+def split_parts(buf, start: int, end: int, boundary: str) -> Tuple[List[Tuple[int, int]], bool]:
+    """[(início, fim)] de cada parte entre as linhas --boundary de buf[start:end].
+    O fim exclui a quebra de linha que antecede o delimitador seguinte.
+    O segundo valor indica se o delimitador final (--boundary--) foi encontrado."""
+    delim = b'--' + boundary.encode('latin-1', errors='replace')
+    parts: List[Tuple[int, int]] = []
+    pos = buf.find(delim, start, end)
+    while pos >= 0 and not _is_delimiter(buf, pos, start, end, delim):
+        pos = buf.find(delim, pos + 1, end)
+    while pos >= 0:
+        if buf[pos + len(delim):pos + len(delim) + 2] == b'--':
+            return parts, True
+        line_end = buf.find(b'\n', pos, end)
+        if line_end < 0:
+            break
+        part_start = line_end + 1
+        nxt = buf.find(delim, part_start, end)
+        while nxt >= 0 and not _is_delimiter(buf, nxt, start, end, delim):
+            nxt = buf.find(delim, nxt + 1, end)
+        if nxt == part_start:
+            # delimitadores seguidos: parte vazia, ignorada como no parser do email
+            pos = nxt
+            continue
+        part_end = end if nxt < 0 else nxt
+        if nxt >= 0 and part_end > part_start:
+            # a quebra de linha antes do delimitador pertence ao delimitador
+            part_end -= 1
+            if part_end > part_start and buf[part_end - 1:part_end] == b'\r':
+                part_end -= 1
+        parts.append((part_start, max(part_start, part_end)))
+        pos = nxt
+    return parts, False
+
+
+def _part_info(hdr: Message, section: str, start: int, end: int) -> Dict:
+    return {
+        'filename': hdr.get_filename() or '',
+        'content_type': (hdr.get_content_type() or '').lower(),
+        'section': section,
+        'encoding': str(hdr.get('Content-Transfer-Encoding') or '7bit').strip().lower(),
+        'disposition': str(hdr.get('Content-Disposition') or '').lower(),
+        'start': start,
+        'end': end,
+        'size': end - start,
+    }
+
+
+def _walk(buf, hdr: Message, body: int, end: int, section: str, depth: int, out: List[Dict]):
+    """Percorre a parte (já com cabeçalhos lidos) na ordem de Message.walk()."""
+    out.append(_part_info(hdr, section, body, end))
+    if depth >= MAX_DEPTH:
+        return
+    if hdr.get_content_maintype() == 'multipart':
+        boundary = hdr.get_boundary()
+        if not boundary:
+            return
+        parts, _ = split_parts(buf, body, end, boundary)
+        digest = hdr.get_content_subtype() == 'digest'
+        for n, (pstart, pend) in enumerate(parts, start=1):
+            phdr, pbody = parse_headers(buf, pstart, pend)
+            if digest:
+                # em multipart/digest o tipo padrão das partes é message/rfc822
+                phdr.set_default_type('message/rfc822')
+            _walk(buf, phdr, pbody, pend, f"{section}.{n}" if section else str(n), depth + 1, out)
+    elif (hdr.get_content_type() or '').lower() == 'message/rfc822' and body < end:
+        # a mensagem encapsulada também aparece no walk(); como no BODYSTRUCTURE,
+        # as partes de um corpo interno multipart são N.1, N.2... e um corpo simples é N.1
+        inner, ibody = parse_headers(buf, body, end)
+        inner_section = section if inner.get_content_maintype() == 'multipart' else f"{section}.1"
+        _walk(buf, inner, ibody, end, inner_section, depth + 1, out)
+
+
+def scan_message(buf, start: int = 0, end: Optional[int] = None) -> Tuple[Message, List[Dict]]:
+    """(cabeçalhos da mensagem, todas as partes na ordem de Message.walk()).
+    Cada parte: {filename, content_type, section, encoding, disposition, start, end, size},
+    com start/end delimitando o conteúdo bruto (ainda codificado) da parte em buf."""
+    end = len(buf) if end is None else end
+    hdr, body = parse_headers(buf, start, end)
+    parts: List[Dict] = []
+    _walk(buf, hdr, body, end, '' if hdr.get_content_maintype() == 'multipart' else '1', 0, parts)
+    return hdr, parts
+
+
+def attachments_from_parts(parts: List[Dict], multipart: bool) -> List[Dict]:
+    """Mesmo critério de GmailClient._iter_message_attachments: em mensagens
+    multipart, partes com disposition 'attachment'; em mensagens simples, a
+    própria mensagem se tiver nome de arquivo."""
+    if multipart:
+        return [p for p in parts if 'attachment' in p['disposition']]
+    return [p for p in parts[:1] if p['filename']]
+
+
+def scan_attachments(buf, start: int = 0, end: Optional[int] = None) -> Tuple[Message, List[Dict]]:
+    """(cabeçalhos da mensagem, anexos com offsets) sem decodificar nenhum conteúdo."""
+    hdr, parts = scan_message(buf, start, end)
+    return hdr, attachments_from_parts(parts, hdr.get_content_maintype() == 'multipart')
+
+
+def part_payload(buf, part: Dict) -> bytes:
+    """Conteúdo decodificado de uma parte, fatiado direto pelos offsets."""
+    return decode_transfer_encoding(bytes(buf[part['start']:part['end']]), part['encoding'])
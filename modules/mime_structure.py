@@ -0,0 +1,185 @@
+"""Leitura de BODYSTRUCTURE (RFC 3501) para descobrir anexos sem baixar o corpo.
+
+A árvore vem de modules.imap_response.parse_fetch_response já convertida em
+listas aninhadas. Cada anexo encontrado é descrito por um dict com o nome,
+content-type, número da seção MIME (ex.: '2.1'), transfer-encoding e tamanho.
+"""
+import base64
+import binascii
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+
+# Content-Transfer-Encoding que sabemos decodificar localmente
+TRANSFER_ENCODINGS = ('base64', 'quoted-printable', '7bit', '8bit', 'binary')
+
+
+def _params(value: Any) -> Dict[str, str]:
+    out: Dict[str, str] = {}
+    if isinstance(value, list):
+        for i in range(0, len(value) - 1, 2):
+            k, v = value[i], value[i + 1]
+            if isinstance(k, (str, bytes)):
+                k = k.decode('latin-1') if isinstance(k, bytes) else k
+                if isinstance(v, bytes):
+                    v = v.decode('utf-8', errors='ignore')
+                out[k.lower()] = v if v is not None else ''
+    return out
+
+
+def _rfc2231(params: Dict[str, str], name: str) -> Optional[str]:
+    """Lê um parâmetro simples, RFC 2231 (name*) ou com continuações (name*0*)."""
+    if name in params:
+        return params[name]
+    if f'{name}*' in params:
+        return _decode_2231(params[f'{name}*'], True)
+    pieces = []
+    i = 0
+    while True:
+        if f'{name}*{i}*' in params:
+            pieces.append((params[f'{name}*{i}*'], True))
+        elif f'{name}*{i}' in params:
+            pieces.append((params[f'{name}*{i}'], False))
+        else:
+            break
+        i += 1
+    if not pieces:
+        return None
+    first, encoded = pieces[0]
+    charset = 'utf-8'
+    if encoded and first.count("'") >= 2:
+        charset, _, first = first.split("'", 2)
+        pieces[0] = (first, True)
+    raw = ''.join(unquote(p, encoding=charset or 'utf-8', errors='ignore') if enc else p for p, enc in pieces)
+    return raw
+
+
+def _decode_2231(value: str, encoded: bool) -> str:
+    if encoded and value.count("'") >= 2:
+        charset, _, text = value.split("'", 2)
+        return unquote(text, encoding=charset or 'utf-8', errors='ignore')
+    return unquote(value) if encoded else value
+
+
+def _is_multipart(node: Any) -> bool:
+    return isinstance(node, list) and bool(node) and isinstance(node[0], list)
+
+
+def _leaf_info(node: List, section: str) -> Dict:
+    ctype = f"{node[0] or ''}/{node[1] or ''}".lower()
+    params = _params(node[2] if len(node) > 2 else None)
+    encoding = str(node[5] or '7bit').lower() if len(node) > 5 else '7bit'
+    try:
+        size = int(node[6]) if len(node) > 6 and node[6] is not None else 0
+    except (TypeError, ValueError):
+        size = 0
+    # posição da extensão depende do tipo (text/* tem linhas; message/rfc822 tem envelope+body+linhas)
+    ext = 7
+    if ctype.startswith('text/'):
+        ext = 8
+    elif ctype == 'message/rfc822':
+        ext = 10
+    disposition = None
+    disp_params: Dict[str, str] = {}
+    if len(node) > ext + 1 and isinstance(node[ext + 1], list) and node[ext + 1]:
+        disp = node[ext + 1]
+        disposition = str(disp[0] or '').lower()
+        disp_params = _params(disp[1] if len(disp) > 1 else None)
+    filename = _rfc2231(disp_params, 'filename') or _rfc2231(params, 'name') or ''
+    return {
+        'filename': filename,
+        'content_type': ctype,
+        'section': section,
+        'encoding': encoding,
+        'size': size,
+        'charset': params.get('charset', ''),
+        'disposition': disposition or '',
+    }
+
+
+def walk_bodystructure(node: Any, prefix: str = '') -> List[Dict]:
+    """Lista todas as partes folha com seus números de seção."""
+    out: List[Dict] = []
+    if _is_multipart(node):
+        n = 0
+        for child in node:
+            if not isinstance(child, list):
+                break
+            n += 1
+            out.extend(walk_bodystructure(child, f"{prefix}.{n}" if prefix else str(n)))
+        return out
+    if not isinstance(node, list) or len(node) < 2:
+        return out
+    section = prefix or '1'
+    info = _leaf_info(node, section)
+    out.append(info)
+    # mensagem encapsulada: desce no corpo interno (seções N.1, N.2 ...)
+    if info['content_type'] == 'message/rfc822' and len(node) > 8 and isinstance(node[8], list):
+        inner = node[8]
+        if _is_multipart(inner):
+            out.extend(walk_bodystructure(inner, section))
+        else:
+            out.extend(walk_bodystructure(inner, f"{section}.1"))
+    return out
+
+
+def attachments_from_bodystructure(bodystructure: Any) -> List[Dict]:
+    """Mesmo critério de GmailClient._iter_message_attachments, a partir do BODYSTRUCTURE.
+    Em mensagens multipart, só partes com disposition 'attachment';
+    em mensagens simples, qualquer parte com nome de arquivo.
+    """
+    if not isinstance(bodystructure, list) or not bodystructure:
+        raise ValueError('BODYSTRUCTURE inválido')
+    parts = walk_bodystructure(bodystructure)
+    if _is_multipart(bodystructure):
+        return [p for p in parts if 'attachment' in p['disposition']]
+    return [p for p in parts[:1] if p['filename']]
+
+
+def decode_transfer_encoding(data: bytes, encoding: str) -> bytes:
+    """Decodifica o conteúdo bruto de uma seção MIME (BODY[n]) conforme o transfer-encoding."""
+    encoding = (encoding or '7bit').lower()
+    if encoding == 'base64':
+        try:
+            return base64.b64decode(data)
+        except (binascii.Error, ValueError):
+            # padding incompleto: completa e tenta de novo
+            clean = b''.join(data.split())
+            return base64.b64decode(clean + b'=' * (-len(clean) % 4))
+    if encoding == 'quoted-printable':
+        return binascii.a2b_qp(data)
+    return data
+
+
+class TransferDecoder:
+    """Decodificação incremental de base64/quoted-printable, em blocos.
+    write() recebe pedaços do conteúdo bruto e devolve o que já pode ser
+    decodificado; flush() devolve o restante no fim da seção.
+    """
+
+    def __init__(self, encoding: str):
+        self.encoding = (encoding or '7bit').lower()
+        self._pending = b''
+
+    def write(self, chunk: bytes) -> bytes:
+        if self.encoding == 'base64':
+            data = self._pending + b''.join(chunk.split())
+            cut = len(data) - len(data) % 4
+            self._pending = data[cut:]
+            return binascii.a2b_base64(data[:cut]) if cut else b''
+        if self.encoding == 'quoted-printable':
+            # só linhas completas: "=\r\n" (quebra suave) precisa estar inteiro
+            data = self._pending + chunk
+            cut = data.rfind(b'\n') + 1
+            self._pending = data[cut:]
+            return binascii.a2b_qp(data[:cut]) if cut else b''
+        return chunk
+
+    def flush(self) -> bytes:
+        data, self._pending = self._pending, b''
+        if not data:
+            return b''
+        if self.encoding == 'base64':
+            return decode_transfer_encoding(data + b'=' * (-len(data) % 4), 'base64')
+        if self.encoding == 'quoted-printable':
+            return binascii.a2b_qp(data)
+        return data
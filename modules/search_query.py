@@ -0,0 +1,134 @@
+"""Planejador de consultas IMAP SEARCH a partir dos filtros da busca.
+
+Só vão ao servidor critérios cujo resultado o filtro local também aceitaria:
+as palavras de exclusão (NOT SUBJECT/NOT FROM, só ASCII), a marca de
+processado e as datas. As palavras de inclusão ficam só no filtro local: ele
+ignora acentos e maiúsculas ('eletronica' acha 'Eletrônica') e casa trechos,
+enquanto o SUBJECT do servidor compara o texto exato e, no Gmail, palavras
+inteiras, então um OR SUBJECT/FROM descartaria emails que o filtro local aceita.
+"""
+import re
+from datetime import date, datetime
+from typing import List, Optional
+
+# Marca de email já processado (ver GmailClient.mark_processed): palavra-chave
+# IMAP nos servidores em geral e rótulo no Gmail, visível também na interface web
+PROCESSED_KEYWORD = '$SimpleNFEDone'
+PROCESSED_LABEL = 'SimpleNFE-Processado'
+
+
+def imap_quote(value: str) -> str:
+    """Retorna a string entre aspas, escapando '\\' e '"' (RFC 3501)."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _or_tree(terms: List[str]) -> str:
+    # OR no IMAP é binário: OR a OR b c
+    if len(terms) == 1:
+        return terms[0]
+    return f"OR {terms[0]} {_or_tree(terms[1:])}"
+
+
+def exclude_criteria(exclude_keywords: List[str]) -> List[str]:
+    """NOT SUBJECT/NOT FROM para palavras de exclusão puramente ASCII.
+    Palavras com acento ficam de fora: excluir no servidor precisa ser exato."""
+    out: List[str] = []
+    seen = set()
+    for kw in exclude_keywords or []:
+        kw = (kw or '').strip()
+        if not kw or not re.fullmatch(r'[\x20-\x7e]+', kw) or kw.lower() in seen:
+            continue
+        seen.add(kw.lower())
+        out.append(f"NOT SUBJECT {imap_quote(kw)}")
+        out.append(f"NOT FROM {imap_quote(kw)}")
+    return out
+
+
+# Meses do formato de data do IMAP (independente do locale, ao contrário de strftime('%b'))
+_MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+def parse_day(text: str) -> Optional[date]:
+    """Data digitada como AAAA-MM-DD ou DD/MM/AAAA; None se vazia.
+    Levanta ValueError se o texto não for uma data."""
+    text = (text or '').strip()
+    if not text:
+        return None
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f'Data inválida: {text} (use AAAA-MM-DD ou DD/MM/AAAA)')
+
+
+def imap_date(day: date) -> str:
+    """Data no formato do SEARCH (RFC 3501): 05-Oct-2026."""
+    return f"{day.day:02d}-{_MONTHS[day.month - 1]}-{day.year}"
+
+
+def date_criteria(since: Optional[date] = None, before: Optional[date] = None) -> List[str]:
+    """SINCE/BEFORE pela data de recebimento (INTERNALDATE); `before` é exclusivo."""
+    out: List[str] = []
+    if since:
+        out.append(f"SINCE {imap_date(since)}")
+    if before:
+        out.append(f"BEFORE {imap_date(before)}")
+    return out
+
+
+def sender_criteria(addresses: List[str]) -> Optional[str]:
+    """OR FROM ... para uma lista de endereços (None se vazia)."""
+    terms = [f"FROM {imap_quote(a)}" for a in addresses if a and re.fullmatch(r'[\x21-\x7e]+', a)]
+    if not terms:
+        return None
+    return f"({_or_tree(terms)})" if len(terms) > 1 else terms[0]
+
+
+def build_search_criteria(exclude_keywords: List[str]) -> List[str]:
+    """Monta a lista de critérios (combinados por AND) para UID SEARCH.
+    As palavras de inclusão não entram (ver o início do módulo)."""
+    return exclude_criteria(exclude_keywords)
+
+
+def _gmail_term(value: str) -> str:
+    value = (value or '').strip().replace('"', '')
+    if not value:
+        return ''
+    return f'"{value}"' if re.search(r'[\s(){}:-]', value) else value
+
+
+def processed_criteria(gmail: bool) -> List[str]:
+    """Critério que deixa de fora os emails já marcados como processados:
+    UNKEYWORD $SimpleNFEDone, ou -label:SimpleNFE-Processado via X-GM-RAW no Gmail."""
+    if gmail:
+        return ['X-GM-RAW', imap_quote(f'-label:{PROCESSED_LABEL}')]
+    return [f'UNKEYWORD {PROCESSED_KEYWORD}']
+
+
+def gmail_raw_query(target_exts, exclude_keywords: List[str], skip_processed: bool = False,
+                    since: Optional[date] = None, before: Optional[date] = None) -> str:
+    """Consulta na sintaxe de busca do Gmail (X-GM-RAW), por exemplo:
+    has:attachment filename:(xml OR pdf) -subject:promo -from:promo
+    A busca do Gmail casa palavras inteiras ('nfe' não acha 'NFe123'), e o filtro
+    local casa trechos: as palavras de inclusão ficam só no filtro local para
+    não perder candidatos. As de exclusão podem ir ao servidor, porque o que a
+    palavra inteira exclui o trecho também excluiria.
+    Com skip_processed, acrescenta -label:SimpleNFE-Processado; since/before
+    viram after:/before: (AAAA/MM/DD).
+    """
+    parts = ['has:attachment']
+    exts = sorted(e.lstrip('.') for e in target_exts or [])
+    if exts:
+        parts.append('filename:(' + ' OR '.join(exts) + ')' if len(exts) > 1 else f'filename:{exts[0]}')
+    for kw in exclude_keywords or []:
+        term = _gmail_term(kw)
+        if term:
+            parts.extend([f'-subject:{term}', f'-from:{term}'])
+    if skip_processed:
+        parts.append(f'-label:{PROCESSED_LABEL}')
+    if since:
+        parts.append(f'after:{since:%Y/%m/%d}')
+    if before:
+        parts.append(f'before:{before:%Y/%m/%d}')
+    return ' '.join(parts)
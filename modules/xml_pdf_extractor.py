@@ -1,7 +1,13 @@
 import os
 import re
 import json
-from typing import List, Dict, Tuple
+import logging
+from typing import List, Dict, Optional, Tuple
+
+from modules.app_logging import get_logger
+
+log = get_logger('PDF')
+llm_log = get_logger('LLM')
 
 # PDF text extraction (optional dependencies)
 
@@ -13,7 +19,7 @@ def _extract_text_pdfminer(path: str) -> str:
         text = ''.join(char for char in text if char.isprintable() or char in '\n\r\t')
         return text.strip()
     except Exception as e:
-        print(f"Erro pdfminer: {e}")
+        log.debug("Erro pdfminer: %s", e)
         return ""
 
 
@@ -32,38 +38,39 @@ def _extract_text_pypdf(path: str) -> str:
             combined = ''.join(char for char in combined if char.isprintable() or char in '\n\r\t')
             return combined.strip()
     except Exception as e:
-        print(f"Erro PyPDF2: {e}")
+        log.debug("Erro PyPDF2: %s", e)
         return ""
 
 
 def extract_text_from_pdf(path: str) -> str:
     """Extrai texto de PDF com fallback entre múltiplas bibliotecas"""
-    print(f"[PDF] Tentando extrair de: {os.path.basename(path)}")
+    log.debug("Tentando extrair de: %s", os.path.basename(path))
     
     # Tenta pdfminer primeiro (melhor qualidade)
     text = _extract_text_pdfminer(path)
     if text and len(text.strip()) > 50:
-        print(f"[PDF] Extraído via pdfminer: {len(text)} caracteres")
+        log.debug("Extraído via pdfminer: %d caracteres", len(text))
         return text
     
     # Fallback para PyPDF2
     text = _extract_text_pypdf(path)
     if text and len(text.strip()) > 50:
-        print(f"[PDF] Extraído via PyPDF2: {len(text)} caracteres")
+        log.debug("Extraído via PyPDF2: %d caracteres", len(text))
         return text
     
     # Se falhou, pode ser PDF escaneado (imagem)
-    print(f"[PDF] AVISO: PDF pode ser escaneado (imagem) - OCR não implementado")
-    print(f"[PDF] Sugestão: Use ferramenta de OCR ou converta para PDF pesquisável")
+    log.warning("%s pode ser escaneado (imagem) - OCR não implementado; "
+                "use ferramenta de OCR ou converta para PDF pesquisável", os.path.basename(path))
     
     return text
 
 
 # XML NFe extraction
 
-def extract_items_from_xml(path: str) -> List[Dict]:
+def extract_items_from_xml(path: str) -> Optional[List[Dict]]:
     """Extrai itens de uma NFe XML (NFe/NF-e padrão SEFAZ).
     Campos: descricao (xProd), quantidade (qCom), valor_unit (vUnCom), valor_total (vProd)
+    Retorna None se o arquivo não puder ser lido/parseado (diferente de uma nota sem itens).
     """
     import xml.etree.ElementTree as ET
 
@@ -75,8 +82,9 @@ def extract_items_from_xml(path: str) -> List[Dict]:
     try:
         tree = ET.parse(path)
         root = tree.getroot()
-    except Exception:
-        return []
+    except Exception as e:
+        log.warning("XML inválido %s: %s", os.path.basename(path), e)
+        return None
 
     # Tenta encontrar det/prod em caminhos comuns
     det_nodes = []
@@ -121,28 +129,26 @@ def extract_items_from_pdf_via_llm(pdf_text: str, lm_url: str, model: str) -> Li
     """
     import requests  # type: ignore
 
-    print(f"[DEBUG] Iniciando extração via LM Studio")
-    print(f"[DEBUG] URL: {lm_url}, Modelo: {model}")
-    print(f"[DEBUG] Tamanho do texto PDF: {len(pdf_text)} caracteres")
+    llm_log.debug("Iniciando extração via LM Studio (URL: %s, modelo: %s, %d caracteres)",
+                  lm_url, model, len(pdf_text or ''))
 
     if not pdf_text or len(pdf_text.strip()) < 50:
-        print(f"[DEBUG] Texto muito curto, retornando vazio")
+        llm_log.debug("Texto muito curto, retornando vazio")
         raise Exception(f"Texto do PDF muito curto ({len(pdf_text)} caracteres)")
 
     # Testa conexão primeiro
     try:
-        print(f"[DEBUG] Testando conexão com LM Studio...")
+        llm_log.debug("Testando conexão com LM Studio...")
         test_response = requests.get(f"{lm_url}/v1/models", timeout=5)
-        print(f"[DEBUG] LM Studio respondeu: {test_response.status_code}")
-        if test_response.status_code == 200:
-            models = test_response.json()
-            print(f"[DEBUG] Modelos disponíveis: {models}")
+        llm_log.debug("LM Studio respondeu: %s", test_response.status_code)
+        if test_response.status_code == 200 and llm_log.isEnabledFor(logging.DEBUG):
+            llm_log.debug("Modelos disponíveis: %s", test_response.json())
     except requests.exceptions.ConnectionError:
         raise Exception(f"LM Studio NÃO está rodando em {lm_url}. Inicie o servidor Local Server na porta 1234.")
     except requests.exceptions.Timeout:
         raise Exception(f"LM Studio não respondeu em {lm_url}. Servidor pode estar travado.")
     except Exception as e:
-        print(f"[DEBUG] Aviso ao testar conexão: {e}")
+        llm_log.warning("Aviso ao testar conexão: %s", e)
 
     system = (
         "Você é um assistente especializado em extração de dados de DANFE (nota fiscal eletrônica). "
@@ -170,26 +176,25 @@ def extract_items_from_pdf_via_llm(pdf_text: str, lm_url: str, model: str) -> Li
     }
 
     try:
-        print(f"[DEBUG] Enviando requisição para {lm_url}/v1/chat/completions")
-        print(f"[DEBUG] Aguardando resposta (SEM TIMEOUT - aguarde o modelo terminar)...")
+        llm_log.debug("Enviando requisição para %s/v1/chat/completions (sem timeout)", lm_url)
         r = requests.post(f"{lm_url}/v1/chat/completions", json=payload, timeout=None)
-        print(f"[DEBUG] Status code: {r.status_code}")
+        llm_log.debug("Status code: %s", r.status_code)
         
         if r.status_code != 200:
-            print(f"[DEBUG] Erro HTTP {r.status_code}: {r.text[:500]}")
+            llm_log.error("Erro HTTP %s: %s", r.status_code, r.text[:500])
             raise Exception(f"LM Studio retornou erro {r.status_code}: {r.text[:200]}")
             
         r.raise_for_status()
         data = r.json()
-        print(f"[DEBUG] Resposta recebida do LM Studio")
+        llm_log.debug("Resposta recebida do LM Studio")
         
         # Tenta extrair content ou reasoning
         msg = data.get('choices', [{}])[0].get('message', {})
         content = msg.get('content', '').strip()
         reasoning = msg.get('reasoning', '').strip()
         
-        print(f"[DEBUG] Content ({len(content)} caracteres): {content[:500]}...")
-        print(f"[DEBUG] Reasoning ({len(reasoning)} caracteres): {reasoning[:500]}...")
+        llm_log.debug("Content (%d caracteres): %.500s...", len(content), content)
+        llm_log.debug("Reasoning (%d caracteres): %.500s...", len(reasoning), reasoning)
         
         # Prefere content, mas usa reasoning se content vazio
         text_to_parse = content if content else reasoning
@@ -197,29 +202,27 @@ def extract_items_from_pdf_via_llm(pdf_text: str, lm_url: str, model: str) -> Li
         if not text_to_parse:
             raise Exception("LM Studio retornou resposta vazia (sem content nem reasoning)")
         
-        print(f"[DEBUG] Usando {'content' if content else 'reasoning'} para parsing")
-            
-        print(f"[DEBUG] Usando {'content' if content else 'reasoning'} para parsing")
+        llm_log.debug("Usando %s para parsing", 'content' if content else 'reasoning')
             
         # tenta parsear JSON
         try:
             parsed = json.loads(text_to_parse)
-            print(f"[DEBUG] JSON parseado com sucesso")
+            llm_log.debug("JSON parseado com sucesso")
         except Exception as e:
-            print(f"[DEBUG] Falha ao parsear JSON direto: {e}")
+            llm_log.debug("Falha ao parsear JSON direto: %s", e)
             # tenta extrair bloco JSON do reasoning/content
             m = re.search(r'\{[\s\S]*?"items"[\s\S]*?\[[\s\S]*?\][\s\S]*?\}', text_to_parse)
             if not m:
-                print(f"[DEBUG] Texto completo para análise: {text_to_parse[:2000]}")
+                llm_log.debug("Texto completo para análise: %.2000s", text_to_parse)
                 raise Exception(f"Não foi possível extrair JSON da resposta. Texto: {text_to_parse[:300]}...")
             try:
                 parsed = json.loads(m.group(0))
-                print(f"[DEBUG] JSON extraído e parseado com sucesso")
+                llm_log.debug("JSON extraído e parseado com sucesso")
             except Exception as e2:
                 raise Exception(f"Falha ao parsear JSON extraído: {e2}. JSON: {m.group(0)[:300]}")
                 
         items = parsed.get('items', [])
-        print(f"[DEBUG] Itens extraídos: {len(items)}")
+        llm_log.debug("Itens extraídos: %d", len(items))
         
         if not items:
             raise Exception(f"LM Studio retornou 0 itens. Resposta: {str(parsed)[:500]}")
@@ -238,14 +241,14 @@ def extract_items_from_pdf_via_llm(pdf_text: str, lm_url: str, model: str) -> Li
                 'valor_unit': _f(it.get('valor_unit', 0)),
                 'valor_total': _f(it.get('valor_total', 0)),
             })
-        print(f"[DEBUG] {len(norm_items)} itens normalizados com sucesso")
+        llm_log.debug("%d itens normalizados com sucesso", len(norm_items))
         return norm_items
     except requests.exceptions.ConnectionError as e:
-        print(f"[DEBUG] Erro de conexão: {e}")
+        llm_log.error("Erro de conexão: %s", e)
         raise Exception("LM Studio não está rodando ou não está acessível em " + lm_url)
     except requests.exceptions.Timeout:
-        print(f"[DEBUG] Timeout (não deveria acontecer com timeout=None)")
+        llm_log.error("Timeout (não deveria acontecer com timeout=None)")
         raise Exception("Timeout ao aguardar resposta do LM Studio. Isso é inesperado.")
     except Exception as e:
-        print(f"[DEBUG] Erro geral: {type(e).__name__}: {e}")
+        llm_log.error("Erro geral: %s: %s", type(e).__name__, e)
         raise Exception(f"Erro ao chamar LM Studio: {str(e)}")